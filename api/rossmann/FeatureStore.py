@@ -0,0 +1,141 @@
+import pandas as pd
+import numpy  as np
+import datetime
+import hashlib
+import json
+import os
+
+class FeatureStore( object ):
+    # Model features ( Rossmann.cols_selected ) of a store x date grid persisted in path:
+    #   features.f32  - float32 memmap [dates, stores, features], the values data_preparation gives to the model
+    #   open.u8       - uint8 memmap [dates, stores], open flag of the grid calendar
+    #   manifest.json - stores, first date, days, feature names and sha256 of the parameter files used to build it
+    # Slices by stores and dates read only the pages of the requested days through the memmap.
+    def __init__( self, path ):
+        self.path     = path
+        self.manifest = None
+
+        if os.path.exists( os.path.join( path, 'manifest.json' ) ):
+            self.load()
+
+    def checksums( self, pipeline ):
+        # sha256 of the scaler files and of the store file of the pipeline
+        checksums = pipeline.parameter_checksums()
+        if pipeline.path_store:
+            with open( pipeline.path_store, 'rb' ) as f:
+                checksums[os.path.basename( pipeline.path_store )] = hashlib.sha256( f.read() ).hexdigest()
+
+        return checksums
+
+    def build( self, pipeline, stores=None, start=None, end=None, calendars=None, chunk_days=28 ):
+        # features of the grid ( Rossmann.make_grid ) computed chunk_days days at a time and written to the memmaps;
+        # every cell gets features, closed days only have open = 0
+        stores = np.sort( pipeline.store_ids() if stores is None else np.asarray( stores, dtype=np.int64 ) )
+        dates  = pd.date_range( start, end, freq='D' )
+        shape  = ( len( dates ), len( stores ), len( pipeline.cols_selected ) )
+
+        os.makedirs( self.path, exist_ok=True )
+        features = np.memmap( os.path.join( self.path, 'features.f32' ), dtype=np.float32, mode='w+', shape=shape )
+        is_open  = np.memmap( os.path.join( self.path, 'open.u8' ), dtype=np.uint8, mode='w+', shape=shape[:2] )
+
+        for i in range( 0, len( dates ), chunk_days ):
+            days = dates[i:i + chunk_days]
+            grid = pipeline.make_grid( stores, days[0], days[-1], calendars )
+
+            is_open[i:i + len( days )] = ( grid['open'].to_numpy() != 0 ).reshape( len( days ), len( stores ) )
+            grid['open'] = 1
+
+            features[i:i + len( days )] = pipeline.lean_features( grid ).to_numpy().reshape( len( days ), len( stores ), shape[2] )
+
+        features.flush()
+        is_open.flush()
+        del features, is_open
+
+        manifest = { 'stores'     : stores.tolist(),
+                     'start'      : dates[0].strftime( '%Y-%m-%d' ),
+                     'days'       : len( dates ),
+                     'features'   : list( pipeline.cols_selected ),
+                     'dtype'      : 'float32',
+                     'parameters' : self.checksums( pipeline ),
+                     'created'    : datetime.datetime.now().isoformat( timespec='seconds' ) }
+
+        # the manifest is written last: a feature store without manifest is incomplete
+        with open( os.path.join( self.path, 'manifest.json.tmp' ), 'w' ) as f:
+            json.dump( manifest, f, indent=2 )
+
+        os.replace( os.path.join( self.path, 'manifest.json.tmp' ), os.path.join( self.path, 'manifest.json' ) )
+
+        return self.load()
+
+    def load( self ):
+        with open( os.path.join( self.path, 'manifest.json' ) ) as f:
+            self.manifest = json.load( f )
+
+        self.stores = np.array( self.manifest['stores'], dtype=np.int64 )
+        self.start  = np.datetime64( self.manifest['start'], 'D' )
+        shape       = ( self.manifest['days'], len( self.stores ), len( self.manifest['features'] ) )
+
+        self.features = np.memmap( os.path.join( self.path, 'features.f32' ), dtype=np.float32, mode='r', shape=shape )
+        self.is_open  = np.memmap( os.path.join( self.path, 'open.u8' ), dtype=np.uint8, mode='r', shape=shape[:2] )
+
+        return self
+
+    def check( self, pipeline ):
+        # the features are only valid for the parameter files they were built with
+        checksums = self.checksums( pipeline )
+        changed   = [ f for f in set( checksums ) | set( self.manifest['parameters'] ) if checksums.get( f ) != self.manifest['parameters'].get( f ) ]
+        if changed:
+            raise ValueError( 'feature store {} was built with other parameters: {}'.format( self.path, sorted( changed ) ) )
+
+        return None
+
+    def positions( self, stores, start, end ):
+        # store positions and day range of a slice, None = every store / first or last day
+        if self.manifest is None:
+            raise ValueError( 'feature store {} is not built'.format( self.path ) )
+
+        store_pos = np.arange( len( self.stores ) )
+        if stores is not None:
+            stores    = np.asarray( stores, dtype=np.int64 )
+            store_pos = np.minimum( np.searchsorted( self.stores, stores ), len( self.stores ) - 1 )
+            if ( self.stores[store_pos] != stores ).any():
+                raise ValueError( 'stores not in the feature store: {}'.format( list( stores[self.stores[store_pos] != stores] ) ) )
+
+        first = 0 if start is None else int( ( np.datetime64( pd.Timestamp( start ).date(), 'D' ) - self.start ).astype( np.int64 ) )
+        last  = self.manifest['days'] - 1 if end is None else int( ( np.datetime64( pd.Timestamp( end ).date(), 'D' ) - self.start ).astype( np.int64 ) )
+        if first < 0 or last >= self.manifest['days'] or first > last:
+            raise ValueError( 'dates out of the feature store range: {} + {} days'.format( self.manifest['start'], self.manifest['days'] ) )
+
+        return store_pos, first, last
+
+    def slice( self, stores=None, start=None, end=None ):
+        # ( keys, features ) of stores x [start, end], day by day: keys has store, date and open, features the model columns
+        store_pos, first, last = self.positions( stores, start, end )
+
+        features = self.features[first:last + 1]
+        is_open  = self.is_open[first:last + 1]
+        if stores is not None:
+            features = features[:, store_pos]
+            is_open  = is_open[:, store_pos]
+
+        days = last - first + 1
+        keys = pd.DataFrame( { 'store' : np.tile( self.stores[store_pos], days ),
+                               'date'  : np.repeat( self.start + np.arange( first, last + 1 ), len( store_pos ) ),
+                               'open'  : np.asarray( is_open ).reshape( -1 ) } )
+
+        features = pd.DataFrame( np.asarray( features ).reshape( -1, len( self.manifest['features'] ) ), columns=self.manifest['features'] )
+
+        return keys, features
+
+    def predict( self, model, stores=None, start=None, end=None ):
+        # read -> slice -> predict: store, date, open and sales_predictions ( NaN for closed days )
+        keys, features = self.slice( stores, start, end )
+
+        pred   = np.full( len( keys ), np.nan )
+        opened = keys['open'].to_numpy() != 0
+        if opened.any():
+            pred[opened] = np.expm1( model.predict( features[opened] ) )
+
+        keys['sales_predictions'] = pred
+
+        return keys
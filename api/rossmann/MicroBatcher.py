@@ -0,0 +1,85 @@
+import pandas as pd
+
+import threading
+import queue
+import time
+import os
+
+class MicroBatcher( object ):
+    # Collects small prediction requests for up to max_wait seconds or max_rows rows and predicts them as one batch.
+    # predict( df ) receives the concatenated frames and returns them with the sales_predictions column.
+    def __init__( self, predict, max_wait=0.005, max_rows=1000 ):
+        self.predict  = predict
+        self.max_wait = max_wait
+        self.max_rows = max_rows
+        self.start()
+
+        # threads do not survive fork: forked children ( ex: rossmann_prefork.py workers ) start their own
+        if hasattr( os, 'register_at_fork' ):
+            os.register_at_fork( after_in_child=self.start )
+
+    def start( self ):
+        self.queue  = queue.Queue()
+        self.thread = threading.Thread( target=self.run, name='micro-batcher', daemon=True )
+        self.thread.start()
+
+        return None
+
+    def submit( self, df ):
+        # called by the request thread, blocks until the batch with df is predicted
+        item = { 'df': df, 'done': threading.Event(), 'result': None, 'error': None }
+        self.queue.put( item )
+        item['done'].wait()
+
+        if item['error'] is not None:
+            raise item['error']
+
+        return item['result']
+
+    def run( self ):
+        while True:
+            # the first request opens the window
+            items    = [ self.queue.get() ]
+            rows     = len( items[0]['df'] )
+            deadline = time.perf_counter() + self.max_wait
+
+            while rows < self.max_rows:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+
+                try:
+                    item = self.queue.get( timeout=timeout )
+
+                except queue.Empty:
+                    break
+
+                items.append( item )
+                rows += len( item['df'] )
+
+            self.process( items )
+
+    def process( self, items ):
+        try:
+            df   = pd.concat( [ item['df'] for item in items ], ignore_index=True )
+            pred = self.predict( df )['sales_predictions'].to_numpy()
+
+            offset = 0
+            for item in items:
+                item['result'] = pred[offset:offset + len( item['df'] )]
+                offset += len( item['df'] )
+
+        except Exception as e:
+            # a bad request must not fail the others of the batch: predict them one by one
+            if len( items ) > 1:
+                for item in items:
+                    self.process( [item] )
+
+                return None
+
+            items[0]['error'] = e
+
+        for item in items:
+            item['done'].set()
+
+        return None
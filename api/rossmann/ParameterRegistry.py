@@ -0,0 +1,88 @@
+import pickle
+import threading
+import glob
+import time
+
+from api.rossmann.Rossmann     import Rossmann
+from api.rossmann.TreeEnsemble import TreeEnsemble
+
+class ParameterRegistry( object ):
+    # Holds the model and the Rossmann pipeline (scalers, store table) loaded once per process.
+    # Requests take a snapshot with get() and keep using it until they finish, so reload() can swap
+    # to a new parameter set at any moment without affecting in-flight requests.
+    # backend 'numpy' evaluates the model with TreeEnsemble instead of xgboost; a .npz path_model ( TreeEnsemble.save )
+    # is always loaded as a TreeEnsemble, without pickle. low_memory is passed to the Rossmann pipeline.
+    # default_path_model / default_path_store: paths of the deployment, used when path_model / path_store are not set
+    default_path_model = '/home/datamendes/comunidadeds/projetos/rossmann_store_sales/model/model_rossmann.pkl'
+    default_path_store = '/home/datamendes/comunidadeds/projetos/rossmann_store_sales/data/store.csv'
+
+    def __init__( self, path_model, path_params=None, path_store=None, warm_up=None, backend='xgboost', low_memory=False ):
+        self.path_model  = path_model
+        self.path_params = path_params
+        self.path_store  = path_store
+        self.warm_up     = warm_up
+        self.backend     = backend
+        self.low_memory  = low_memory
+        self.version     = 0
+        self.params      = None
+        self.lock        = threading.Lock()
+
+    def load( self ):
+        start = time.perf_counter()
+
+        model           = self.load_model()
+        model_load_time = time.perf_counter() - start
+
+        pipeline  = Rossmann( self.path_params, self.path_store, low_memory=self.low_memory )
+        load_time = time.perf_counter() - start
+
+        # optional warm-up prediction, so the first request does not pay for lazy initializations
+        warm_up_time = None
+        if self.warm_up is not None:
+            start = time.perf_counter()
+            pipeline.predict_frame( model, self.warm_up.copy() )
+            warm_up_time = time.perf_counter() - start
+
+        # model_load_time includes the imports of the model libraries ( xgboost, scikit-learn ) on the first load
+        return { 'model': model, 'pipeline': pipeline, 'load_time': load_time, 'model_load_time': model_load_time,
+                 'pipeline_load_time': load_time - model_load_time, 'warm_up_time': warm_up_time }
+
+    def load_model( self ):
+        if self.path_model.endswith( '.npz' ):
+            return TreeEnsemble( path=self.path_model )
+
+        with open( self.path_model, 'rb' ) as f:
+            model = pickle.load( f )
+
+        if self.backend == 'numpy':
+            model = TreeEnsemble( model )
+
+        return model
+
+    def reload( self ):
+        # only one reload at a time; the new parameter set is fully loaded before the swap
+        with self.lock:
+            params = self.load()
+            params['version'] = self.version + 1
+            params['loaded_at'] = time.time()
+
+            self.params  = params
+            self.version = params['version']
+
+        return params
+
+    def get( self ):
+        if self.params is None:
+            self.reload()
+
+        return self.params
+
+    def files( self ):
+        # files of the parameter set ( model, scalers, store table ), to detect changes on disk
+        pipeline = self.get()['pipeline']
+        files    = [ self.path_model ] + sorted( glob.glob( pipeline.path_params + '*.pkl' ) )
+
+        if self.path_store:
+            files.append( self.path_store )
+
+        return files
@@ -0,0 +1,65 @@
+import threading
+
+class PipelineMetrics( object ):
+    # Histograms of the prediction requests ( latency per pipeline stage, rows, payload bytes, peak memory ),
+    # rendered in the Prometheus text format by render().
+    seconds_buckets = [ 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0 ]
+    rows_buckets    = [ 1, 10, 100, 1000, 10000, 50000, 100000, 1000000 ]
+    bytes_buckets   = [ 1e3, 1e4, 1e5, 1e6, 1e7, 1e8, 1e9 ]
+
+    histograms = { 'rossmann_stage_seconds'              : ( 'Seconds per pipeline stage', seconds_buckets ),
+                   'rossmann_request_rows'               : ( 'Rows per prediction request', rows_buckets ),
+                   'rossmann_request_bytes'              : ( 'Request payload bytes', bytes_buckets ),
+                   'rossmann_response_bytes'             : ( 'Response payload bytes', bytes_buckets ),
+                   'rossmann_request_peak_memory_bytes'  : ( 'Peak traced memory per request', bytes_buckets ) }
+
+    def __init__( self ):
+        self.lock   = threading.Lock()
+        # ( name, label ) -> [ bucket counts, sum, count ]
+        self.series = {}
+
+    def observe( self, name, value, label=None ):
+        buckets = self.histograms[name][1]
+
+        with self.lock:
+            series = self.series.setdefault( ( name, label ), [ [0] * len( buckets ), 0.0, 0 ] )
+            for i, bound in enumerate( buckets ):
+                if value <= bound:
+                    series[0][i] += 1
+
+            series[1] += value
+            series[2] += 1
+
+        return None
+
+    def observe_request( self, timings, rows=None, request_bytes=None, response_bytes=None, peak_memory=None ):
+        for stage, seconds in timings.items():
+            self.observe( 'rossmann_stage_seconds', seconds, 'stage="{}"'.format( stage ) )
+
+        for name, value in [ ( 'rossmann_request_rows', rows ), ( 'rossmann_request_bytes', request_bytes ),
+                             ( 'rossmann_response_bytes', response_bytes ), ( 'rossmann_request_peak_memory_bytes', peak_memory ) ]:
+            if value is not None:
+                self.observe( name, value )
+
+        return None
+
+    def render( self ):
+        lines = []
+        with self.lock:
+            for name, ( help_text, buckets ) in self.histograms.items():
+                lines.append( '# HELP {} {}'.format( name, help_text ) )
+                lines.append( '# TYPE {} histogram'.format( name ) )
+
+                for ( series_name, label ), ( counts, total, count ) in sorted( self.series.items(), key=lambda x: ( x[0][0], x[0][1] or '' ) ):
+                    if series_name != name:
+                        continue
+
+                    prefix = label + ',' if label else ''
+                    for bound, bucket_count in zip( buckets, counts ):
+                        lines.append( '{}_bucket{{{}le="{:g}"}} {}'.format( name, prefix, bound, bucket_count ) )
+
+                    lines.append( '{}_bucket{{{}le="+Inf"}} {}'.format( name, prefix, count ) )
+                    lines.append( '{}_sum{} {}'.format( name, '{' + label + '}' if label else '', total ) )
+                    lines.append( '{}_count{} {}'.format( name, '{' + label + '}' if label else '', count ) )
+
+        return '\n'.join( lines ) + '\n'
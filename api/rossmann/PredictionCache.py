@@ -0,0 +1,146 @@
+import pandas as pd
+import numpy  as np
+
+import collections
+import threading
+import time
+import os
+
+class PredictionCache( object ):
+    # Predictions per row, keyed by a hash of the model relevant input columns, so batches that partially
+    # overlap previous ones only predict the new rows. LRU eviction bounded by max_mb, entries expire after ttl seconds.
+    # The cache is cleared when the fingerprint of the model/parameter files changes.
+    # version: parameter set ( ParameterRegistry version ) of the cached predictions, clear( version ) moves to a new one;
+    # get and put of a request that took its parameters before the change are misses and dropped writes
+
+    # approximate memory of one entry: ordered dict node + int key + ( prediction, expiration ) tuple
+    entry_bytes = 200
+
+    def __init__( self, key_columns, max_mb=64, ttl=3600, files=(), check_interval=1.0, version=None ):
+        self.key_columns    = key_columns
+        self.max_entries    = int( max_mb * 1024 * 1024 // self.entry_bytes )
+        self.ttl            = ttl
+        self.files          = list( files )
+        self.check_interval = check_interval
+        self.version        = version
+
+        self.entries     = collections.OrderedDict()
+        self.lock        = threading.Lock()
+        self.fingerprint = self.files_fingerprint()
+        self.checked_at  = time.monotonic()
+
+        self.counters = { 'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0, 'invalidations': 0, 'stale_writes': 0 }
+
+    def files_fingerprint( self ):
+        fingerprint = []
+        for path in self.files:
+            try:
+                stat = os.stat( path )
+                fingerprint.append( ( path, stat.st_mtime_ns, stat.st_size ) )
+
+            except OSError:
+                fingerprint.append( ( path, None, None ) )
+
+        return fingerprint
+
+    def keys( self, df ):
+        # canonical values: dates as datetime64, numbers as float64 ( 1 and 1.0 are the same ), everything else as text
+        # state_holiday as the pipeline reads it: a, b, c or a regular day ( 0, 0.0 and '0' are the same )
+        canonical = {}
+        for col in self.key_columns:
+            if col == 'date':
+                canonical[col] = pd.to_datetime( df[col] ).to_numpy()
+
+            elif col == 'state_holiday':
+                holiday = df[col].isin( ['a', 'b', 'c'] ).to_numpy()
+                canonical[col] = np.where( holiday, df[col].to_numpy( dtype=str ), '0' )
+
+            elif pd.api.types.is_numeric_dtype( df[col] ):
+                canonical[col] = df[col].to_numpy( dtype=np.float64 )
+
+            else:
+                canonical[col] = df[col].to_numpy( dtype=str )
+
+        return pd.util.hash_pandas_object( pd.DataFrame( canonical ), index=False ).to_numpy()
+
+    def validate( self ):
+        # clears the cache when the model/parameter files changed, checked at most once per check_interval seconds
+        now = time.monotonic()
+        if now - self.checked_at < self.check_interval:
+            return None
+
+        self.checked_at = now
+        fingerprint = self.files_fingerprint()
+        if fingerprint != self.fingerprint:
+            self.clear()
+            self.fingerprint = fingerprint
+
+        return None
+
+    def clear( self, version=None ):
+        with self.lock:
+            self.entries.clear()
+            self.counters['invalidations'] += 1
+            if version is not None:
+                self.version = version
+
+        return None
+
+    def get( self, keys, version=None ):
+        # predictions of the cached keys and the mask of the keys found ( none for another version )
+        self.validate()
+
+        pred = np.full( len( keys ), np.nan )
+        hit  = np.zeros( len( keys ), dtype=bool )
+        now  = time.monotonic()
+
+        with self.lock:
+            if version is not None and version != self.version:
+                self.counters['misses'] += len( keys )
+                return pred, hit
+
+            for i, key in enumerate( keys.tolist() ):
+                entry = self.entries.get( key )
+                if entry is None:
+                    continue
+
+                if entry[1] < now:
+                    del self.entries[key]
+                    self.counters['expirations'] += 1
+                    continue
+
+                self.entries.move_to_end( key )
+                pred[i] = entry[0]
+                hit[i]  = True
+
+            self.counters['hits']   += int( hit.sum() )
+            self.counters['misses'] += int( len( keys ) - hit.sum() )
+
+        return pred, hit
+
+    def put( self, keys, pred, version=None ):
+        # predictions of another version ( parameters taken before a reload ) are not stored
+        expires = time.monotonic() + self.ttl
+
+        with self.lock:
+            if version is not None and version != self.version:
+                self.counters['stale_writes'] += 1
+                return None
+
+            for key, value in zip( keys.tolist(), pred.tolist() ):
+                self.entries[key] = ( value, expires )
+                self.entries.move_to_end( key )
+
+            while len( self.entries ) > self.max_entries:
+                self.entries.popitem( last=False )
+                self.counters['evictions'] += 1
+
+        return None
+
+    def stats( self ):
+        with self.lock:
+            stats = dict( self.counters )
+            stats['entries']     = len( self.entries )
+            stats['max_entries'] = self.max_entries
+
+        return stats
@@ -1,57 +1,339 @@
 import pickle
-import inflection
 import pandas as pd
 import numpy as np
-import math
-import datetime
+import hashlib
+import zipfile
+import json
+import time
+import io
 import os
 
 class Rossmann( object ):
-    def __init__(self):
-        self.path_params = os.environ.get( 'path_params', '/home/datamendes/comunidadeds/projetos/rossmann_store_sales/parameters/')
-        self.competition_distance_scaler   = pickle.load( open( self.path_params + 'competition_distance_scaler.pkl', 'rb' ) )
-        self.promo2_time_week_scaler       = pickle.load( open( self.path_params + 'promo2_time_week_scaler.pkl', 'rb' ) )
-        self.competition_time_month_scaler = pickle.load( open( self.path_params + 'competition_time_month_scaler.pkl', 'rb' ) )
-        self.store_type_scaler             = pickle.load( open( self.path_params + 'store_type_scaler.pkl', 'rb' ) )
-        self.year_scaler                   = pickle.load( open( self.path_params + 'year_scaler.pkl', 'rb' ) )
+    # attributes of data/store.csv, in the order of the full payload
+    store_columns = ['store_type', 'assortment', 'competition_distance', 'competition_open_since_month', 'competition_open_since_year',
+                     'promo2', 'promo2_since_week', 'promo2_since_year', 'promo_interval']
+
+    # columns of the full payload ( test.csv without sales ), in the order expected by data_cleaning
+    input_columns = ['store', 'day_of_week', 'date', 'customers', 'open', 'promo', 'state_holiday', 'school_holiday'] + store_columns
+
+    # name suffix of the npz mask arrays of the text columns with missing values
+    npz_missing_suffix = '__missing'
+
+    # columns of the compact payload, the store attributes are joined from the store table ( open and day_of_week optional )
+    compact_columns = ['store', 'date', 'promo', 'state_holiday', 'school_holiday']
+
+    # the same columns as named in the kaggle files ( train.csv, test.csv, store.csv )
+    raw_columns = ['Store', 'DayOfWeek', 'Date', 'Customers', 'Open', 'Promo', 'StateHoliday', 'SchoolHoliday', 'StoreType', 'Assortment', 'CompetitionDistance',
+                   'CompetitionOpenSinceMonth', 'CompetitionOpenSinceYear', 'Promo2', 'Promo2SinceWeek', 'Promo2SinceYear', 'PromoInterval']
+
+    # features of the model, in the training order
+    cols_selected = ['store', 'promo', 'store_type', 'assortment', 'competition_distance', 'competition_open_since_month',
+                     'competition_open_since_year', 'promo2', 'promo2_since_week', 'promo2_since_year', 'competition_time_month', 'promo2_time_week',
+                     'day_of_week_sin', 'day_of_week_cos', 'day_sin', 'day_cos', 'week_of_year_cos', 'month_cos']
+
+    # files of path_params loaded by the pipeline
+    parameter_files = ['competition_distance_scaler.pkl', 'promo2_time_week_scaler.pkl', 'competition_time_month_scaler.pkl',
+                       'store_type_scaler.pkl', 'year_scaler.pkl']
+
+    # optional snapshot of the frozen scalers in path_params, Rossmann( path_params ).save_scalers(): loaded instead of
+    # the pickled scalers ( while their checksums match ), so the process starts without importing scikit-learn
+    scalers_file = 'scalers.json'
+
+    # values of the compact payload columns of a generated grid ( make_grid ) without a calendar entry, except open on
+    # closed_weekdays ( monday = 0 ): stores are closed on sundays ( 6,497 of the 6,690 sunday rows of test.csv )
+    grid_defaults   = { 'promo': 0, 'state_holiday': '0', 'school_holiday': 0, 'open': 1 }
+    closed_weekdays = [6]
+
+    # low_memory: predict_frame builds the features with lean_features ( float32, no intermediate columns ) and
+    # join_store returns compact dtypes ( categoricals, float32, int8 )
+    def __init__( self, path_params=None, path_store=None, calendar_start='2013-01-01', calendar_end='2030-12-31', low_memory=False ):
+        self.path_params = path_params or os.environ.get( 'path_params', '/home/datamendes/comunidadeds/projetos/rossmann_store_sales/parameters/')
+        self.low_memory  = low_memory
+        self.path_store  = path_store
+
+        if not self.load_scalers():
+            self.competition_distance_scaler   = self.load_parameter( 'competition_distance_scaler.pkl' )
+            self.promo2_time_week_scaler       = self.load_parameter( 'promo2_time_week_scaler.pkl' )
+            self.competition_time_month_scaler = self.load_parameter( 'competition_time_month_scaler.pkl' )
+            self.store_type_scaler             = self.load_parameter( 'store_type_scaler.pkl' )
+            self.year_scaler                   = self.load_parameter( 'year_scaler.pkl' )
+            self.freeze_scalers()
+
+        # store-static attributes ( data/store.csv ), optional
+        self.store_table = self.load_store_table( path_store ) if path_store else None
+
+        # calendar features of every day between calendar_start and calendar_end
+        self.calendar = self.build_calendar( calendar_start, calendar_end )
+
+    def load_parameter( self, file_name ):
+        with open( self.path_params + file_name, 'rb' ) as f:
+            return pickle.load( f )
+
+    def freeze_scalers( self ):
+        # extract the fitted parameters once, inference never refits the scalers
+        # numerical columns: x_scaled = ( x - sub ) / div * mul + add
+        #   RobustScaler -> ( x - center_ ) / scale_
+        #   MinMaxScaler -> x * scale_ + min_
+        self.scaled_columns = ['promo2_time_week', 'competition_distance', 'competition_time_month', 'year']
+        scalers = [ self.promo2_time_week_scaler, self.competition_distance_scaler, self.competition_time_month_scaler, self.year_scaler ]
+
+        sub, div, mul, add = [], [], [], []
+        for scaler in scalers:
+            if hasattr( scaler, 'min_' ):
+                sub.append( 0.0 )
+                div.append( 1.0 )
+                mul.append( scaler.scale_[0] )
+                add.append( scaler.min_[0] )
+
+            else:
+                sub.append( 0.0 if scaler.center_ is None else scaler.center_[0] )
+                div.append( 1.0 if scaler.scale_  is None else scaler.scale_[0] )
+                mul.append( 1.0 )
+                add.append( 0.0 )
+
+        self.scaler_sub = np.array( sub )
+        self.scaler_div = np.array( div )
+        self.scaler_mul = np.array( mul )
+        self.scaler_add = np.array( add )
+
+        # store_type: label -> code lookup ( same codes of the LabelEncoder )
+        self.store_type_classes = pd.Index( self.store_type_scaler.classes_ )
+
+    def parameter_checksums( self ):
+        # sha256 of each parameter file
+        checksums = {}
+        for file_name in self.parameter_files:
+            with open( os.path.join( self.path_params, file_name ), 'rb' ) as f:
+                checksums[file_name] = hashlib.sha256( f.read() ).hexdigest()
+
+        return checksums
+
+    def save_scalers( self, path=None ):
+        # frozen scalers -> json ( path_params + scalers_file by default ), floats written with all their digits
+        scalers = { 'parameters'         : self.parameter_checksums(),
+                    'scaled_columns'     : self.scaled_columns,
+                    'sub'                : self.scaler_sub.tolist(),
+                    'div'                : self.scaler_div.tolist(),
+                    'mul'                : self.scaler_mul.tolist(),
+                    'add'                : self.scaler_add.tolist(),
+                    'store_type_classes' : self.store_type_classes.tolist() }
+
+        with open( path or os.path.join( self.path_params, self.scalers_file ), 'w' ) as f:
+            json.dump( scalers, f, indent=2 )
+
+        return None
+
+    def load_scalers( self ):
+        # frozen scalers from the snapshot, False when there is none or it was saved from other parameter files
+        path = os.path.join( self.path_params, self.scalers_file )
+        if not os.path.exists( path ):
+            return False
+
+        with open( path ) as f:
+            scalers = json.load( f )
+
+        if scalers['parameters'] != self.parameter_checksums():
+            return False
+
+        self.scaled_columns     = scalers['scaled_columns']
+        self.scaler_sub         = np.array( scalers['sub'] )
+        self.scaler_div         = np.array( scalers['div'] )
+        self.scaler_mul         = np.array( scalers['mul'] )
+        self.scaler_add         = np.array( scalers['add'] )
+        self.store_type_classes = pd.Index( scalers['store_type_classes'] )
+
+        return True
+
+
+    def load_store_table( self, path_store ):
+        # one array per store attribute, row i = i-th store of the file, plus an id -> row lookup array
+        df_store = pd.read_csv( path_store )
+        df_store = df_store.rename( columns=dict( zip( self.raw_columns, self.input_columns ) ) )
+
+        # competition_distance with NA values means "no competitor around", the same value of data_cleaning
+        df_store['competition_distance'] = df_store['competition_distance'].fillna( 200000 )
+
+        store_ids = df_store['store'].to_numpy()
+        store_row = np.full( store_ids.max() + 1, -1, dtype=np.int64 )
+        store_row[store_ids] = np.arange( len( store_ids ) )
+
+        store_columns = { col: df_store[col].to_numpy() for col in self.store_columns }
+
+        # compact dtypes of the low memory mode: text -> categorical, integers -> int16, numbers with NA -> float32 ( small integers, exact )
+        lean_columns = {}
+        for col, values in store_columns.items():
+            if values.dtype == object:
+                lean_columns[col] = pd.Categorical( values )
+
+            else:
+                lean_columns[col] = values.astype( np.int16 if values.dtype.kind == 'i' else np.float32 )
+
+        return { 'row': store_row, 'columns': store_columns, 'lean': lean_columns }
+
+    def join_store( self, df ):
+        # compact payload ( store, date, promo, state_holiday, school_holiday ) -> full payload layout,
+        # store attributes joined by store id array indexing
+        if self.store_table is None:
+            raise ValueError( 'store table is not loaded, the full payload is required' )
+
+        missing = [ col for col in self.compact_columns if col not in df.columns ]
+        if missing:
+            raise ValueError( 'the compact payload needs the columns {}, missing {}'.format( self.compact_columns, missing ) )
+
+        store_row = self.store_table['row']
+        store_ids = df['store'].to_numpy( dtype=np.int64 )
+
+        rows = np.full( len( store_ids ), -1, dtype=np.int64 )
+        known = ( store_ids >= 0 ) & ( store_ids < len( store_row ) )
+        rows[known] = store_row[store_ids[known]]
+        if ( rows < 0 ).any():
+            raise ValueError( 'unknown stores: {}'.format( list( np.unique( store_ids[rows < 0] ) ) ) )
 
+        date = pd.to_datetime( df['date'] )
 
-    def data_cleaning( self, df ):
-        ## Rename Columns
-        cols_old = ['Store', 'DayOfWeek', 'Date', 'Customers', 'Open', 'Promo', 'StateHoliday', 'SchoolHoliday', 'StoreType', 'Assortment', 'CompetitionDistance',
-                    'CompetitionOpenSinceMonth', 'CompetitionOpenSinceYear', 'Promo2', 'Promo2SinceWeek', 'Promo2SinceYear', 'PromoInterval']
+        df_full = pd.DataFrame( { 'store'          : df['store'].to_numpy(),
+                                  'day_of_week'    : df['day_of_week'].to_numpy() if 'day_of_week' in df.columns else date.dt.dayofweek.to_numpy() + 1,
+                                  'date'           : df['date'].to_numpy(),
+                                  'customers'      : np.zeros( len( df ), dtype=np.int8 if self.low_memory else np.int64 ),
+                                  'open'           : df['open'].to_numpy() if 'open' in df.columns else np.ones( len( df ), dtype=np.int8 if self.low_memory else np.int64 ),
+                                  'promo'          : df['promo'].to_numpy(),
+                                  'state_holiday'  : df['state_holiday'].to_numpy(),
+                                  'school_holiday' : df['school_holiday'].to_numpy() }, index=df.index )
+
+        for col, values in self.store_table['lean' if self.low_memory else 'columns'].items():
+            df_full[col] = values[rows]
+
+        return df_full
+
+    def store_ids( self ):
+        # ids of the stores of the store table
+        if self.store_table is None:
+            raise ValueError( 'store table is not loaded' )
+
+        return np.nonzero( self.store_table['row'] >= 0 )[0]
+
+    def make_grid( self, stores=None, start=None, end=None, calendars=None ):
+        # compact payload of every store x day between start and end, day by day ( all stores of a day, then the next day )
+        # stores: store ids, None for every store of the store table
+        # calendars: optional dataframe with date ( and store, for per store values ) and any of promo, state_holiday,
+        # school_holiday and open; grid rows without a calendar value get grid_defaults ( open = 0 on closed_weekdays )
+        stores = self.store_ids() if stores is None else np.asarray( stores, dtype=np.int64 )
+        dates  = pd.date_range( start, end, freq='D' )
+
+        df = pd.DataFrame( { 'store' : np.tile( stores, len( dates ) ),
+                             'date'  : np.repeat( dates.to_numpy(), len( stores ) ) } )
+
+        for col, value in self.grid_defaults.items():
+            df[col] = value
+
+        closed = np.repeat( dates.dayofweek.isin( self.closed_weekdays ), len( stores ) )
+        df['open'] = np.where( closed, 0, self.grid_defaults['open'] )
+
+        if calendars is not None and len( calendars ) > 0:
+            keys    = ['store', 'date'] if 'store' in calendars.columns else ['date']
+            columns = [ col for col in self.grid_defaults if col in calendars.columns ]
+
+            calendars = calendars[keys + columns].assign( date=pd.to_datetime( calendars['date'] ) ).drop_duplicates( keys, keep='last' )
+            values    = df[keys].merge( calendars, how='left', on=keys )
+            for col in columns:
+                df[col] = values[col].fillna( df[col] ).to_numpy()
+
+        return df
+
+    def cyclic_table( self, values, period ):
+        # sin and cos of the distinct values, evaluated with the same scalar formula of the original features
+        sin = np.array( [ np.sin( x * ( 2 * np.pi/period ) ) for x in values ] )
+        cos = np.array( [ np.cos( x * ( 2 * np.pi/period ) ) for x in values ] )
+
+        return sin, cos
+
+    def build_calendar( self, start, end ):
+        # one contiguous array per calendar feature, position = days since start
+        dates = pd.Series( pd.date_range( start, end, freq='D' ) )
+
+        calendar = { 'start'        : np.datetime64( dates.iloc[0], 'D' ).astype( np.int64 ),
+                     'year'         : dates.dt.year.to_numpy(),
+                     'month'        : dates.dt.month.to_numpy(),
+                     'day'          : dates.dt.day.to_numpy(),
+                     'week_of_year' : dates.dt.isocalendar().week.astype( np.int64 ).to_numpy() }
 
+        calendar['year_week'] = ( pd.Series( calendar['year'] ).astype( str ) + '-' + pd.Series( calendar['week_of_year'] ).astype( str ) ).to_numpy()
 
-        snakecase = lambda x: inflection.underscore( x )
-        cols_new = list( map( snakecase, cols_old ) )
+        for col, period in [ ( 'month', 12 ), ( 'day', 30 ), ( 'week_of_year', 52 ) ]:
+            sin, cos = self.cyclic_table( range( calendar[col].max() + 1 ), period )
+            calendar[col + '_sin'] = sin[calendar[col]]
+            calendar[col + '_cos'] = cos[calendar[col]]
 
-        # rename
-        df.columns = cols_new
+        return calendar
+
+    def calendar_index( self, date ):
+        # position of each date in the calendar, the calendar is rebuilt when a date is out of its range
+        # the calendar is returned with the positions, self.calendar may be replaced by another request
+        calendar = self.calendar
+        days = date.to_numpy( dtype='datetime64[D]' )
+        if np.isnat( days ).any():
+            raise ValueError( 'date contains missing values' )
+
+        days  = days.astype( np.int64 )
+        start = calendar['start']
+        end   = start + len( calendar['year'] ) - 1
+        if len( days ) > 0 and ( days.min() < start or days.max() > end ):
+            start = min( start, days.min() )
+            end   = max( end, days.max() )
+            calendar = self.build_calendar( np.int64( start ).astype( 'datetime64[D]' ), np.int64( end ).astype( 'datetime64[D]' ) )
+            self.calendar = calendar
+
+        return days - start, calendar
+
+    def is_compact( self, df ):
+        # compact payload: no store attributes, they are joined from the store table
+        return 'store_type' not in df.columns and 'StoreType' not in df.columns
+
+    def full_payload( self, df ):
+        # df in the full payload layout, the columns expected by data_cleaning ( a copy, unless low_memory )
+        if self.is_compact( df ):
+            return self.join_store( df )
+
+        # low memory: no copy, lean_features reads the columns by name and does not change df
+        if set( self.input_columns ).issubset( df.columns ):
+            return df if self.low_memory else df[self.input_columns].copy()
+
+        # columns with other names ( ex: Store, DayOfWeek, ... ), renamed by position as data_cleaning does
+        if len( df.columns ) != len( self.input_columns ):
+            raise ValueError( 'the full payload has {} columns, {} expected'.format( len( df.columns ), len( self.input_columns ) ) )
+
+        return df.set_axis( self.input_columns, axis=1 )
+
+    def data_cleaning( self, df ):
+        ## Rename Columns - raw_columns ( Store, DayOfWeek, ... ) -> input_columns ( store, day_of_week, ... ), by position
+        df.columns = self.input_columns
 
         # change data type "date"
         df['date'] = pd.to_datetime( df['date'] )
 
         # competition_distance - competition_distance with NA values means "no competitor around". Set max value = 200000
-        max_value = df['competition_distance'].max()
-        df['competition_distance'] = df['competition_distance'].apply( lambda x: 200000 if math.isnan( x ) else x )
+        df['competition_distance'] = df['competition_distance'].fillna( 200000 )
 
         # competition_open_since_month and competition_open_since_year - Set month and year of sale as default value
-        df['competition_open_since_month'] = df.apply( lambda x: x['date'].month if math.isnan( x['competition_open_since_month'] ) else x['competition_open_since_month'], axis=1 )
-        df['competition_open_since_year']  = df.apply( lambda x: x['date'].year if math.isnan( x['competition_open_since_year'] )   else x['competition_open_since_year'], axis=1 )
+        df['competition_open_since_month'] = df['competition_open_since_month'].fillna( df['date'].dt.month )
+        df['competition_open_since_year']  = df['competition_open_since_year'].fillna( df['date'].dt.year )
 
         # promo2_since_week  and promo2_since_year - Set month and year of sale as default value
-        df['promo2_since_week'] = df.apply( lambda x: x['date'].week if math.isnan( x['promo2_since_week'] ) else x['promo2_since_week'], axis=1 )
-        df['promo2_since_year'] = df.apply( lambda x: x['date'].year if math.isnan( x['promo2_since_year'] ) else x['promo2_since_year'], axis=1 )
+        df['promo2_since_week'] = df['promo2_since_week'].fillna( df['date'].dt.isocalendar().week.astype( int ) )
+        df['promo2_since_year'] = df['promo2_since_year'].fillna( df['date'].dt.year )
 
 
         # promo_interval - first, create a new column(month_map) with the month of sale  
         month_map = { 1: 'Jan', 2: 'Feb', 3: 'Mar', 4: 'Apr', 5: 'May', 6: 'Jun', 7: 'Jul', 8: 'Aug', 9: 'Sep', 10: 'Oct', 11: 'Nov', 12: 'Dec' }
-        df['promo_interval'].fillna( 0, inplace=True )
+        df['promo_interval'] = df['promo_interval'].fillna( 0 )
         df['month_map'] = df['date'].dt.month.map( month_map )
 
         # second, create a new column(is_promo) to check two conditions:  if promo_interval is active (1) and if month_map is inside promo_interval. (0) No, (1) Yes
-        df['is_promo'] = df[['promo_interval', 'month_map']].apply( lambda x: 0 if x['promo_interval'] == 0 else 1 if x['month_map'] in x['promo_interval'].split( ',' ) else 0, axis=1 ) 
-
+        # each distinct promo_interval is translated once into a 12 bits mask (bit 0 = Jan ... bit 11 = Dec)
+        month_bit = { v: 1 << ( k - 1 ) for k, v in month_map.items() }
+        interval_mask = { x: 0 if x == 0 else sum( month_bit.get( m, 0 ) for m in set( x.split( ',' ) ) ) for x in df['promo_interval'].unique() }
+        mask = df['promo_interval'].map( interval_mask ).to_numpy( dtype=np.int64 )
+        df['is_promo'] = ( mask >> ( df['date'].dt.month.to_numpy() - 1 ) ) & 1
 
         # change data types from float to int
         df['competition_open_since_month'] = df['competition_open_since_month'].astype( int )
@@ -62,35 +344,41 @@ class Rossmann( object ):
         return df
 
     def feature_engineering( self, df ):
+        # calendar features - one gather from the calendar table
+        idx, calendar = self.calendar_index( df['date'] )
+
         # year
-        df['year'] = df['date'].dt.year
+        df['year'] = calendar['year'][idx]
 
         # month
-        df['month'] = df['date'].dt.month
+        df['month'] = calendar['month'][idx]
 
         # day
-        df['day'] = df['date'].dt.day
+        df['day'] = calendar['day'][idx]
 
         # week of year
-        df['week_of_year'] = df.apply( lambda x: datetime.date( x['year'], x['month'], x['day'] ).isocalendar().week, axis=1 )
+        df['week_of_year'] = calendar['week_of_year'][idx]
 
         # year week
-        df['year_week'] = df.apply( lambda x: str( x['year'] ) + '-' + str( x['week_of_year'] ), axis=1 )
+        df['year_week'] = calendar['year_week'][idx]
 
         # from competition_open_since columns
-        df['competition_since']      = df.apply( lambda x: datetime.datetime( year=x['competition_open_since_year'], month=x['competition_open_since_month'], day=1 ), axis=1 )
-        df['competition_time_month'] = df.apply( lambda x: ( ( x['date'] - x['competition_since'] ) / 30 ).days, axis=1 ).astype( int )
+        df['competition_since']      = pd.to_datetime( pd.DataFrame( { 'year': df['competition_open_since_year'], 'month': df['competition_open_since_month'], 'day': 1 } ) )
+        df['competition_time_month'] = ( ( df['date'] - df['competition_since'] ) / 30 ).dt.days.astype( int )
 
-        # from promo2_since columns
-        df['promo2_since']     = df['promo2_since_year'].astype( str ) + '-' + df['promo2_since_week'].astype( str )
-        df['promo2_since']     = df['promo2_since'].apply( lambda x: datetime.datetime.strptime( x +'-1', '%Y-%W-%w' ) - datetime.timedelta( days=7 ) )
-        df['promo2_time_week'] = df.apply( lambda x: ( ( x['date'] - x['promo2_since'] ) / 7 ).days, axis=1 ).astype( int )
+        # from promo2_since columns - monday of week promo2_since_week ( %W: weeks start on monday, days before the first monday are week 0 ) minus 7 days
+        first_day     = pd.to_datetime( pd.DataFrame( { 'year': df['promo2_since_year'], 'month': 1, 'day': 1 } ) )
+        first_weekday = first_day.dt.weekday.to_numpy()
+        week          = df['promo2_since_week'].to_numpy()
+        offset_days   = np.where( week == 0, -first_weekday, ( 7 - first_weekday ) % 7 + ( week - 1 ) * 7 ) - 7
+        df['promo2_since']     = first_day + pd.to_timedelta( offset_days, unit='D' )
+        df['promo2_time_week'] = ( ( df['date'] - df['promo2_since'] ) / 7 ).dt.days.astype( int )
 
         # assortment level: a = basic, b = extra, c = extended
-        df['assortment'] = df['assortment'].apply( lambda x: 'basic' if x == 'a' else 'extra' if x =='b' else 'extended' )
+        df['assortment'] = df['assortment'].map( { 'a': 'basic', 'b': 'extra' } ).fillna( 'extended' )
 
         #StateHoliday - indicates a state holiday - a = public holiday, b = easter holiday, c = christmas, 0 = regular day
-        df['state_holiday'] = df['state_holiday'].apply( lambda x: 'public holiday' if x == 'a' else 'easter holiday' if x == 'b' else 'christmas' if x == 'c' else 'regular day' )
+        df['state_holiday'] = df['state_holiday'].map( { 'a': 'public holiday', 'b': 'easter holiday', 'c': 'christmas' } ).fillna( 'regular day' )
 
         # remove lines where there are no sales 
         df = df[ ( df['open'] != 0 ) ]
@@ -105,11 +393,16 @@ class Rossmann( object ):
         return df
 
     def data_preparation( self, df ):
-        df['promo2_time_week']       = self.promo2_time_week_scaler.fit_transform( df[['promo2_time_week']].values )
-        df['competition_distance']   = self.competition_distance_scaler.fit_transform( df[['competition_distance']].values )
-        df['competition_time_month'] = self.competition_time_month_scaler.fit_transform( df[['competition_time_month']].values )
-        df['year']                   = self.year_scaler.fit_transform( df[['year']].values )
-        df['store_type']             = self.store_type_scaler.fit_transform( df['store_type'] )
+        # Rescaling with the pre-fitted parameters - all numerical columns in one vectorized operation
+        scaled = ( df[self.scaled_columns].to_numpy( dtype=np.float64 ) - self.scaler_sub ) / self.scaler_div * self.scaler_mul + self.scaler_add
+        df[self.scaled_columns] = scaled
+
+        # Label Encoding with the pre-fitted classes
+        store_type = self.store_type_classes.get_indexer( df['store_type'] )
+        if ( store_type < 0 ).any():
+            raise ValueError( 'store_type contains previously unseen labels: {}'.format( list( df['store_type'][store_type < 0].unique() ) ) )
+
+        df['store_type'] = store_type.astype( np.int64 )
 
         # Apply One-Hot Encoding
         df = pd.get_dummies( df, prefix=['state_holiday'], columns=['state_holiday'] )
@@ -118,40 +411,311 @@ class Rossmann( object ):
         assortment_dict = { 'basic' : 1, 'extra' : 2, 'extended' : 3 }
         df['assortment'] = df['assortment'].map( assortment_dict )
 
-        # Calculate sin and cos 
-        df['month_sin'] = df['month'].apply( lambda x: np.sin( x * ( 2 * np.pi/12 ) ) )
-        df['month_cos'] = df['month'].apply( lambda x: np.cos( x * ( 2 * np.pi/12 ) ) )
-
-        # Calculate sin and cos 
-        df['day_of_week_sin'] = df['day_of_week'].apply( lambda x: np.sin( x * ( 2 * np.pi/7 ) ) )
-        df['day_of_week_cos'] = df['day_of_week'].apply( lambda x: np.cos( x * ( 2 * np.pi/7 ) ) )
+        # Calculate sin and cos - month, day and week_of_year from the calendar table
+        idx, calendar = self.calendar_index( df['date'] )
+        for col in ['month_sin', 'month_cos', 'day_sin', 'day_cos', 'week_of_year_sin', 'week_of_year_cos']:
+            df[col] = calendar[col][idx]
 
-        # Calculate sin and cos 
-        df['day_sin'] = df['day'].apply( lambda x: np.sin( x * ( 2 * np.pi/30 ) ) )
-        df['day_cos'] = df['day'].apply( lambda x: np.cos( x * ( 2 * np.pi/30 ) ) )
-
-        # Calculate sin and cos 
-        df['week_of_year_sin'] = df['week_of_year'].apply( lambda x: np.sin( x * ( 2 * np.pi/52 ) ) )
-        df['week_of_year_cos'] = df['week_of_year'].apply( lambda x: np.cos( x * ( 2 * np.pi/52 ) ) )
+        # Calculate sin and cos - day_of_week, evaluated once per distinct value
+        day_of_week, inverse = np.unique( df['day_of_week'].to_numpy(), return_inverse=True )
+        sin, cos = self.cyclic_table( day_of_week.tolist(), 7 )
+        df['day_of_week_sin'] = sin[inverse]
+        df['day_of_week_cos'] = cos[inverse]
 
         # features selected 
         #cols_selected = ['store', 'promo', 'store_type', 'assortment', 'competition_distance', 'competition_open_since_month',
         #                 'competition_open_since_year', 'promo2', 'promo2_since_week', 'promo2_since_year', 'competition_time_month', 'promo2_time_week', 
         #                 'day_of_week_sin', 'day_of_week_cos', 'day_sin', 'day_cos', 'week_of_year_sin', 'week_of_year_cos', 'month_sin', 'month_cos']
-        
-        cols_selected = ['store', 'promo', 'store_type', 'assortment', 'competition_distance', 'competition_open_since_month',
-                         'competition_open_since_year', 'promo2', 'promo2_since_week', 'promo2_since_year', 'competition_time_month', 'promo2_time_week', 
-                         'day_of_week_sin', 'day_of_week_cos', 'day_sin', 'day_cos', 'week_of_year_cos', 'month_cos']
 
-        
+        return df[self.cols_selected]
+
+    def map_distinct( self, values, function ):
+        # function evaluated once per distinct value ( NaN included ), categorical columns through their categories
+        codes, uniques = pd.factorize( values, use_na_sentinel=False )
 
-        return df[cols_selected]
+        return function( np.asarray( uniques, dtype=object ) )[codes]
+
+    def fill_missing( self, values, default ):
+        # NA values -> default ( array of the same length ), as integers
+        values = values.astype( np.float64 )
+
+        return np.where( np.isnan( values ), default, values ).astype( np.int64 )
+
+    def lean_features( self, df ):
+        # low memory pipeline: full or compact payload -> features of the open stores ( cols_selected ) in one float32 matrix
+        # same values the model receives from data_cleaning -> feature_engineering -> data_preparation ( casted to float32 ),
+        # without the intermediate columns ( year_week, month_map, is_promo, promo2_since, text labels, dummies ) and
+        # without changing df: only the needed columns are read, already filtered by open != 0
+        if self.is_compact( df ):
+            df = self.join_store( df )
+
+        elif not set( self.input_columns ).issubset( df.columns ):
+            df = self.full_payload( df )
+
+        open_rows = df['open'].to_numpy() != 0
+        column    = lambda col: df[col].to_numpy()[open_rows]
+        index     = df.index[open_rows]
+
+        idx, calendar = self.calendar_index( pd.to_datetime( column( 'date' ) ) )
+        days = idx + calendar['start']
+
+        # column order ( F ): every feature is written in one contiguous column
+        X = np.empty( ( len( index ), len( self.cols_selected ) ), dtype=np.float32, order='F' )
+        j = { col: i for i, col in enumerate( self.cols_selected ) }
+        scaler = { col: i for i, col in enumerate( self.scaled_columns ) }
+        scale  = lambda col, x: ( x - self.scaler_sub[scaler[col]] ) / self.scaler_div[scaler[col]] * self.scaler_mul[scaler[col]] + self.scaler_add[scaler[col]]
+
+        X[:, j['store']]  = column( 'store' )
+        X[:, j['promo']]  = column( 'promo' )
+        X[:, j['promo2']] = column( 'promo2' )
+
+        # label and ordinal encodings
+        store_type = self.map_distinct( df['store_type'], self.store_type_classes.get_indexer )[open_rows]
+        if ( store_type < 0 ).any():
+            raise ValueError( 'store_type contains previously unseen labels: {}'.format( list( pd.unique( column( 'store_type' )[store_type < 0] ) ) ) )
+
+        X[:, j['store_type']] = store_type
+        X[:, j['assortment']] = self.map_distinct( df['assortment'], lambda x: np.where( x == 'a', 1, np.where( x == 'b', 2, 3 ) ) )[open_rows]
+
+        # NA values: no competitor around, or the month / year / week of the sale
+        competition_distance = np.nan_to_num( column( 'competition_distance' ).astype( np.float64 ), nan=200000 )
+        X[:, j['competition_distance']] = scale( 'competition_distance', competition_distance )
+
+        competition_month = self.fill_missing( column( 'competition_open_since_month' ), calendar['month'][idx] )
+        competition_year  = self.fill_missing( column( 'competition_open_since_year' ), calendar['year'][idx] )
+        promo2_week       = self.fill_missing( column( 'promo2_since_week' ), calendar['week_of_year'][idx] )
+        promo2_year       = self.fill_missing( column( 'promo2_since_year' ), calendar['year'][idx] )
+
+        X[:, j['competition_open_since_month']] = competition_month
+        X[:, j['competition_open_since_year']]  = competition_year
+        X[:, j['promo2_since_week']]            = promo2_week
+        X[:, j['promo2_since_year']]            = promo2_year
+
+        # competition_time_month: days since the first day of the competition month // 30
+        competition_since = ( ( competition_year - 1970 ) * 12 + competition_month - 1 ).astype( 'datetime64[M]' ).astype( 'datetime64[D]' ).astype( np.int64 )
+        X[:, j['competition_time_month']] = scale( 'competition_time_month', np.floor_divide( days - competition_since, 30 ) )
+
+        # promo2_time_week: days since the monday of the %W week promo2_since_week, minus 7 days, // 7 ( 1970-01-01 is a thursday )
+        first_day     = ( promo2_year - 1970 ).astype( 'datetime64[Y]' ).astype( 'datetime64[D]' ).astype( np.int64 )
+        first_weekday = ( first_day + 3 ) % 7
+        promo2_since  = first_day + np.where( promo2_week == 0, -first_weekday, ( 7 - first_weekday ) % 7 + ( promo2_week - 1 ) * 7 ) - 7
+        X[:, j['promo2_time_week']] = scale( 'promo2_time_week', np.floor_divide( days - promo2_since, 7 ) )
+
+        # cyclic features
+        for col in ['day_sin', 'day_cos', 'week_of_year_cos', 'month_cos']:
+            X[:, j[col]] = calendar[col][idx]
+
+        day_of_week, inverse = np.unique( column( 'day_of_week' ), return_inverse=True )
+        sin, cos = self.cyclic_table( day_of_week.tolist(), 7 )
+        X[:, j['day_of_week_sin']] = sin[inverse]
+        X[:, j['day_of_week_cos']] = cos[inverse]
+
+        return pd.DataFrame( X, columns=self.cols_selected, index=index, copy=False )
     
-    def get_prediction( self, model, original_data, test_data ):
+    def read_data( self, body, content_type='application/json' ):
+        # request body -> dataframe, None when there is no data
+        # application/x-npz : numpy .npz archive, one array per column
+        # application/json  : records ( list of rows ), columns ( dict of lists ) or a unique example ( dict of values )
+        if content_type == 'application/x-npz':
+            try:
+                with np.load( io.BytesIO( body ), allow_pickle=False ) as npz:
+                    arrays = { col: npz[col] for col in npz.files }
+
+            except ( zipfile.BadZipFile, OSError, EOFError ) as e:
+                raise ValueError( 'invalid npz body: {}'.format( e ) )
+
+            # text columns with missing values: '' in the column, True in the <column>__missing mask
+            masks = { col[:-len( self.npz_missing_suffix )]: arrays.pop( col ) for col in list( arrays ) if col.endswith( self.npz_missing_suffix ) }
+            df    = pd.DataFrame( arrays )
+            for col, mask in masks.items():
+                if col in df.columns:
+                    df[col] = df[col].astype( object ).mask( mask )
+
+            return df if len( df ) > 0 else None
+
+        test_json = json.loads( body ) if body else None
+        if not test_json:
+            return None
+
+        # Column Oriented
+        if isinstance( test_json, dict ) and isinstance( next( iter( test_json.values() ) ), list ):
+            return pd.DataFrame( test_json )
+
+        # Unique Example
+        if isinstance( test_json, dict ):
+            return pd.DataFrame( test_json, index=[0] )
+
+        # Multiple Examples
+        return pd.DataFrame( test_json, columns=test_json[0].keys() )
+
+    def get_prediction( self, model, original_data, test_data, orient='records', columns=None ):
         # prediction
         pred = model.predict( test_data )
 
-        # join pred into original data
-        original_data['sales_predictions'] = np.expm1( pred )
+        # join pred into original data, by index: closed stores ( removed by feature_engineering ) get NaN
+        original_data['sales_predictions'] = pd.Series( np.expm1( pred ), index=test_data.index, dtype=np.float64 )
+
+        return self.write_data( original_data, orient, columns )
+
+    def write_data( self, df, orient='records', columns=None ):
+        # dataframe -> response body: json records, json columns or npz
+        if columns is not None:
+            df = df[columns]
+
+        # numpy .npz archive - text columns ( object or categorical ) as unicode arrays, no pickled objects;
+        # missing text values are '' plus a <column>__missing boolean mask, read back as NaN by read_data
+        if orient == 'npz':
+            arrays = {}
+            for col in df.columns:
+                values = df[col].to_numpy()
+                if values.dtype == object:
+                    missing = df[col].isna().to_numpy()
+                    values  = np.where( missing, '', values ).astype( str )
+                    if missing.any():
+                        arrays[col + self.npz_missing_suffix] = missing
+
+                arrays[col] = values
+
+            buffer = io.BytesIO()
+            np.savez( buffer, **arrays )
+
+            return buffer.getvalue()
+
+        # json { column: [values] }
+        if orient == 'columns':
+            return '{' + ', '.join( json.dumps( col ) + ': ' + df[col].to_json( orient='values', date_format='iso' ) for col in df.columns ) + '}'
+
+        return df.to_json( orient='records', date_format='iso' )
+
+    def timed( self, timings, stage, function, *args, **kwargs ):
+        # calls function, adding its duration in seconds to timings[stage] when timings ( dict ) is given
+        if timings is None:
+            return function( *args, **kwargs )
+
+        start  = time.perf_counter()
+        result = function( *args, **kwargs )
+        timings[stage] = timings.get( stage, 0.0 ) + time.perf_counter() - start
+
+        return result
+
+    def predict_frame( self, model, df, timings=None ):
+        # full or compact payload -> the same dataframe with sales_predictions ( NaN for closed stores )
+        # the pipeline runs on a copy of the input columns, df only receives the predictions
+        # timings ( dict ), when given, accumulates the seconds spent in each stage
+        if self.low_memory:
+            df_test = self.timed( timings, 'lean_features', self.lean_features, df )
+
+        else:
+            # compact payloads are joined with the store table, full payloads only copied
+            df_test = self.timed( timings, 'join_store' if self.is_compact( df ) else 'full_payload', self.full_payload, df )
+            df_test = self.timed( timings, 'data_cleaning', self.data_cleaning, df_test )
+            df_test = self.timed( timings, 'feature_engineering', self.feature_engineering, df_test )
+            df_test = self.timed( timings, 'data_preparation', self.data_preparation, df_test )
+
+        pred = self.timed( timings, 'predict', model.predict, df_test ) if len( df_test ) > 0 else np.array( [] )
+        df['sales_predictions'] = pd.Series( np.expm1( pred ), index=df_test.index, dtype=np.float64 )
+
+        return df
 
-        return original_data.to_json( orient='records', date_format='iso' )
+    def read_forecast( self, body ):
+        # forecast request body ( json ) -> ( stores, start, end, calendars )
+        # { "start": "2015-08-01", "end": "2015-09-11", "stores": [1, 2] ( optional, every store by default ),
+        #   "calendar": records or columns with date ( and store ) and any of promo, state_holiday, school_holiday, open }
+        # days without a calendar value: promo 0, state_holiday '0', school_holiday 0, stores closed on sundays and open
+        # on the other days ( a calendar with open = 1 opens a store on sunday )
+        forecast = json.loads( body ) if body else None
+        if not isinstance( forecast, dict ) or 'start' not in forecast or 'end' not in forecast:
+            raise ValueError( 'forecast request needs start and end dates' )
+
+        try:
+            start  = pd.Timestamp( forecast['start'] )
+            end    = pd.Timestamp( forecast['end'] )
+            stores = np.asarray( forecast['stores'], dtype=np.int64 ) if forecast.get( 'stores' ) is not None else None
+
+        except ( ValueError, TypeError ) as e:
+            raise ValueError( 'invalid forecast request: {}'.format( e ) )
+
+        if end < start:
+            raise ValueError( 'forecast end {} is before start {}'.format( end.date(), start.date() ) )
+
+        calendars = pd.DataFrame( forecast['calendar'] ) if forecast.get( 'calendar' ) else None
+        if calendars is not None and 'date' not in calendars.columns:
+            raise ValueError( 'forecast calendar needs a date column' )
+
+        return stores, start, end, calendars
+
+    def forecast( self, model, stores=None, start=None, end=None, calendars=None, chunk_rows=50000, max_rows=None, timings=None ):
+        # sales forecast of stores x [start, end]: the grid ( make_grid ) is predicted whole days at a time, up to chunk_rows rows
+        # -> ( daily, weekly )
+        #   daily : store, date, open, sales_predictions ( 0 for closed days )
+        #   weekly: store, week ( monday ), days, open_days, sales_predictions ( sum of the days of the week in the range )
+        known  = self.store_ids()
+        stores = known if stores is None else np.unique( np.asarray( stores, dtype=np.int64 ) )
+        dates  = pd.date_range( start, end, freq='D' )
+
+        if len( stores ) == 0:
+            raise ValueError( 'forecast without stores' )
+
+        unknown = np.setdiff1d( stores, known )
+        if len( unknown ) > 0:
+            raise ValueError( 'unknown stores: {}'.format( unknown.tolist() ) )
+
+        if max_rows is not None and len( stores ) * len( dates ) > max_rows:
+            raise ValueError( 'forecast of {:,} store-days exceeds the limit of {:,}'.format( len( stores ) * len( dates ), max_rows ) )
+
+        chunk_days = max( 1, chunk_rows // len( stores ) )
+
+        is_open = []
+        pred    = []
+        for i in range( 0, len( dates ), chunk_days ):
+            days = dates[i:i + chunk_days]
+            grid = self.timed( timings, 'grid', self.make_grid, stores, days[0], days[-1], calendars )
+            grid = self.predict_frame( model, grid, timings )
+
+            is_open.append( grid['open'].to_numpy() != 0 )
+            pred.append( grid['sales_predictions'].fillna( 0 ).to_numpy() )
+
+        # dates as yyyy-mm-dd text, formatted once per day
+        daily = pd.DataFrame( { 'store'             : np.tile( stores, len( dates ) ),
+                                'date'              : np.repeat( dates.strftime( '%Y-%m-%d' ).to_numpy(), len( stores ) ),
+                                'open'              : np.concatenate( is_open ).astype( np.int64 ),
+                                'sales_predictions' : np.concatenate( pred ) } )
+
+        # weeks start on monday, partial weeks at the edges of the range only count their days
+        week   = np.repeat( ( dates - pd.to_timedelta( dates.dayofweek, unit='D' ) ).strftime( '%Y-%m-%d' ).to_numpy(), len( stores ) )
+        weekly = self.timed( timings, 'aggregate', lambda: daily.assign( week=week, days=1 )
+                                                                .groupby( ['store', 'week'], sort=True )
+                                                                .agg( days=( 'days', 'sum' ), open_days=( 'open', 'sum' ), sales_predictions=( 'sales_predictions', 'sum' ) )
+                                                                .reset_index() )
+
+        return daily, weekly
+
+    def read_chunks( self, stream, content_type, chunksize ):
+        # incremental reader of a csv or ndjson stream, chunksize rows at a time
+        if content_type == 'text/csv':
+            return pd.read_csv( stream, chunksize=chunksize )
+
+        if content_type == 'application/x-ndjson':
+            return pd.read_json( stream, lines=True, chunksize=chunksize, dtype=False, convert_dates=False )
+
+        raise ValueError( 'content type not supported for chunks: {}'.format( content_type ) )
+
+    def predict_chunks( self, model, chunks, timings=None ):
+        # clean -> features -> prepare -> predict per chunk, only one chunk in memory at a time
+        for chunk in chunks:
+            yield self.predict_frame( model, chunk, timings )
+
+    def write_chunks( self, frames, content_type='application/x-ndjson', columns=None ):
+        # predicted chunks -> csv or ndjson text, one piece per chunk
+        header = True
+        for df in frames:
+            if columns is not None:
+                df = df[columns]
+
+            if content_type == 'text/csv':
+                yield df.to_csv( index=False, header=header, date_format='%Y-%m-%d' )
+                header = False
+
+            else:
+                # one line per row, the text ends with a newline
+                yield df.to_json( orient='records', lines=True, date_format='iso' )
@@ -0,0 +1,158 @@
+import numpy as np
+import json
+
+class TreeEnsemble( object ):
+    # Trees of a trained XGBoost regressor exported once to flat node arrays ( feature, threshold, left/right child,
+    # default direction of missing values, leaf value ) and evaluated with vectorized NumPy traversal over a float32
+    # feature matrix: all rows x all trees descend one level per step, max_depth steps in total.
+    #   TreeEnsemble( model ).save( 'model/model_rossmann.npz' )   -> predictions without pickle / xgboost
+    #   TreeEnsemble( path='model/model_rossmann.npz' ).predict( df_test )
+    identity_objectives = [ 'reg:squarederror', 'reg:absoluteerror', 'reg:pseudohubererror', 'reg:quantileerror' ]
+
+    # rows x trees cells of one traversal block ( bounds the temporary node matrices )
+    block_cells = 1 << 22
+
+    def __init__( self, model=None, path=None ):
+        if path is not None:
+            self.load( path )
+
+        else:
+            self.export( model )
+
+    def export( self, model ):
+        booster = model.get_booster() if hasattr( model, 'get_booster' ) else model
+        learner = json.loads( booster.save_raw( raw_format='json' ) )['learner']
+
+        if learner['gradient_booster']['name'] != 'gbtree':
+            raise ValueError( 'Only gbtree boosters can be exported, got {}'.format( learner['gradient_booster']['name'] ) )
+
+        if learner['objective']['name'] not in self.identity_objectives:
+            raise ValueError( 'Objective {} is not supported'.format( learner['objective']['name'] ) )
+
+        trees = learner['gradient_booster']['model']['trees']
+
+        # early stopping: xgboost predicts with the trees up to the best iteration
+        best_iteration = booster.attr( 'best_iteration' )
+        if best_iteration is not None:
+            trees = trees[:learner['gradient_booster']['model']['iteration_indptr'][int( best_iteration ) + 1]]
+
+        feature, threshold, left, right, default_left, roots = [], [], [], [], [], []
+        offset = 0
+        for tree in trees:
+            if any( tree['split_type'] ):
+                raise ValueError( 'Categorical splits are not supported' )
+
+            tree_left  = np.array( tree['left_children'], dtype=np.int32 )
+            tree_right = np.array( tree['right_children'], dtype=np.int32 )
+            nodes      = np.arange( offset, offset + len( tree_left ), dtype=np.int32 )
+            leaf       = tree_left == -1
+
+            # leaves point to themselves, so extra traversal steps keep rows on their leaf
+            left.append( np.where( leaf, nodes, tree_left + offset ) )
+            right.append( np.where( leaf, nodes, tree_right + offset ) )
+            feature.append( np.array( tree['split_indices'], dtype=np.int32 ) )
+            threshold.append( np.array( tree['split_conditions'], dtype=np.float32 ) )
+            default_left.append( np.array( tree['default_left'], dtype=bool ) )
+            roots.append( offset )
+
+            offset += len( tree_left )
+
+        self.feature      = np.concatenate( feature )
+        self.threshold    = np.concatenate( threshold )
+        self.left         = np.concatenate( left )
+        self.right        = np.concatenate( right )
+        self.default_left = np.concatenate( default_left )
+        self.roots        = np.array( roots, dtype=np.int32 )
+        self.base_score   = float( learner['learner_model_param']['base_score'] )
+        self.feature_names = list( booster.feature_names ) if booster.feature_names else None
+
+        # leaf values are stored in split_conditions of the leaf nodes; the leaf threshold becomes +inf and missing
+        # values go left, so rows on a leaf always take the left child ( the leaf itself )
+        leaf = self.left == np.arange( len( self.left ) )
+        self.value        = np.where( leaf, self.threshold, 0 ).astype( np.float32 )
+        self.threshold    = np.where( leaf, np.inf, self.threshold ).astype( np.float32 )
+        self.default_left = self.default_left | leaf
+
+        # depth: levels until every root reaches a leaf
+        self.depth = 0
+        level = self.roots
+        while True:
+            level = level[self.left[level] != level]
+            if len( level ) == 0:
+                break
+
+            level = np.concatenate( [ self.left[level], self.right[level] ] )
+            self.depth += 1
+
+        self.set_adjacent()
+
+        return None
+
+    def set_adjacent( self ):
+        # xgboost allocates the children of a node in pairs ( right = left + 1 ): the next node is then left + go right
+        internal = self.left != np.arange( len( self.left ) )
+        self.adjacent = bool( ( self.right[internal] == self.left[internal] + 1 ).all() )
+
+        return None
+
+    def save( self, path ):
+        np.savez( path, feature=self.feature, threshold=self.threshold, left=self.left, right=self.right,
+                  default_left=self.default_left, value=self.value, roots=self.roots,
+                  base_score=np.array( self.base_score ), depth=np.array( self.depth ),
+                  feature_names=np.array( self.feature_names or [], dtype=str ) )
+
+        return None
+
+    def load( self, path ):
+        with np.load( path, allow_pickle=False ) as arrays:
+            self.feature       = arrays['feature']
+            self.threshold     = arrays['threshold']
+            self.left          = arrays['left']
+            self.right         = arrays['right']
+            self.default_left  = arrays['default_left']
+            self.value         = arrays['value']
+            self.roots         = arrays['roots']
+            self.base_score    = float( arrays['base_score'] )
+            self.depth         = int( arrays['depth'] )
+            self.feature_names = arrays['feature_names'].tolist() or None
+
+        self.set_adjacent()
+
+        return None
+
+    def predict( self, X ):
+        # X: DataFrame with the training columns ( selected by name ) or a feature matrix in the training column order
+        if self.feature_names is not None and hasattr( X, 'columns' ):
+            X = X[self.feature_names]
+
+        X     = np.asarray( X, dtype=np.float32 )
+        pred  = np.empty( len( X ), dtype=np.float32 )
+        block = max( 1, self.block_cells // len( self.roots ) )
+
+        for start in range( 0, len( X ), block ):
+            x       = X[start:start + block]
+            missing = np.isnan( x ).any()
+
+            # flat gathers: x value of row r and feature f at r * n_features + f
+            x_flat = x.ravel()
+            offset = ( np.arange( len( x ), dtype=np.int64 ) * x.shape[1] )[:, None]
+            node   = np.repeat( self.roots[None, :], len( x ), axis=0 )
+
+            for _ in range( self.depth ):
+                value = x_flat.take( offset + self.feature.take( node ) )
+
+                # x < threshold goes left, missing values follow the default direction of the node
+                go_left = value < self.threshold.take( node )
+                if missing:
+                    nan = np.isnan( value )
+                    go_left[nan] = self.default_left.take( node[nan] )
+
+                if self.adjacent:
+                    node = self.left.take( node ) + ~go_left
+
+                else:
+                    node = np.where( go_left, self.left.take( node ), self.right.take( node ) )
+
+            pred[start:start + block] = self.value.take( node ).sum( axis=1, dtype=np.float64 ) + self.base_score
+
+        return pred
@@ -0,0 +1,221 @@
+# ASGI entry point: uvicorn rossmann_asgi:app --host 0.0.0.0 --port 5000
+# Same /rossmann/predict and /rossmann/forecast contract of rossmann_handler.py. The request body is received
+# asynchronously and the parsing, pipeline and model.predict work runs in a process pool. The model and parameters
+# are loaded once in this process and inherited by the pool workers through fork.
+from   api.rossmann.ParameterRegistry import ParameterRegistry
+import concurrent.futures
+import multiprocessing
+import urllib.parse
+import asyncio
+import json
+import gzip
+import zlib
+import io
+import os
+
+workers = int( os.environ.get( 'workers', os.cpu_count() ) )
+
+registry = ParameterRegistry( os.environ.get( 'path_model', ParameterRegistry.default_path_model ),
+                              path_params=os.environ.get( 'path_params' ),
+                              path_store=os.environ.get( 'path_store', ParameterRegistry.default_path_store ),
+                              backend=os.environ.get( 'inference_backend', 'xgboost' ),
+                              low_memory=os.environ.get( 'low_memory', '0' ) == '1' )
+registry.reload()
+
+# process pool, created at startup ( after the parameters are loaded ) and replaced on reload
+pool  = None
+ready = False
+lock  = asyncio.Lock()
+
+
+def ping():
+    return os.getpid()
+
+def predict( body, content_type, accept, args ):
+    # runs in a pool worker: body -> ( status, mimetype, response body )
+    params   = registry.get()
+    model    = params['model']
+    pipeline = params['pipeline']
+    columns  = ['store', 'date', 'sales_predictions'] if args.get( 'output' ) == 'predictions' else None
+
+    try:
+        # chunked formats: the whole body is predicted chunk by chunk, the response is not streamed
+        if content_type in ( 'text/csv', 'application/x-ndjson' ):
+            mimetype = 'text/csv' if 'text/csv' in accept else 'application/x-ndjson'
+            chunks   = pipeline.read_chunks( io.BytesIO( body ), content_type, int( args.get( 'chunksize', 10000 ) ) )
+            response = ''.join( pipeline.write_chunks( pipeline.predict_chunks( model, chunks ), mimetype, columns ) )
+
+            return 200, mimetype, response.encode()
+
+        df_test_raw = pipeline.read_data( body, content_type )
+
+        # there is no data
+        if df_test_raw is None:
+            return 200, 'application/json', b'{}'
+
+        mimetype = 'application/x-npz' if 'application/x-npz' in accept else 'application/json'
+        orient   = 'npz' if mimetype == 'application/x-npz' else args.get( 'orient', 'records' )
+
+        # the response has the request columns plus sales_predictions ( NaN for closed stores ), in every mode
+        response = pipeline.write_data( pipeline.predict_frame( model, df_test_raw ), orient=orient, columns=columns )
+
+    # invalid payloads and values ( ex: unseen store_type labels ) are bad requests, as in rossmann_handler.py
+    except ValueError as e:
+        return 400, 'application/json', json.dumps( { 'error': str( e ) } ).encode()
+
+    return 200, mimetype, response if isinstance( response, bytes ) else response.encode()
+
+
+def forecast( body, args ):
+    # runs in a pool worker: forecast request -> ( status, mimetype, response body ), same contract of rossmann_handler.py
+    params   = registry.get()
+    pipeline = params['pipeline']
+
+    try:
+        stores, start, end, calendars = pipeline.read_forecast( body )
+        daily, weekly = pipeline.forecast( params['model'], stores, start, end, calendars,
+                                           chunk_rows=int( os.environ.get( 'forecast_chunk_rows', 50000 ) ),
+                                           max_rows=int( os.environ.get( 'forecast_max_rows', 1000000 ) ) )
+
+    except ValueError as e:
+        return 400, 'application/json', json.dumps( { 'error': str( e ) } ).encode()
+
+    orient   = args.get( 'orient', 'records' )
+    frames   = { 'daily': daily, 'weekly': weekly }
+    response = ', '.join( '"{}": {}'.format( output, pipeline.write_data( frames[output], orient ) ) for output in frames if args.get( 'output', output ) == output )
+
+    return 200, 'application/json', ( '{' + response + '}' ).encode()
+
+
+async def start_pool():
+    # forks the workers and waits until every one of them answers
+    new_pool = concurrent.futures.ProcessPoolExecutor( max_workers=workers, mp_context=multiprocessing.get_context( 'fork' ) )
+
+    loop = asyncio.get_running_loop()
+    await asyncio.gather( *[ loop.run_in_executor( new_pool, ping ) for _ in range( workers ) ] )
+
+    return new_pool
+
+async def startup():
+    global pool, ready
+
+    async with lock:
+        if pool is None:
+            pool  = await start_pool()
+            ready = True
+
+    return None
+
+async def reload():
+    # new parameters are loaded here, then a new pool is forked with them; the old pool finishes its requests
+    global pool
+
+    loop   = asyncio.get_running_loop()
+    params = await loop.run_in_executor( None, registry.reload )
+
+    new_pool = await start_pool()
+    async with lock:
+        old_pool, pool = pool, new_pool
+
+    old_pool.shutdown( wait=False )
+
+    return params
+
+
+async def read_body( receive ):
+    body = bytearray()
+    more = True
+    while more:
+        message = await receive()
+        body   += message.get( 'body', b'' )
+        more    = message.get( 'more_body', False )
+
+    return bytes( body )
+
+async def request_body( receive, headers ):
+    # request body, decompressed when Content-Encoding is gzip ( ValueError when it is not valid gzip )
+    body = await read_body( receive )
+    if headers.get( 'content-encoding' ) != 'gzip':
+        return body
+
+    try:
+        return gzip.decompress( body )
+
+    except ( OSError, EOFError, zlib.error ) as e:
+        raise ValueError( 'invalid gzip body: {}'.format( e ) )
+
+async def send_response( send, status, mimetype, body ):
+    await send( { 'type': 'http.response.start', 'status': status,
+                  'headers': [ ( b'content-type', mimetype.encode() ), ( b'content-length', str( len( body ) ).encode() ) ] } )
+    await send( { 'type': 'http.response.body', 'body': body } )
+
+    return None
+
+async def lifespan( receive, send ):
+    while True:
+        message = await receive()
+
+        if message['type'] == 'lifespan.startup':
+            await startup()
+            await send( { 'type': 'lifespan.startup.complete' } )
+
+        elif message['type'] == 'lifespan.shutdown':
+            if pool is not None:
+                pool.shutdown( wait=True )
+
+            await send( { 'type': 'lifespan.shutdown.complete' } )
+            return None
+
+async def app( scope, receive, send ):
+    if scope['type'] == 'lifespan':
+        return await lifespan( receive, send )
+
+    if scope['type'] != 'http':
+        return None
+
+    path    = scope['path']
+    method  = scope['method']
+    headers = { k.decode( 'latin-1' ).lower(): v.decode( 'latin-1' ) for k, v in scope['headers'] }
+    args    = { k: v[-1] for k, v in urllib.parse.parse_qs( scope.get( 'query_string', b'' ).decode() ).items() }
+
+    # liveness: the process answers
+    if path == '/health':
+        return await send_response( send, 200, 'application/json', b'{"status": "ok"}' )
+
+    # servers without lifespan support: the pool starts with the first request
+    if pool is None:
+        await startup()
+
+    # readiness: parameters loaded and pool workers running
+    if path == '/ready':
+        status = 200 if ready else 503
+        return await send_response( send, status, 'application/json', json.dumps( { 'ready': ready, 'workers': workers, 'version': registry.version } ).encode() )
+
+    if path == '/rossmann/reload' and method == 'POST':
+        params   = await reload()
+        response = { 'version': params['version'], 'load_time': params['load_time'], 'warm_up_time': params['warm_up_time'] }
+        return await send_response( send, 200, 'application/json', json.dumps( response ).encode() )
+
+    if path in ( '/rossmann/predict', '/rossmann/forecast' ) and method == 'POST':
+        try:
+            body = await request_body( receive, headers )
+
+        except ValueError as e:
+            return await send_response( send, 400, 'application/json', json.dumps( { 'error': str( e ) } ).encode() )
+
+    if path == '/rossmann/predict' and method == 'POST':
+        content_type = headers.get( 'content-type', 'application/json' ).split( ';' )[0].strip()
+        accept       = headers.get( 'accept', '' )
+
+        loop = asyncio.get_running_loop()
+        status, mimetype, response = await loop.run_in_executor( pool, predict, body, content_type, accept, args )
+
+        return await send_response( send, status, mimetype, response )
+
+    if path == '/rossmann/forecast' and method == 'POST':
+        loop = asyncio.get_running_loop()
+        status, mimetype, response = await loop.run_in_executor( pool, forecast, body, args )
+
+        return await send_response( send, status, mimetype, response )
+
+    return await send_response( send, 404, 'application/json', b'{"error": "not found"}' )
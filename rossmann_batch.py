@@ -0,0 +1,166 @@
+# Offline batch scoring: python rossmann_batch.py data/test.csv --output predictions.csv --workers 4
+#                        python rossmann_batch.py --synthetic 10000000 --workers 8
+import pandas as pd
+import numpy  as np
+
+import concurrent.futures
+import argparse
+import pickle
+import glob
+import time
+import os
+
+from api.rossmann.ParameterRegistry import ParameterRegistry
+from api.rossmann.Rossmann          import Rossmann
+from api.rossmann.TreeEnsemble      import TreeEnsemble
+
+# model and pipeline of the worker process, loaded once by init_worker
+worker = {}
+
+def init_worker( path_model, path_params, path_store, backend, low_memory ):
+    if path_model.endswith( '.npz' ):
+        worker['model'] = TreeEnsemble( path=path_model )
+
+    else:
+        with open( path_model, 'rb' ) as f:
+            worker['model'] = pickle.load( f )
+
+        if backend == 'numpy':
+            worker['model'] = TreeEnsemble( worker['model'] )
+
+    # one thread per worker, the parallelism comes from the processes
+    if hasattr( worker['model'], 'set_params' ):
+        worker['model'].set_params( n_jobs=1 )
+
+    worker['pipeline'] = Rossmann( path_params, path_store, low_memory=low_memory )
+
+    return None
+
+def list_files( inputs ):
+    # files, directories ( partitioned data: every csv/parquet file inside ) or glob patterns
+    files = []
+    for path in inputs:
+        if os.path.isdir( path ):
+            files += sorted( glob.glob( os.path.join( path, '**', '*.csv' ), recursive=True ) )
+            files += sorted( glob.glob( os.path.join( path, '**', '*.parquet' ), recursive=True ) )
+
+        else:
+            files += sorted( glob.glob( path ) )
+
+    return files
+
+def load_data( files ):
+    frames = [ pd.read_parquet( f ) if f.endswith( '.parquet' ) else pd.read_csv( f, low_memory=False ) for f in files ]
+
+    return pd.concat( frames, ignore_index=True )
+
+def synthetic_data( df_store, start_date, n_days, seed ):
+    # compact payload for every store x day, random promo and holidays
+    rng   = np.random.default_rng( seed )
+    dates = pd.date_range( start_date, periods=n_days, freq='D' )
+
+    df = pd.DataFrame( { 'store' : np.repeat( df_store['Store'].to_numpy(), n_days ),
+                         'date'  : np.tile( dates.strftime( '%Y-%m-%d' ).to_numpy(), len( df_store ) ) } )
+
+    df['promo']          = rng.integers( 0, 2, len( df ) )
+    df['state_holiday']  = rng.choice( np.array( ['0', 'a', 'b', 'c'], dtype=object ), len( df ), p=[0.97, 0.01, 0.01, 0.01] )
+    df['school_holiday'] = rng.integers( 0, 2, len( df ) )
+
+    return df
+
+def score_partition( df, columns ):
+    # runs in a worker process: one partition of stores through the whole pipeline
+    timings = {}
+    df = worker['pipeline'].predict_frame( worker['model'], df, timings )
+
+    return df[columns] if columns else df, timings
+
+def score_synthetic( path_store, stores, start_date, n_days, seed, columns ):
+    # runs in a worker process: the partition is generated by the worker, nothing is sent to it
+    start    = time.perf_counter()
+    df_store = pd.read_csv( path_store )
+    df       = synthetic_data( df_store[df_store['Store'].isin( stores )], start_date, n_days, seed )
+    generate = time.perf_counter() - start
+
+    df, timings = score_partition( df, columns )
+    timings['generate'] = generate
+
+    return df, timings
+
+def write_data( df, output ):
+    if output.endswith( '.parquet' ):
+        df.to_parquet( output, index=False )
+
+    else:
+        df.to_csv( output, index=False )
+
+    return None
+
+def report( timings, rows, wall_time ):
+    # stage times are summed over all workers ( cpu seconds ), rows/s per stage is the throughput of one worker
+    print( '{:<22} {:>10} {:>14}'.format( 'stage', 'seconds', 'rows/s' ) )
+    for stage, seconds in timings.items():
+        print( '{:<22} {:>10.2f} {:>14,.0f}'.format( stage, seconds, rows / seconds if seconds > 0 else 0 ) )
+
+    print( '{:<22} {:>10.2f} {:>14,.0f}'.format( 'wall time', wall_time, rows / wall_time if wall_time > 0 else 0 ) )
+
+    return None
+
+def main():
+    parser = argparse.ArgumentParser( description='Rossmann batch scoring' )
+    parser.add_argument( 'inputs', nargs='*', help='csv/parquet files, directories or glob patterns' )
+    parser.add_argument( '--output', help='predictions file ( .csv or .parquet )' )
+    parser.add_argument( '--columns', default='store,date,sales_predictions', help='output columns, "all" for every input column' )
+    parser.add_argument( '--workers', type=int, default=os.cpu_count() )
+    parser.add_argument( '--partitions', type=int, default=None, help='store partitions, default 4 per worker' )
+    parser.add_argument( '--synthetic', type=int, default=None, help='score N synthetic rows generated from store.csv' )
+    parser.add_argument( '--backend', choices=['xgboost', 'numpy'], default=os.environ.get( 'inference_backend', 'xgboost' ) )
+    parser.add_argument( '--low-memory', action='store_true', help='compact dtypes, no intermediate columns' )
+    parser.add_argument( '--path-model', default=os.environ.get( 'path_model', ParameterRegistry.default_path_model ) )
+    parser.add_argument( '--path-params', default=os.environ.get( 'path_params' ) )
+    parser.add_argument( '--path-store', default=os.environ.get( 'path_store', ParameterRegistry.default_path_store ) )
+    args = parser.parse_args()
+
+    columns    = None if args.columns == 'all' else args.columns.split( ',' )
+    partitions = args.partitions or args.workers * 4
+    start      = time.perf_counter()
+
+    executor = concurrent.futures.ProcessPoolExecutor( max_workers=args.workers, initializer=init_worker,
+                                                       initargs=( args.path_model, args.path_params, args.path_store, args.backend, args.low_memory ) )
+    with executor:
+        # synthetic rows: every partition is a group of stores x n_days
+        if args.synthetic:
+            store_ids = pd.read_csv( args.path_store )['Store'].to_numpy()
+            n_days    = max( 1, args.synthetic // len( store_ids ) )
+            futures   = [ executor.submit( score_synthetic, args.path_store, stores, '2013-01-01', n_days, i, columns )
+                          for i, stores in enumerate( np.array_split( store_ids, partitions ) ) ]
+
+        # input files: rows partitioned by store, so each worker scores whole stores
+        else:
+            df      = load_data( list_files( args.inputs ) )
+            part    = df['store'].to_numpy() % partitions
+            futures = [ executor.submit( score_partition, df[part == i], columns ) for i in range( partitions ) ]
+
+        results = [ future.result() for future in futures ]
+
+    wall_time = time.perf_counter() - start
+
+    # input files: back to the original row order
+    df_pred = pd.concat( [ df for df, timings in results ], ignore_index=bool( args.synthetic ) )
+    if not args.synthetic:
+        df_pred = df_pred.sort_index()
+
+    timings = {}
+    for df, stage_timings in results:
+        for stage, seconds in stage_timings.items():
+            timings[stage] = timings.get( stage, 0.0 ) + seconds
+
+    report( timings, len( df_pred ), wall_time )
+
+    if args.output:
+        write_data( df_pred, args.output )
+
+    return None
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,683 @@
+# Benchmark suite of the inference pipeline and of the monitor aggregations
+#   python rossmann_benchmark.py --rows 1000,50000 --output bench.json
+#   python rossmann_benchmark.py --rows 1000,50000 --baseline bench.json --threshold 0.2
+#   python rossmann_benchmark.py --rows 1,100,10000,1000000 --skip-monitor --skip-handler   ( inference backends by batch size )
+#   python rossmann_benchmark.py --rows 1000 --cold-start   ( process start to first prediction, import time per module )
+#   python rossmann_benchmark.py --rows 1000 --stream 5000000 --stream-max-mb 256   ( csv streamed through predict_chunks in a
+#                                                   new process, exits 1 when its peak rss grows more than the bound over the loaded model )
+#   python rossmann_benchmark.py --rows 1000 --load 10 --load-clients 16 --load-windows 0,5,20   ( requests per second of
+#                                                   single row requests against the threaded server, with and without micro-batching )
+#   python rossmann_benchmark.py --rows 1000 --asgi-workers 1,2,4 --asgi-rows 1000 --load-clients 8   ( requests per second of
+#                                                   uvicorn rossmann_asgi:app by number of pool workers )
+#   python rossmann_benchmark.py --rows 1000 --monitor-backends   ( apply_model of the monitor: local, http records, http columns
+#                                                   and gzip, and the legacy single request, against a local server )
+# The handler benchmarks include a sweep of the request / response formats ( records, columns, npz, output=predictions ).
+# The model dependent benchmarks ( predict, end-to-end ) run only when path_model points to a model file.
+import pandas as pd
+import numpy  as np
+
+import urllib.request
+import tracemalloc
+import subprocess
+import argparse
+import platform
+import datetime
+import threading
+import tempfile
+import pickle
+import shutil
+import socket
+import json
+import time
+import sys
+import os
+
+from api.rossmann.Rossmann     import Rossmann
+from api.rossmann.TreeEnsemble import TreeEnsemble
+
+local_path_store = 'data/store.csv'
+local_path_test  = 'data/test.csv'
+
+
+def synthetic_test( df_test, rows, seed ):
+    # rows of test.csv ( open stores ) sampled with replacement, full payload plus sales
+    df = df_test[df_test['open'] != 0].sample( rows, replace=True, random_state=seed )
+
+    return df.reset_index( drop=True )
+
+def synthetic_predictions( df, seed ):
+    # monitor input: store, date, sales and a prediction with ~10% of error
+    rng = np.random.default_rng( seed )
+
+    df_pred = df[['store', 'date', 'sales']].copy()
+    df_pred['sales_predictions'] = df_pred['sales'] * rng.normal( 1.0, 0.1, len( df_pred ) )
+    df_pred['absolute_error']    = np.abs( df_pred['sales'] - df_pred['sales_predictions'] )
+
+    return df_pred
+
+def measure( function, setup, repeat ):
+    # best time of repeat runs, then one more run traced for the peak memory
+    best = None
+    for _ in range( repeat ):
+        args  = setup()
+        start = time.perf_counter()
+        function( *args )
+        elapsed = time.perf_counter() - start
+        best    = elapsed if best is None else min( best, elapsed )
+
+    args = setup()
+    tracemalloc.start()
+    function( *args )
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return best, peak
+
+def frozen_transform( pipeline, df ):
+    # rescaling and label encoding of data_preparation with the frozen scaler parameters
+    scaled     = ( df[pipeline.scaled_columns].to_numpy( dtype=np.float64 ) - pipeline.scaler_sub ) / pipeline.scaler_div * pipeline.scaler_mul + pipeline.scaler_add
+    store_type = pipeline.store_type_classes.get_indexer( df['store_type'] )
+
+    return scaled, store_type
+
+def sklearn_transform( pipeline, df ):
+    # the same with the transform calls of the pickled scikit-learn scalers
+    scaled     = np.column_stack( [ getattr( pipeline, col + '_scaler' ).transform( df[[col]].values )[:, 0] for col in pipeline.scaled_columns ] )
+    store_type = pipeline.store_type_scaler.transform( df['store_type'] )
+
+    return scaled, store_type
+
+def run_benchmarks( rows, repeat, pipeline, lean, model, trees, client, monitor, df_test ):
+    df       = synthetic_test( df_test, rows, seed=rows )
+    df_input = df.drop( columns=['sales'] )
+    df_pred  = synthetic_predictions( df, seed=rows )
+
+    # inputs of each stage, copied for every run ( the stages change their input )
+    df_compact  = df_input[['store', 'date', 'promo', 'state_holiday', 'school_holiday']]
+    df_cleaned  = pipeline.data_cleaning( df_input.copy() )
+    df_features = pipeline.feature_engineering( df_cleaned.copy() )
+    df_prepared = pipeline.data_preparation( df_features.copy() )
+    df_output   = df_input.copy()
+    df_output['sales_predictions'] = df_pred['sales_predictions'].to_numpy()
+
+    benchmarks = [ ( 'rossmann.join_store',             pipeline.join_store,          lambda: ( df_compact, ) ),
+                   ( 'rossmann.data_cleaning',          pipeline.data_cleaning,       lambda: ( df_input.copy(), ) ),
+                   ( 'rossmann.feature_engineering',    pipeline.feature_engineering, lambda: ( df_cleaned.copy(), ) ),
+                   ( 'rossmann.data_preparation',       pipeline.data_preparation,    lambda: ( df_features.copy(), ) ),
+                   ( 'rossmann.write_data',             pipeline.write_data,          lambda: ( df_output, ) ),
+                   ( 'rossmann.lean_features',          lean.lean_features,           lambda: ( df_input, ) ),
+                   ( 'rossmann.lean_features_compact',  lean.lean_features,           lambda: ( df_compact, ) ) ]
+
+    # frozen scalers against the scikit-learn transform calls they replace, only when the pickled scalers are loaded
+    # ( not from scalers.json, which avoids importing scikit-learn )
+    if hasattr( pipeline, 'year_scaler' ):
+        frozen, sklearn = frozen_transform( pipeline, df_features ), sklearn_transform( pipeline, df_features )
+        if not ( np.array_equal( frozen[0], sklearn[0] ) and np.array_equal( frozen[1], sklearn[1] ) ):
+            raise ValueError( 'frozen scalers differ from the scikit-learn transform' )
+
+        benchmarks += [ ( 'scalers.frozen_transform',  frozen_transform,  lambda: ( pipeline, df_features ) ),
+                        ( 'scalers.sklearn_transform', sklearn_transform, lambda: ( pipeline, df_features ) ) ]
+
+    # predict_frame of the default and of the low memory pipeline, full and compact payloads
+    if model is not None:
+        benchmarks += [ ( 'model.predict',                            model.predict,                                     lambda: ( df_prepared, ) ),
+                        ( 'rossmann.predict_frame',                   lambda df: pipeline.predict_frame( model, df ), lambda: ( df_input.copy(), ) ),
+                        ( 'rossmann.predict_frame_low_memory',        lambda df: lean.predict_frame( model, df ),     lambda: ( df_input.copy(), ) ),
+                        ( 'rossmann.predict_frame_compact',           lambda df: pipeline.predict_frame( model, df ), lambda: ( df_compact.copy(), ) ),
+                        ( 'rossmann.predict_frame_compact_low_memory', lambda df: lean.predict_frame( model, df ),     lambda: ( df_compact.copy(), ) ) ]
+
+        # forecast of about rows store-days ( every store, rows // stores days, or the first rows stores for one day )
+        stores = pipeline.store_ids()
+        days   = max( 1, rows // len( stores ) )
+        stores = stores if rows >= len( stores ) else stores[:rows]
+        end    = pd.Timestamp( '2015-08-01' ) + pd.Timedelta( days=days - 1 )
+        benchmarks += [ ( 'rossmann.forecast',            lambda: pipeline.forecast( model, stores, '2015-08-01', end ), lambda: () ),
+                        ( 'rossmann.forecast_low_memory', lambda: lean.forecast( model, stores, '2015-08-01', end ),     lambda: () ) ]
+
+    if trees is not None:
+        benchmarks.append( ( 'tree_ensemble.predict', trees.predict, lambda: ( df_prepared, ) ) )
+
+        # the numpy backend must match xgboost ( float32 sums in a different order )
+        difference = np.abs( trees.predict( df_prepared ) - model.predict( df_prepared ) ).max()
+        print( 'tree_ensemble max abs difference to xgboost: {:.2e}'.format( difference ) )
+        if difference > 1e-4:
+            raise ValueError( 'TreeEnsemble predictions differ from xgboost by {}'.format( difference ) )
+
+    if client is not None:
+        body = json.dumps( df_input.to_dict( orient='records' ) )
+        post = lambda data: client.post( '/rossmann/predict', data=data, headers={ 'Content-type': 'application/json' } ).data
+        benchmarks.append( ( 'handler.predict', post, lambda: ( body, ) ) )
+
+    # monitor: aggregates built once per prediction run, the metrics and charts derived from them ( all stores selected )
+    if monitor is not None:
+        aggregates = monitor.build_aggregates( df_pred, df )
+        stores     = np.ones( len( aggregates['stores'] ), dtype=bool )
+        benchmarks += [ ( 'monitor.baseline_errors',        monitor.baseline_errors,        lambda: ( df_pred, df ) ),
+                        ( 'monitor.build_aggregates',       monitor.build_aggregates,       lambda: ( df_pred, df ) ),
+                        ( 'monitor.grouped_stores',         monitor.grouped_stores,         lambda: ( aggregates, stores ) ),
+                        ( 'monitor.error_range_table',      monitor.error_range_table,      lambda: ( aggregates, stores ) ),
+                        ( 'monitor.averaging_models_table', monitor.averaging_models_table, lambda: ( aggregates, stores ) ) ]
+
+    results = []
+    for name, function, setup in benchmarks:
+        seconds, peak = measure( function, setup, repeat )
+        results.append( { 'name'           : name,
+                          'rows'           : rows,
+                          'seconds'        : seconds,
+                          'rows_per_sec'   : rows / seconds if seconds > 0 else None,
+                          'peak_memory_mb' : peak / 1024 / 1024 } )
+
+        print( '{:<40} {:>10,} {:>10.4f} {:>14,.0f} {:>10.1f}'.format( name, rows, seconds, rows / seconds if seconds > 0 else 0, peak / 1024 / 1024 ) )
+
+    return results
+
+def run_formats( rows, repeat, pipeline, client, df_test ):
+    # request and response formats through the handler ( flask test client ): payload sizes and best latency of repeat runs
+    df         = synthetic_test( df_test, rows, seed=rows ).drop( columns=['sales'] )
+    df_compact = df[pipeline.compact_columns]
+
+    npz     = { 'Content-type': 'application/x-npz', 'Accept': 'application/x-npz' }
+    records = { 'Content-type': 'application/json' }
+    formats = [ ( 'records',                     pipeline.write_data( df, 'records' ),         records, '' ),
+                ( 'columns',                     pipeline.write_data( df, 'columns' ),         records, '?orient=columns' ),
+                ( 'npz',                         pipeline.write_data( df, 'npz' ),             npz,     '' ),
+                ( 'records_predictions',         pipeline.write_data( df, 'records' ),         records, '?output=predictions' ),
+                ( 'compact_records',             pipeline.write_data( df_compact, 'records' ), records, '' ),
+                ( 'compact_columns_predictions', pipeline.write_data( df_compact, 'columns' ), records, '?orient=columns&output=predictions' ),
+                ( 'compact_npz_predictions',     pipeline.write_data( df_compact, 'npz' ),     npz,     '?output=predictions' ) ]
+
+    print( '\n{:<40} {:>10} {:>10} {:>12} {:>12}'.format( 'format', 'rows', 'seconds', 'request MB', 'response MB' ) )
+
+    results = []
+    for name, body, headers, query in formats:
+        best = None
+        for _ in range( repeat ):
+            start    = time.perf_counter()
+            response = client.post( '/rossmann/predict' + query, data=body, headers=headers )
+            elapsed  = time.perf_counter() - start
+            best     = elapsed if best is None else min( best, elapsed )
+
+        if response.status_code != 200:
+            raise RuntimeError( 'format {}: status {}'.format( name, response.status_code ) )
+
+        name = 'formats.' + name
+        results.append( { 'name'           : name,
+                          'rows'           : rows,
+                          'seconds'        : best,
+                          'rows_per_sec'   : rows / best if best > 0 else None,
+                          'peak_memory_mb' : None,
+                          'request_mb'     : len( body ) / 1024 / 1024,
+                          'response_mb'    : len( response.data ) / 1024 / 1024 } )
+
+        print( '{:<40} {:>10,} {:>10.4f} {:>12.2f} {:>12.2f}'.format( name, rows, best, len( body ) / 1024 / 1024, len( response.data ) / 1024 / 1024 ) )
+
+    return results
+
+def first_prediction( env, body, port=None, timeout=300 ):
+    # seconds from a new python process to its first prediction of body: imports, model and parameters loading and
+    # the request; with port, through a prefork server ( rossmann_prefork.py, one worker ), else in process
+    root  = os.path.dirname( os.path.abspath( __file__ ) )
+    start = time.perf_counter()
+
+    # in process: the child prints the wall clock time of its prediction ( the interpreter exit is not counted )
+    if port is None:
+        begin  = time.time()
+        script = ( 'import sys, time, rossmann_handler\n'
+                   'response = rossmann_handler.app.test_client().post( "/rossmann/predict", data=sys.stdin.buffer.read(), headers={ "Content-type": "application/json" } )\n'
+                   'print( time.time() if response.status_code == 200 else -1 )' )
+        output = subprocess.run( [ sys.executable, '-c', script ], input=body, env=env, cwd=root, check=True,
+                                 capture_output=True ).stdout.decode().split()
+
+        if not output or float( output[-1] ) < 0:
+            raise RuntimeError( 'in process prediction failed' )
+
+        return float( output[-1] ) - begin
+
+    process = subprocess.Popen( [ sys.executable, 'rossmann_prefork.py', '--host', '127.0.0.1', '--port', str( port ), '--workers', '1' ],
+                                env=env, cwd=root, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL )
+    try:
+        request = urllib.request.Request( 'http://127.0.0.1:{}/rossmann/predict'.format( port ), data=body, headers={ 'Content-type': 'application/json' } )
+        while time.perf_counter() - start < timeout:
+            try:
+                with urllib.request.urlopen( request, timeout=timeout ) as response:
+                    response.read()
+                    return time.perf_counter() - start
+
+            except OSError:
+                if process.poll() is not None:
+                    raise RuntimeError( 'prefork server exited with {}'.format( process.returncode ) )
+
+                time.sleep( 0.01 )
+
+        raise RuntimeError( 'no prediction after {}s'.format( timeout ) )
+
+    finally:
+        process.terminate()
+        process.wait()
+
+def import_times( env, top=12 ):
+    # python -X importtime of rossmann_handler ( the model load imports the model libraries ): cumulative seconds of
+    # each top level package ( xgboost, sklearn, pandas, ... ), nested imports are also counted in their parents
+    root   = os.path.dirname( os.path.abspath( __file__ ) )
+    output = subprocess.run( [ sys.executable, '-X', 'importtime', '-c', 'import rossmann_handler' ],
+                             env=env, cwd=root, capture_output=True, text=True, check=True ).stderr
+
+    times = {}
+    for line in output.splitlines():
+        if not line.startswith( 'import time:' ) or 'cumulative' in line:
+            continue
+
+        _, cumulative, name = line.split( '|' )
+        package = name.strip().split( '.' )[0]
+        times[package] = max( times.get( package, 0 ), int( cumulative ) / 1e6 )
+
+    return sorted( times.items(), key=lambda x: -x[1] )[:top]
+
+def run_cold_start( repeat, model, df_test ):
+    # cold start of the default parameters ( pickled xgboost model and scalers ) and of the numpy snapshot
+    # ( TreeEnsemble .npz and scalers.json, no xgboost / scikit-learn import ), best of repeat runs
+    body = json.dumps( synthetic_test( df_test, 1, seed=0 ).drop( columns=['sales'] ).to_dict( orient='records' ) ).encode()
+    env  = dict( os.environ, PYTHONWARNINGS='ignore' )
+
+    snapshot = tempfile.mkdtemp()
+    try:
+        path_params = os.path.join( snapshot, 'parameters' ) + os.sep
+        shutil.copytree( Rossmann( os.environ.get( 'path_params' ) ).path_params, path_params )
+        Rossmann( path_params ).save_scalers()
+        TreeEnsemble( model ).save( os.path.join( snapshot, 'model.npz' ) )
+
+        variants = [ ( '', env ), ( '_numpy', dict( env, path_model=os.path.join( snapshot, 'model.npz' ), path_params=path_params ) ) ]
+
+        for suffix, variant_env in variants:
+            print( '\nimport time of rossmann_handler{}:'.format( suffix ) )
+            for name, seconds in import_times( variant_env ):
+                print( '  {:<40} {:>8.3f}s'.format( name, seconds ) )
+
+        results = []
+        for suffix, variant_env in variants:
+            for mode in [ 'in_process', 'prefork' ]:
+                best = None
+                for _ in range( repeat ):
+                    seconds = first_prediction( variant_env, body, free_port() if mode == 'prefork' else None )
+                    best    = seconds if best is None else min( best, seconds )
+
+                name = 'cold_start.{}{}'.format( mode, suffix )
+                results.append( { 'name': name, 'rows': 1, 'seconds': best, 'rows_per_sec': None, 'peak_memory_mb': None } )
+                print( '{:<40} {:>10,} {:>10.4f}'.format( name, 1, best ) )
+
+    finally:
+        shutil.rmtree( snapshot )
+
+    return results
+
+def free_port():
+    with socket.socket() as s:
+        s.bind( ( '127.0.0.1', 0 ) )
+        return s.getsockname()[1]
+
+def start_server( command, env, port, ready_path, timeout=300 ):
+    # server process started from the repository root, returned once GET ready_path answers 200
+    root    = os.path.dirname( os.path.abspath( __file__ ) )
+    process = subprocess.Popen( command, env=env, cwd=root, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL )
+    start   = time.perf_counter()
+
+    while time.perf_counter() - start < timeout:
+        try:
+            with urllib.request.urlopen( 'http://127.0.0.1:{}{}'.format( port, ready_path ), timeout=timeout ) as response:
+                if response.status == 200:
+                    return process
+
+        except OSError:
+            if process.poll() is not None:
+                raise RuntimeError( '{} exited with {}'.format( ' '.join( command ), process.returncode ) )
+
+        time.sleep( 0.05 )
+
+    process.terminate()
+    process.wait()
+    raise RuntimeError( 'server not ready after {}s'.format( timeout ) )
+
+def load_test( url, body, headers, clients, seconds ):
+    # clients threads posting body back to back for seconds -> { requests, errors, req_per_sec, p50_ms, p99_ms }
+    latencies = []
+    errors    = []
+    deadline  = time.perf_counter() + seconds
+
+    def client():
+        while time.perf_counter() < deadline:
+            request = urllib.request.Request( url, data=body, headers=headers )
+            start   = time.perf_counter()
+            try:
+                with urllib.request.urlopen( request, timeout=60 ) as response:
+                    response.read()
+                    latencies.append( time.perf_counter() - start )
+
+            except OSError as e:
+                errors.append( e )
+
+    start   = time.perf_counter()
+    threads = [ threading.Thread( target=client ) for _ in range( clients ) ]
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    elapsed   = time.perf_counter() - start
+    latencies = np.array( latencies ) * 1000
+
+    return { 'requests'    : len( latencies ),
+             'errors'      : len( errors ),
+             'req_per_sec' : len( latencies ) / elapsed,
+             'p50_ms'      : float( np.percentile( latencies, 50 ) ) if len( latencies ) else None,
+             'p99_ms'      : float( np.percentile( latencies, 99 ) ) if len( latencies ) else None }
+
+def load_result( name, rows, load ):
+    print( '{:<40} {:>10,} {:>10,} {:>10,} {:>10.1f} {:>10.1f} {:>10.1f}'.format( name, rows, load['requests'], load['errors'],
+                                                                           load['req_per_sec'], load['p50_ms'] or 0, load['p99_ms'] or 0 ) )
+
+    return dict( load, name=name, rows=rows, seconds=1 / load['req_per_sec'] if load['req_per_sec'] > 0 else None,
+                 rows_per_sec=rows * load['req_per_sec'], peak_memory_mb=None )
+
+def run_load( seconds, clients, windows, df_test ):
+    # concurrent clients posting single compact rows to the threaded flask server, with each micro-batching window
+    # ( 0: micro-batching disabled )
+    body    = json.dumps( synthetic_test( df_test, 1, seed=0 )[Rossmann.compact_columns].to_dict( orient='records' ) ).encode()
+    headers = { 'Content-type': 'application/json' }
+
+    print( '\n{:<40} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10}'.format( 'load ( {} clients )'.format( clients ), 'rows', 'requests', 'errors', 'req/s', 'p50 ms', 'p99 ms' ) )
+
+    results = []
+    for window in windows:
+        port    = free_port()
+        env     = dict( os.environ, PYTHONWARNINGS='ignore', batch_window_ms=str( window ) )
+        command = [ sys.executable, '-c', 'import rossmann_handler; rossmann_handler.app.run( "127.0.0.1", {}, threaded=True )'.format( port ) ]
+        server  = start_server( command, env, port, '/rossmann/startup' )
+        try:
+            load = load_test( 'http://127.0.0.1:{}/rossmann/predict'.format( port ), body, headers, clients, seconds )
+
+        finally:
+            server.terminate()
+            server.wait()
+
+        results.append( load_result( 'load.batch_window_{:g}ms'.format( window ), 1, load ) )
+
+    return results
+
+def run_asgi_scaling( seconds, clients, workers, rows, df_test ):
+    # concurrent clients posting compact requests of rows rows to uvicorn rossmann_asgi:app with each pool size
+    body    = json.dumps( synthetic_test( df_test, rows, seed=rows )[Rossmann.compact_columns].to_dict( orient='records' ) ).encode()
+    headers = { 'Content-type': 'application/json' }
+
+    print( '\n{:<40} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10}'.format( 'asgi ( {} clients )'.format( clients ), 'rows', 'requests', 'errors', 'req/s', 'p50 ms', 'p99 ms' ) )
+
+    results = []
+    for n in workers:
+        port    = free_port()
+        env     = dict( os.environ, PYTHONWARNINGS='ignore', workers=str( n ) )
+        command = [ sys.executable, '-m', 'uvicorn', 'rossmann_asgi:app', '--host', '127.0.0.1', '--port', str( port ), '--log-level', 'warning' ]
+        server  = start_server( command, env, port, '/ready' )
+        try:
+            load = load_test( 'http://127.0.0.1:{}/rossmann/predict'.format( port ), body, headers, clients, seconds )
+
+        finally:
+            server.terminate()
+            server.wait()
+
+        results.append( load_result( 'asgi.workers_{}'.format( n ), rows, load ) )
+
+    return results
+
+def legacy_apply_model( url, x_test ):
+    # apply_model of the monitor before the backends: the whole frame in one records request, the response parsed twice
+    import requests
+
+    y_test   = x_test['sales'].values
+    x_test   = x_test.drop( ['sales'], axis=1 )
+    response = requests.post( url, data=json.dumps( x_test.to_dict( orient='records' ) ), headers={ 'Content-type' : 'application/json' } )
+
+    df = pd.DataFrame( response.json(), columns=response.json()[0].keys() )
+    df = df[['store', 'date', 'sales_predictions']]
+    df['sales']          = y_test
+    df['absolute_error'] = np.abs( y_test - df['sales_predictions'].values )
+
+    return df
+
+def run_monitor_backends( repeat, monitor, df_test ):
+    # apply_model of the monitor on its input ( test.csv open rows ) with each backend, the http ones against a local
+    # threaded flask server, and the legacy single request apply_model; best of repeat runs
+    x_test = df_test[df_test['open'] != 0]
+    port   = free_port()
+    url    = 'http://127.0.0.1:{}/rossmann/predict'.format( port )
+
+    command  = [ sys.executable, '-c', 'import rossmann_handler; rossmann_handler.app.run( "127.0.0.1", {}, threaded=True )'.format( port ) ]
+    server   = start_server( command, dict( os.environ, PYTHONWARNINGS='ignore' ), port, '/rossmann/startup' )
+    variants = [ ( 'monitor.legacy_apply_model', lambda: legacy_apply_model( url, x_test ),  {} ),
+                 ( 'monitor.http_records',       lambda: monitor.apply_model( x_test ),      { 'monitor_backend': 'http' } ),
+                 ( 'monitor.http_columns_gzip',  lambda: monitor.apply_model( x_test ),      { 'monitor_backend': 'http', 'monitor_columns': '1', 'monitor_gzip': '1' } ),
+                 ( 'monitor.local',              lambda: monitor.apply_model( x_test ),      { 'monitor_backend': 'local' } ) ]
+
+    print( '\n{:<40} {:>10} {:>10}'.format( 'monitor backend', 'rows', 'seconds' ) )
+
+    results  = []
+    previous = { key: os.environ.get( key ) for key in [ 'monitor_columns', 'monitor_gzip' ] }
+    backend  = ( monitor.backend, monitor.url )
+    try:
+        for name, function, env in variants:
+            os.environ.update( { 'monitor_columns': '0', 'monitor_gzip': '0' } )
+            os.environ.update( { key: value for key, value in env.items() if key != 'monitor_backend' } )
+            monitor.backend = env.get( 'monitor_backend', 'http' )
+            monitor.url     = url
+
+            # first call outside the timing ( connections, local model loading )
+            function()
+            best = None
+            for _ in range( repeat ):
+                start = time.perf_counter()
+                function()
+                elapsed = time.perf_counter() - start
+                best    = elapsed if best is None else min( best, elapsed )
+
+            results.append( { 'name': name, 'rows': len( x_test ), 'seconds': best, 'rows_per_sec': len( x_test ) / best, 'peak_memory_mb': None } )
+            print( '{:<40} {:>10,} {:>10.4f}'.format( name, len( x_test ), best ) )
+
+    finally:
+        server.terminate()
+        server.wait()
+
+        monitor.backend, monitor.url = backend
+        for key, value in previous.items():
+            if value is None:
+                os.environ.pop( key, None )
+
+            else:
+                os.environ[key] = value
+
+    return results
+
+def write_stream_csv( df_test, rows, path ):
+    # csv with rows rows ( full payload, test.csv repeated, closed stores included ), written one block at a time
+    df = df_test.drop( columns=['sales'], errors='ignore' )
+    with open( path, 'w' ) as f:
+        for start in range( 0, rows, len( df ) ):
+            df.head( rows - start ).to_csv( f, header=start == 0, index=False )
+
+    return path
+
+def run_stream( pipeline, model, path, chunksize ):
+    # csv file -> read_chunks -> predict_chunks -> write_chunks ( ndjson, discarded ) -> ( rows, seconds )
+    rows  = 0
+    start = time.perf_counter()
+
+    with open( path, 'rb' ) as f:
+        chunks = pipeline.read_chunks( f, 'text/csv', chunksize )
+        for text in pipeline.write_chunks( pipeline.predict_chunks( model, chunks ) ):
+            rows += text.count( '\n' )
+
+    return rows, time.perf_counter() - start
+
+def stream_rss( path, chunksize, env=None ):
+    # run_stream in a new process ( path_model, path_params, path_store of env ): peak resident memory ( ru_maxrss,
+    # native allocations of pandas / xgboost included ) before and after the stream, the model already loaded
+    # -> { rows, seconds, rss_before_mb, peak_rss_mb, stream_rss_mb }
+    root   = os.path.dirname( os.path.abspath( __file__ ) )
+    script = ( 'import json, os, pickle, resource, sys, warnings\n'
+               'warnings.simplefilter( "ignore" )\n'
+               'from rossmann_benchmark import run_stream\n'
+               'from api.rossmann.Rossmann import Rossmann\n'
+               'pipeline = Rossmann( os.environ.get( "path_params" ), os.environ.get( "path_store", "data/store.csv" ) )\n'
+               'with open( os.environ["path_model"], "rb" ) as f:\n'
+               '    model = pickle.load( f )\n'
+               'before = resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss\n'
+               'rows, seconds = run_stream( pipeline, model, sys.argv[1], int( sys.argv[2] ) )\n'
+               'peak = resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss\n'
+               'print( json.dumps( { "rows": rows, "seconds": seconds, "before": before, "peak": peak } ) )' )
+
+    output = subprocess.run( [ sys.executable, '-c', script, path, str( chunksize ) ], env=env, cwd=root, check=True,
+                             capture_output=True, text=True ).stdout
+    result = json.loads( output.splitlines()[-1] )
+
+    # ru_maxrss in kilobytes ( linux )
+    return { 'rows'          : result['rows'],
+             'seconds'       : result['seconds'],
+             'rss_before_mb' : result['before'] / 1024,
+             'peak_rss_mb'   : result['peak'] / 1024,
+             'stream_rss_mb' : ( result['peak'] - result['before'] ) / 1024 }
+
+def run_stream_benchmark( rows, chunksize, df_test ):
+    folder = tempfile.mkdtemp()
+    try:
+        path   = write_stream_csv( df_test, rows, os.path.join( folder, 'stream.csv' ) )
+        stream = stream_rss( path, chunksize, env=dict( os.environ ) )
+
+    finally:
+        shutil.rmtree( folder )
+
+    name = 'stream.predict_chunks_{}'.format( chunksize )
+    print( '{:<40} {:>10,} {:>10.4f} {:>14,.0f} {:>10.1f}'.format( name, stream['rows'], stream['seconds'], stream['rows'] / stream['seconds'], stream['stream_rss_mb'] ) )
+    print( '  peak rss {:.1f}MB, {:.1f}MB before the stream ( model loaded )'.format( stream['peak_rss_mb'], stream['rss_before_mb'] ) )
+
+    return dict( stream, name=name, rows_per_sec=stream['rows'] / stream['seconds'], peak_memory_mb=stream['stream_rss_mb'] )
+
+def compare( results, baseline, threshold ):
+    # regression: slower than the baseline by more than threshold ( ex: 0.2 = 20% )
+    base = { ( r['name'], r['rows'] ): r for r in baseline['results'] }
+
+    regressions = []
+    print( '\n{:<40} {:>10} {:>10} {:>10} {:>8}'.format( 'benchmark', 'rows', 'baseline', 'current', 'ratio' ) )
+    for r in results:
+        b = base.get( ( r['name'], r['rows'] ) )
+        if b is None:
+            continue
+
+        ratio = r['seconds'] / b['seconds'] if b['seconds'] > 0 else float( 'inf' )
+        flag  = ' REGRESSION' if ratio > 1 + threshold else ''
+        print( '{:<40} {:>10,} {:>10.4f} {:>10.4f} {:>8.2f}{}'.format( r['name'], r['rows'], b['seconds'], r['seconds'], ratio, flag ) )
+
+        if flag:
+            regressions.append( r )
+
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser( description='Rossmann benchmark suite' )
+    parser.add_argument( '--rows', default='1000,50000', help='comma separated input sizes' )
+    parser.add_argument( '--repeat', type=int, default=3 )
+    parser.add_argument( '--output', help='json file with the results' )
+    parser.add_argument( '--baseline', help='json file of a previous run to compare with' )
+    parser.add_argument( '--threshold', type=float, default=0.2, help='allowed slowdown over the baseline' )
+    parser.add_argument( '--skip-monitor', action='store_true' )
+    parser.add_argument( '--skip-handler', action='store_true' )
+    parser.add_argument( '--cold-start', action='store_true', help='process start to first prediction ( needs path_model )' )
+    parser.add_argument( '--stream', type=int, help='rows of a generated csv streamed through predict_chunks ( needs path_model )' )
+    parser.add_argument( '--stream-chunksize', type=int, default=10000 )
+    parser.add_argument( '--stream-max-mb', type=float, default=256, help='bound of the peak rss growth of the stream' )
+    parser.add_argument( '--load', type=float, help='seconds of concurrent clients against the threaded server, per batch window ( needs path_model )' )
+    parser.add_argument( '--load-clients', type=int, default=16 )
+    parser.add_argument( '--load-windows', default='0,5,20', help='comma separated batch_window_ms values, 0 without micro-batching' )
+    parser.add_argument( '--asgi-workers', help='comma separated pool sizes of the asgi app, load of --load seconds ( default 10 ) and --load-clients' )
+    parser.add_argument( '--asgi-rows', type=int, default=1000, help='rows of each compact request to the asgi app' )
+    parser.add_argument( '--monitor-backends', action='store_true', help='apply_model of the monitor with each backend ( needs path_model )' )
+    args = parser.parse_args()
+
+    path_store = os.environ.get( 'path_store', local_path_store )
+    path_model = os.environ.get( 'path_model' )
+    os.environ['path_store'] = path_store
+
+    df_test  = pd.read_csv( os.environ.get( 'path_test', local_path_test ), low_memory=False )
+    pipeline = Rossmann( os.environ.get( 'path_params' ), path_store )
+    lean     = Rossmann( os.environ.get( 'path_params' ), path_store, low_memory=True )
+
+    model  = None
+    trees  = None
+    client = None
+    if path_model and os.path.exists( path_model ):
+        with open( path_model, 'rb' ) as f:
+            model = pickle.load( f )
+
+        trees = TreeEnsemble( model )
+
+        if not args.skip_handler:
+            import rossmann_handler
+            client = rossmann_handler.app.test_client()
+
+    else:
+        print( 'path_model not set or not found: predict and end-to-end benchmarks skipped' )
+
+    monitor = None
+    if not args.skip_monitor:
+        import rossmann_monitor
+        monitor = rossmann_monitor
+
+    print( '{:<40} {:>10} {:>10} {:>14} {:>10}'.format( 'benchmark', 'rows', 'seconds', 'rows/s', 'peak MB' ) )
+
+    results = []
+    for rows in [ int( r ) for r in args.rows.split( ',' ) ]:
+        results += run_benchmarks( rows, args.repeat, pipeline, lean, model, trees, client, monitor, df_test )
+
+    # payload size and latency of each request / response format, largest input size
+    if client is not None:
+        results += run_formats( max( int( r ) for r in args.rows.split( ',' ) ), args.repeat, pipeline, client, df_test )
+
+    if args.cold_start and model is not None:
+        results += run_cold_start( args.repeat, model, df_test )
+
+    if args.monitor_backends and model is not None and monitor is not None:
+        results += run_monitor_backends( args.repeat, monitor, df_test )
+
+    if args.load and model is not None:
+        results += run_load( args.load, args.load_clients, [ float( w ) for w in args.load_windows.split( ',' ) ], df_test )
+
+    if args.asgi_workers and model is not None:
+        results += run_asgi_scaling( args.load or 10, args.load_clients, [ int( w ) for w in args.asgi_workers.split( ',' ) ], args.asgi_rows, df_test )
+
+    stream = None
+    if args.stream and model is not None:
+        stream   = run_stream_benchmark( args.stream, args.stream_chunksize, df_test )
+        results += [ stream ]
+
+    report = { 'created' : datetime.datetime.now().isoformat( timespec='seconds' ),
+               'python'  : platform.python_version(),
+               'machine' : platform.machine(),
+               'cpus'    : os.cpu_count(),
+               'results' : results }
+
+    if args.output:
+        with open( args.output, 'w' ) as f:
+            json.dump( report, f, indent=2 )
+
+    if args.baseline:
+        with open( args.baseline ) as f:
+            baseline = json.load( f )
+
+        if compare( results, baseline, args.threshold ):
+            sys.exit( 1 )
+
+    if stream is not None and stream['stream_rss_mb'] > args.stream_max_mb:
+        print( 'stream peak rss grew {:.1f}MB, more than {:.0f}MB'.format( stream['stream_rss_mb'], args.stream_max_mb ) )
+        sys.exit( 1 )
+
+    return None
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+# Feature store of a store x date grid: built once, scored many times by read -> slice -> predict
+#   python rossmann_features.py build features/ --start 2015-08-01 --end 2015-09-11 [--calendar calendar.csv]
+#   python rossmann_features.py score features/ --start 2015-08-01 --end 2015-08-07 --stores 1,2,3 --output predictions.csv
+# calendar.csv: date ( and store ) plus any of promo, state_holiday, school_holiday, open
+import pandas as pd
+
+import argparse
+import pickle
+import time
+import os
+
+from api.rossmann.ParameterRegistry import ParameterRegistry
+from api.rossmann.Rossmann          import Rossmann
+from api.rossmann.FeatureStore      import FeatureStore
+
+def main():
+    parser = argparse.ArgumentParser( description='Rossmann feature store' )
+    parser.add_argument( 'command', choices=['build', 'score'] )
+    parser.add_argument( 'path', help='feature store directory' )
+    parser.add_argument( '--start' )
+    parser.add_argument( '--end' )
+    parser.add_argument( '--stores', help='comma separated store ids, default every store' )
+    parser.add_argument( '--calendar', help='csv with promo / holiday / open values by date ( and store )' )
+    parser.add_argument( '--output', help='predictions file ( .csv or .parquet )' )
+    parser.add_argument( '--path-model', default=os.environ.get( 'path_model', ParameterRegistry.default_path_model ) )
+    parser.add_argument( '--path-params', default=os.environ.get( 'path_params' ) )
+    parser.add_argument( '--path-store', default=os.environ.get( 'path_store', ParameterRegistry.default_path_store ) )
+    args = parser.parse_args()
+
+    pipeline = Rossmann( args.path_params, args.path_store )
+    store    = FeatureStore( args.path )
+    stores   = [ int( s ) for s in args.stores.split( ',' ) ] if args.stores else None
+    start    = time.perf_counter()
+
+    if args.command == 'build':
+        calendars = pd.read_csv( args.calendar ) if args.calendar else None
+        store.build( pipeline, stores, args.start, args.end, calendars )
+
+        shape = store.features.shape
+        print( 'built {} days x {} stores x {} features in {:.2f}s'.format( shape[0], shape[1], shape[2], time.perf_counter() - start ) )
+
+        return None
+
+    store.check( pipeline )
+
+    with open( args.path_model, 'rb' ) as f:
+        model = pickle.load( f )
+
+    df_pred = store.predict( model, stores, args.start, args.end )
+    print( 'scored {:,} store-days in {:.2f}s'.format( len( df_pred ), time.perf_counter() - start ) )
+
+    if args.output:
+        if args.output.endswith( '.parquet' ):
+            df_pred.to_parquet( args.output, index=False )
+
+        else:
+            df_pred.to_csv( args.output, index=False )
+
+    return None
+
+if __name__ == '__main__':
+    main()
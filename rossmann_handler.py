@@ -1,53 +1,316 @@
-from   flask             import Flask, request, Response
-from   api.rossmann.Rossmann import Rossmann
+# startup instrumentation: seconds of the imports, of the model and parameter loading and of the whole module
+# ( GET /rossmann/startup ); python -X importtime gives the time of each imported module
+import time
+startup_start = time.perf_counter()
+
+from   flask             import Flask, request, Response, stream_with_context
+from   api.rossmann.ParameterRegistry import ParameterRegistry
+from   api.rossmann.MicroBatcher      import MicroBatcher
+from   api.rossmann.PredictionCache   import PredictionCache
+from   api.rossmann.PipelineMetrics   import PipelineMetrics
+from   api.rossmann.Rossmann          import Rossmann
 import pandas as pd
-import pickle
+import tracemalloc
+import threading
+import signal
+import gzip
+import zlib
+import json
 import os
 
-# loading model 
-local_path_model = '/home/datamendes/comunidadeds/projetos/rossmann_store_sales/model/model_rossmann.pkl'
-model  = pickle.load( open( os.environ.get( 'path_model', local_path_model) , 'rb' ) )
+startup = { 'imports': time.perf_counter() - startup_start }
+
+# optional warm-up prediction with the first rows of a csv file ( same columns of the request, ex: data/test.csv without sales )
+warm_up = None
+if os.environ.get( 'path_warm_up' ):
+    warm_up = pd.read_csv( os.environ.get( 'path_warm_up' ), nrows=100 ).drop( columns=['sales'], errors='ignore' )
+
+# loading model and parameters once per process
+# inference_backend=numpy evaluates the trees with TreeEnsemble ( NumPy ) instead of xgboost
+# low_memory=1 builds the features with compact dtypes and without intermediate columns ( Rossmann.lean_features )
+registry = ParameterRegistry( os.environ.get( 'path_model', ParameterRegistry.default_path_model ),
+                              path_params=os.environ.get( 'path_params' ),
+                              path_store=os.environ.get( 'path_store', ParameterRegistry.default_path_store ),
+                              warm_up=warm_up,
+                              backend=os.environ.get( 'inference_backend', 'xgboost' ),
+                              low_memory=os.environ.get( 'low_memory', '0' ) == '1' )
+registry.reload()
+
+startup.update( model_load=registry.params['model_load_time'], pipeline_load=registry.params['pipeline_load_time'],
+                warm_up=registry.params['warm_up_time'] )
+
+# optional prediction cache ( cache_max_mb > 0 ), per row, LRU eviction and cache_ttl seconds of expiration
+# cleared when the model/parameter files change and on every reload
+cache = None
+if float( os.environ.get( 'cache_max_mb', 0 ) ) > 0:
+    cache = PredictionCache( [ col for col in Rossmann.input_columns if col != 'customers' ],
+                             max_mb=float( os.environ.get( 'cache_max_mb' ) ),
+                             ttl=float( os.environ.get( 'cache_ttl', 3600 ) ),
+                             files=registry.files(),
+                             version=registry.version )
+
+def reload_params():
+    # the cache moves to the new version after the swap: writes of requests with the old parameters are dropped
+    params = registry.reload()
+    if cache is not None:
+        cache.clear( params['version'] )
+
+    return params
+
+# reload parameters on SIGHUP, in a thread: the signal handler runs in the main thread between two bytecodes,
+# possibly while it holds the registry lock ( not reentrant ) or is in the middle of a pickle load
+if hasattr( signal, 'SIGHUP' ):
+    signal.signal( signal.SIGHUP, lambda signum, frame: threading.Thread( target=reload_params, name='reload', daemon=True ).start() )
+
+# optional micro-batching: small requests ( up to batch_max_rows rows ) arriving within batch_window_ms
+# are predicted together in one batch
+def predict_batch( df ):
+    params = registry.get()
+    return params['pipeline'].predict_frame( params['model'], df )
+
+batcher = None
+if float( os.environ.get( 'batch_window_ms', 0 ) ) > 0:
+    batcher = MicroBatcher( predict_batch,
+                            max_wait=float( os.environ.get( 'batch_window_ms' ) ) / 1000,
+                            max_rows=int( os.environ.get( 'batch_max_rows', 1000 ) ) )
+
+# optional metrics ( metrics=1 ): stage latency, rows and payload histograms on /metrics
+# peak memory per request needs tracemalloc ( metrics_memory=1 ), it slows down the pipeline and it is approximate
+# with concurrent requests
+metrics      = PipelineMetrics() if os.environ.get( 'metrics' ) == '1' else None
+trace_memory = metrics is not None and os.environ.get( 'metrics_memory' ) == '1'
+if trace_memory:
+    tracemalloc.start()
+
+# request bodies with Content-Encoding gzip are decompressed; responses are compressed with gzip when the client
+# accepts it and the body has at least gzip_min_bytes bytes ( gzip_min_bytes=0, the default, never compresses )
+gzip_min_bytes = int( os.environ.get( 'gzip_min_bytes', 0 ) )
+
+def request_body():
+    body = request.get_data()
+    if request.headers.get( 'Content-Encoding' ) != 'gzip':
+        return body
+
+    try:
+        return gzip.decompress( body )
+
+    except ( OSError, EOFError, zlib.error ) as e:
+        raise ValueError( 'invalid gzip body: {}'.format( e ) )
+
+def request_stream():
+    return gzip.GzipFile( fileobj=request.stream ) if request.headers.get( 'Content-Encoding' ) == 'gzip' else request.stream
+
+def request_timings():
+    # stage timings of this request, None ( no timing at all ) unless metrics are enabled or the request header
+    # X-Rossmann-Timing asks for the stage breakdown
+    if metrics is None and not request.headers.get( 'X-Rossmann-Timing' ):
+        return None
+
+    if trace_memory:
+        tracemalloc.reset_peak()
+
+    return {}
+
+def observe_request( response, timings, start, rows=None, response_bytes=None ):
+    if timings is None:
+        return response
+
+    timings['total'] = time.perf_counter() - start
+
+    if metrics is not None:
+        metrics.observe_request( timings, rows=rows, request_bytes=request.content_length,
+                                 response_bytes=response_bytes if response_bytes is not None else response.content_length,
+                                 peak_memory=tracemalloc.get_traced_memory()[1] if trace_memory else None )
+
+    # stage breakdown in the Server-Timing header, durations in milliseconds
+    if request.headers.get( 'X-Rossmann-Timing' ) and not response.is_streamed:
+        response.headers['Server-Timing'] = ', '.join( '{};dur={:.3f}'.format( stage, seconds * 1000 ) for stage, seconds in timings.items() )
+
+    return response
+
+def count_rows( frames, counter ):
+    # predicted chunks passed through, their rows added to counter['rows']
+    for df in frames:
+        counter['rows'] += len( df )
+        yield df
+
+def observe_stream( pieces, timings, start, counter ):
+    # chunked responses: the request is observed when the last piece is sent, with the rows counted by count_rows
+    size = 0
+    for piece in pieces:
+        size += len( piece )
+        yield piece
+
+    if timings is not None:
+        observe_request( Response(), timings, start, rows=counter['rows'], response_bytes=size )
+
+def predict_rows( pipeline, model, df, timings=None, version=None ):
+    # sales_predictions of df ( full payload layout ) through the prediction cache and the micro-batcher, when enabled
+    # version: registry version of pipeline and model, the cache only serves and stores predictions of its version
+    if cache is not None:
+        keys      = cache.keys( df )
+        pred, hit = cache.get( keys, version )
+        if hit.all():
+            return pred
+
+        df = df[~hit]
+
+    if batcher is not None and len( df ) <= batcher.max_rows:
+        pred_miss = batcher.submit( df )
+
+    else:
+        pred_miss = pipeline.predict_frame( model, df, timings )['sales_predictions'].to_numpy()
+
+    if cache is None:
+        return pred_miss
+
+    cache.put( keys[~hit], pred_miss, version )
+    pred[~hit] = pred_miss
+
+    return pred
 
 # Initialize API
 app = Flask( __name__ )
 @app.route( '/rossmann/predict', methods=['POST'] )
 def rossmann_predict():
-    test_json = request.get_json()
+    start   = time.perf_counter()
+    timings = request_timings()
 
-    # there is data
-    if test_json:
+    # Parameters snapshot - a reload during this request does not affect it
+    params   = registry.get()
+    model    = params['model']
+    pipeline = params['pipeline']
 
-        # Unique Example
-        if isinstance( test_json, dict ):
-            df_test_raw = pd.DataFrame( test_json, index=[0] )
-        
-        # Multiple Examples
-        else:
-            df_test_raw = pd.DataFrame( test_json, columns=test_json[0].keys() )
+    # chunked mode: csv or ndjson body, read and predicted chunksize rows at a time and streamed back
+    # ( ndjson by default, csv with Accept text/csv )
+    if request.mimetype in ( 'text/csv', 'application/x-ndjson' ):
+        chunksize = request.args.get( 'chunksize', 10000, type=int )
+        mimetype  = request.accept_mimetypes.best_match( ['application/x-ndjson', 'text/csv'], default='application/x-ndjson' )
+        columns   = ['store', 'date', 'sales_predictions'] if request.args.get( 'output' ) == 'predictions' else None
 
-        # Instanciate Rossmann Class
-        pipeline = Rossmann()
+        counter     = { 'rows': 0 }
+        chunks      = pipeline.read_chunks( request_stream(), request.mimetype, chunksize )
+        df_response = pipeline.write_chunks( count_rows( pipeline.predict_chunks( model, chunks, timings ), counter ), mimetype, columns )
 
-        # Data Cleaning
-        df_test = pipeline.data_cleaning( df_test_raw )
+        return Response( stream_with_context( observe_stream( df_response, timings, start, counter ) ), status=200, mimetype=mimetype )
 
-        # Feature Engineering
-        df_test = pipeline.feature_engineering( df_test )
+    try:
+        # request format: Content-Type application/json ( records or columns ) or application/x-npz
+        # Compact payload ( store, date, promo, state_holiday, school_holiday ): the pipeline joins the store attributes
+        # Full payload ( all columns of test.csv but sales ): used as it is
+        df_test_raw = pipeline.timed( timings, 'parse', pipeline.read_data, request_body(), request.mimetype )
 
-        # Data Preparation
-        df_test = pipeline.data_preparation( df_test )
+    except ValueError as e:
+        return Response( json.dumps( { 'error': str( e ) } ), status=400, mimetype='application/json' )
+
+    # there is data
+    if df_test_raw is not None:
 
-        # Prediction
-        df_response = pipeline.get_prediction( model, df_test_raw, df_test )
+        # response format: Accept application/x-npz, or json with orient=records ( default ) / orient=columns
+        # output=predictions returns only store, date and sales_predictions
+        mimetype = request.accept_mimetypes.best_match( ['application/json', 'application/x-npz'], default='application/json' )
+        orient   = 'npz' if mimetype == 'application/x-npz' else request.args.get( 'orient', 'records' )
+        columns  = ['store', 'date', 'sales_predictions'] if request.args.get( 'output' ) == 'predictions' else None
+        rows     = len( df_test_raw )
 
-        return df_response
+        # the response has the request columns plus sales_predictions ( NaN for closed stores ) in every mode:
+        # prediction cache, micro-batching and low memory mode through predict_rows, otherwise
+        # Data Cleaning -> Feature Engineering -> Data Preparation -> Prediction on a copy of the request columns
+        # invalid values ( ex: unseen store_type labels, also raised through the micro-batcher ) are bad requests
+        try:
+            if pipeline.low_memory or cache is not None or ( batcher is not None and len( df_test_raw ) <= batcher.max_rows ):
+                df_test_raw['sales_predictions'] = predict_rows( pipeline, model, pipeline.full_payload( df_test_raw ), timings, params['version'] )
+
+            else:
+                df_test_raw = pipeline.predict_frame( model, df_test_raw, timings )
+
+        except ValueError as e:
+            return Response( json.dumps( { 'error': str( e ) } ), status=400, mimetype='application/json' )
+
+        df_response = pipeline.timed( timings, 'serialize', pipeline.write_data, df_test_raw, orient, columns )
+
+        return observe_request( Response( df_response, status=200, mimetype=mimetype ), timings, start, rows )
 
     # there is no data
     else:
         return Response( '{}', status=200, mimetype='application/json' )
     
+# forecast of a store x date grid built here ( stores, date range and optional calendars in the request, see
+# Rossmann.read_forecast; without a calendar, stores are closed on sundays and open on the other days )
+# forecast_max_rows bounds the store-days of one request, forecast_chunk_rows the rows predicted at a time
+forecast_max_rows   = int( os.environ.get( 'forecast_max_rows', 1000000 ) )
+forecast_chunk_rows = int( os.environ.get( 'forecast_chunk_rows', 50000 ) )
+
+@app.route( '/rossmann/forecast', methods=['POST'] )
+def rossmann_forecast():
+    start   = time.perf_counter()
+    timings = request_timings()
+
+    params   = registry.get()
+    model    = params['model']
+    pipeline = params['pipeline']
+
+    try:
+        stores, first, last, calendars = pipeline.timed( timings, 'parse', pipeline.read_forecast, request_body() )
+        daily, weekly = pipeline.forecast( model, stores, first, last, calendars, chunk_rows=forecast_chunk_rows,
+                                           max_rows=forecast_max_rows, timings=timings )
 
+    except ValueError as e:
+        return Response( json.dumps( { 'error': str( e ) } ), status=400, mimetype='application/json' )
+
+    # output=daily or output=weekly returns only one of them, json orient=records ( default ) or orient=columns
+    orient  = request.args.get( 'orient', 'records' )
+    outputs = [ output for output in ( 'daily', 'weekly' ) if request.args.get( 'output', output ) == output ]
+    frames  = { 'daily': daily, 'weekly': weekly }
+
+    df_response = pipeline.timed( timings, 'serialize', lambda: '{' + ', '.join( '"{}": {}'.format( output, pipeline.write_data( frames[output], orient ) ) for output in outputs ) + '}' )
+
+    return observe_request( Response( df_response, status=200, mimetype='application/json' ), timings, start, len( daily ) )
+
+@app.after_request
+def compress_response( response ):
+    if ( gzip_min_bytes <= 0 or response.is_streamed or response.status_code != 200 or 'Content-Encoding' in response.headers
+         or 'gzip' not in request.headers.get( 'Accept-Encoding', '' ) or response.content_length < gzip_min_bytes ):
+        return response
+
+    response.set_data( gzip.compress( response.get_data(), compresslevel=int( os.environ.get( 'gzip_level', 6 ) ) ) )
+    response.headers['Content-Encoding'] = 'gzip'
+    response.headers['Vary'] = 'Accept-Encoding'
+
+    return response
+
+@app.route( '/rossmann/reload', methods=['POST'] )
+def rossmann_reload():
+    params = reload_params()
+
+    response = { 'version'      : params['version'],
+                 'load_time'    : params['load_time'],
+                 'warm_up_time' : params['warm_up_time'] }
+
+    return Response( json.dumps( response ), status=200, mimetype='application/json' )
     
+@app.route( '/rossmann/cache', methods=['GET'] )
+def rossmann_cache():
+    stats = cache.stats() if cache is not None else { 'enabled': False }
+
+    return Response( json.dumps( stats ), status=200, mimetype='application/json' )
+
+@app.route( '/rossmann/startup', methods=['GET'] )
+def rossmann_startup():
+    # pid: process of the startup times, worker_pid: process serving the request ( different under prefork )
+    return Response( json.dumps( dict( startup, worker_pid=os.getpid() ) ), status=200, mimetype='application/json' )
+
+@app.route( '/metrics', methods=['GET'] )
+def rossmann_metrics():
+    if metrics is None:
+        return Response( 'metrics are disabled\n', status=404, mimetype='text/plain' )
+
+    return Response( metrics.render(), status=200, mimetype='text/plain; version=0.0.4' )
+
+# pid of the process that loaded the module ( the parent under rossmann_prefork.py, whose workers inherit it )
+startup['total'] = time.perf_counter() - startup_start
+startup['pid']   = os.getpid()
+
 
 if __name__ == '__main__':
-    app.run( '0.0.0.0' )
\ No newline at end of file
+    app.run( '0.0.0.0' )
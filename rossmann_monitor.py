@@ -6,14 +6,23 @@ import streamlit            as st
 import plotly.express       as px
 import plotly.graph_objects as go
 
-import requests
+import concurrent.futures
 import json
 import math
 import datetime
+import gzip
 import os
 
-from  api.rossmann.Rossmann import Rossmann
-from  sklearn.metrics       import mean_absolute_error, mean_absolute_percentage_error
+# the backend libraries ( requests for http, the model and parameters for local ) are imported by the backend in use
+
+# prediction backend ( monitor_backend ):
+#   http  - POST to url ( default the Render´s server ), chunks of monitor_chunk_rows rows sent in parallel by
+#           monitor_workers threads over pooled connections, json records as every server version accepts;
+#           servers with the columns orient and gzip request bodies ( rossmann_handler.py, rossmann_asgi.py of this
+#           repository ) can be sent columns json ( monitor_columns=1 ) and gzip bodies ( monitor_gzip=1 )
+#   local - Rossmann pipeline and model loaded in this process ( path_model, path_params, path_store ), no serialization
+backend = os.environ.get( 'monitor_backend', 'http' )
+url     = os.environ.get( 'url', 'https://rossmann-ws.onrender.com/rossmann/predict' )
 
 def absolute_error(y, yhat):
     error = np.sum( yhat - y )
@@ -24,6 +33,7 @@ def sum_absolute_error( y, yhat ):
     return round( error, 2 )
 
 
+@st.cache_data
 def load_data( file ):
     # colect original test dataset
     df = pd.read_csv( file )
@@ -33,20 +43,76 @@ def load_data( file ):
 
     return df
 
-def grouped_stores( df ):
-    # store´s performance
-    df_store_sum = df[['store', 'sales', 'sales_predictions']].groupby( 'store' ).sum().reset_index()
-    df_store_avg = df[['store', 'sales', 'absolute_error']].groupby( 'store' ).mean().reset_index().rename( columns = { 'sales' : 'sales_avg',
-                                                                                                                        'absolute_error' : 'MAE' } )
-    
-    df_store = pd.merge( df_store_sum, df_store_avg, how='inner', on='store' )
+# baseline models of the comparative: name -> prediction of every row of df ( same rows, same order ), the mean sales
+# of a group computed with groupby-transform; a new baseline is one more entry
+baseline_models = { 'Simple Average'            : lambda df, df_original: np.full( len( df ), df_original['sales'].mean() ),
+                    'Store Average'             : lambda df, df_original: df['sales'].groupby( df['store'] ).transform( 'mean' ),
+                    'Store Date Average'        : lambda df, df_original: df['sales'].groupby( [ df['store'], df['date'] ] ).transform( 'mean' ),
+                    'Store Day of Week Average' : lambda df, df_original: df['sales'].groupby( [ df['store'], pd.to_datetime( df['date'] ).dt.dayofweek ] ).transform( 'mean' ) }
+
+def baseline_errors( df, df_original ):
+    # absolute error of every baseline model on every row of df: name -> array with one value per row
+    sales  = df['sales'].to_numpy( dtype=np.float64 )
+    errors = {}
+    for name, model in baseline_models.items():
+        pred = np.asarray( model( df, df_original ), dtype=np.float64 )
+        if len( pred ) != len( df ):
+            raise ValueError( 'baseline {} returned {} predictions for {} rows'.format( name, len( pred ), len( df ) ) )
+
+        errors[name] = np.abs( sales - pred )
+
+    return errors
+
+def build_aggregates( df, df_original ):
+    # sums and counts of one prediction run, per store x date and per store ( baseline models included ),
+    # built once: every metric, filter and chart is derived from them without touching the rows again
+    store_idx, stores = pd.factorize( df['store'], sort=True )
+    date_idx,  dates  = pd.factorize( df['date'], sort=True )
+    stores, dates     = np.asarray( stores ), np.asarray( dates )
+
+    shape = ( len( stores ), len( dates ) )
+    cell  = store_idx * shape[1] + date_idx
+    cells = lambda values: np.bincount( cell, weights=values, minlength=shape[0] * shape[1] ).reshape( shape ).astype( np.float64 )
+
+    aggregates = { 'stores'            : stores,
+                   'dates'             : dates,
+                   'count'             : cells( None ),
+                   'sales'             : cells( df['sales'].to_numpy( dtype=np.float64 ) ),
+                   'sales_predictions' : cells( df['sales_predictions'].to_numpy( dtype=np.float64 ) ),
+                   'absolute_error'    : cells( df['absolute_error'].to_numpy( dtype=np.float64 ) ) }
+
+    for col in ['count', 'sales', 'sales_predictions', 'absolute_error']:
+        aggregates['store_' + col] = aggregates[col].sum( axis=1 )
+        aggregates['date_' + col]  = aggregates[col].sum( axis=0 )
+
+    # baseline models: ( sum of absolute errors, number of predictions ) per store
+    store_count = aggregates['store_count']
+    per_store   = lambda values: np.bincount( store_idx, weights=values, minlength=shape[0] )
+
+    aggregates['models'] = { 'Rossmann': ( aggregates['store_absolute_error'], store_count ) }
+    for name, errors in baseline_errors( df, df_original ).items():
+        aggregates['models'][name] = ( per_store( errors ), store_count )
+
+    return aggregates
+
+def grouped_stores( aggregates, stores ):
+    # store´s performance, stores: boolean mask of the selected stores
+    stores = stores & ( aggregates['store_count'] > 0 )
+    count  = aggregates['store_count'][stores]
+
+    df_store = pd.DataFrame( { 'store'             : aggregates['stores'][stores],
+                               'sales'             : aggregates['store_sales'][stores],
+                               'sales_predictions' : aggregates['store_sales_predictions'][stores],
+                               'sales_avg'         : aggregates['store_sales'][stores] / count,
+                               'MAE'               : aggregates['store_absolute_error'][stores] / count } )
+
     df_store['MAPE'] = round( ( df_store['MAE'] / df_store['sales_avg'] ) * 100, 2)
     df_result = df_store.sort_values( 'MAPE').reset_index()
 
     return df_result
 
-def score_of_stores( df, score_radio, score_slider):
-    df_store = grouped_stores( df )
+def score_of_stores( aggregates, score_radio, score_slider):
+    df_store = grouped_stores( aggregates, np.ones( len( aggregates['stores'] ), dtype=bool ) )
     df_store = df_store.sort_values( 'MAPE', ascending= ( score_radio == 'Best' ) ).reset_index()
     df_store = df_store.head(score_slider)
 
@@ -61,48 +127,106 @@ def error_range( df ):
 
     return df['range'].values
 
+@st.cache_resource
+def load_registry():
+    # local backend: model and parameters loaded once, kept across reruns
+    from api.rossmann.ParameterRegistry import ParameterRegistry
+
+    registry = ParameterRegistry( os.environ.get( 'path_model', ParameterRegistry.default_path_model ),
+                                  path_params=os.environ.get( 'path_params' ),
+                                  path_store=os.environ.get( 'path_store', ParameterRegistry.default_path_store ),
+                                  backend=os.environ.get( 'inference_backend', 'xgboost' ),
+                                  low_memory=os.environ.get( 'low_memory', '0' ) == '1' )
+    registry.reload()
+
+    return registry
+
+@st.cache_resource
+def http_session( workers ):
+    # http backend: one session, a pool of keep-alive connections shared by the request threads
+    import requests
+
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter( pool_connections=1, pool_maxsize=workers )
+    session.mount( 'http://', adapter )
+    session.mount( 'https://', adapter )
+
+    return session
+
+def predict_local( x_test ):
+    params = load_registry().get()
+
+    return params['pipeline'].predict_frame( params['model'], x_test.copy() )['sales_predictions'].to_numpy()
+
+def post_chunk( session, x_chunk, columns, compress ):
+    # json records by default; columns json and only the predictions back with columns, the rows in both cases
+    if columns:
+        data   = json.dumps( { col: x_chunk[col].tolist() for col in x_chunk.columns } ).encode()
+        params = { 'orient': 'columns', 'output': 'predictions' }
+
+    else:
+        data   = json.dumps( x_chunk.to_dict( orient='records' ) ).encode()
+        params = None
+
+    headers = { 'Content-type' : 'application/json' }
+    if compress:
+        data = gzip.compress( data, compresslevel=1 )
+        headers['Content-Encoding'] = 'gzip'
+
+    response = session.post( url, data=data, headers=headers, params=params )
+    response.raise_for_status()
+
+    # parsed once
+    return pd.DataFrame( response.json() )['sales_predictions'].to_numpy( dtype=np.float64 )
+
+def predict_http( x_test ):
+    chunk_rows = int( os.environ.get( 'monitor_chunk_rows', 10000 ) )
+    workers    = int( os.environ.get( 'monitor_workers', 4 ) )
+    columns    = os.environ.get( 'monitor_columns', '0' ) == '1'
+    compress   = os.environ.get( 'monitor_gzip', '0' ) == '1'
+    session    = http_session( workers )
+
+    # full payload without the pandas index ( NaN -> null ), rows predicted in order
+    x_test = x_test.astype( object ).where( x_test.notna(), None )
+    chunks = [ x_test.iloc[i:i + chunk_rows] for i in range( 0, len( x_test ), chunk_rows ) ]
+
+    with concurrent.futures.ThreadPoolExecutor( max_workers=workers ) as executor:
+        preds = list( executor.map( lambda x_chunk: post_chunk( session, x_chunk, columns, compress ), chunks ) )
+
+    return np.concatenate( preds ) if preds else np.array( [] )
+
 def apply_model( x_test ):
     # drop sales columns
     y_test = x_test['sales'].values
     x_test = x_test.drop( ['sales'], axis=1 )
 
-    # convert dataframe to json
-    data_json = json.dumps( x_test.to_dict( orient='records' ) )
-
-    # local request
-    #local_url = 'http://0.0.0.0:5000/rossmann/predict'
-    #url = os.environ.get( 'url', local_url)
-
-    # Render´s Server request
-    url = 'https://rossmann-ws.onrender.com/rossmann/predict'
-
-    # API CALL  
-    header = { 'Content-type' : 'application/json' }
-    response = requests.post( url, data=data_json, headers=header ) 
+    pred = predict_local( x_test ) if backend == 'local' else predict_http( x_test )
 
     # return dataframe with predictions
-    df = pd.DataFrame( response.json(), columns=response.json()[0].keys() )
-    df = df[['store', 'date', 'sales_predictions']]
+    df = pd.DataFrame( { 'store'             : x_test['store'].to_numpy(),
+                         'date'              : x_test['date'].to_numpy(),
+                         'sales_predictions' : pred } )
 
     df['sales']          = y_test
     df['absolute_error'] = np.abs( y_test - df['sales_predictions'].values )
 
     return df
 
-def model_metrics( df ):
-    stores            = df['store'].nunique()
-    sales             = df['sales'].sum() 
-    sales_predictions = df['sales_predictions'].sum() 
-    sales_average     = df['sales'].mean()
-    MAE               = df['absolute_error'].mean()
+def model_metrics( aggregates, stores ):
+    count             = aggregates['store_count'][stores].sum()
+    n_stores          = ( aggregates['store_count'][stores] > 0 ).sum()
+    sales             = aggregates['store_sales'][stores].sum()
+    sales_predictions = aggregates['store_sales_predictions'][stores].sum()
+    sales_average     = sales / count
+    MAE               = aggregates['store_absolute_error'][stores].sum() / count
     MAPE              = round( ( MAE / sales_average ) * 100, 2 )
-    SAR               = sum_absolute_error( df['sales'].values , df['sales_predictions'].values )
+    SAR               = round( aggregates['store_absolute_error'][stores].sum(), 2 )
 
     with st.container():
         col1, col2, col3, col4, col5, col6 = st.columns ( 6, gap='small' )
     
         with col1:
-            st.metric( label='Stores',  value='{:,.0f}'.format( stores ), help='Number of stores' )      
+            st.metric( label='Stores',  value='{:,.0f}'.format( n_stores ), help='Number of stores' )      
 
         with col2:
             st.metric( label='Sales Average',  value='{:,.2f}'.format( sales_average ), delta='{:,.2f}'.format( sales ) , help='Sales average')      
@@ -121,8 +245,18 @@ def model_metrics( df ):
 
         return None
     
-def error_average_chart( df ):
-    df_grouped = df[['date', 'absolute_error', 'sales']].groupby( 'date' ).mean().reset_index()
+def error_average_chart( aggregates, stores ):
+    # per date averages: totals of the run when all stores are selected, otherwise summed over the selected stores
+    if stores.all():
+        count, absolute_error, sales = aggregates['date_count'], aggregates['date_absolute_error'], aggregates['date_sales']
+
+    else:
+        count, absolute_error, sales = [ aggregates[col][stores].sum( axis=0 ) for col in ['count', 'absolute_error', 'sales'] ]
+
+    dates      = count > 0
+    df_grouped = pd.DataFrame( { 'date'           : aggregates['dates'][dates],
+                                 'absolute_error' : absolute_error[dates] / count[dates],
+                                 'sales'          : sales[dates] / count[dates] } )
 
     with st.container():
         fig = go.Figure()
@@ -145,9 +279,11 @@ def error_average_chart( df ):
 
     return None
 
-def error_range_chart( df ):
-    df_error_range         = df[['store', 'absolute_error', 'sales']].groupby( 'store' ).mean().reset_index()
-    df_error_range['MAPE'] = df_error_range['absolute_error'] / df_error_range['sales'] * 100
+def error_range_table( aggregates, stores ):
+    stores = stores & ( aggregates['store_count'] > 0 )
+
+    df_error_range         = pd.DataFrame( { 'store': aggregates['stores'][stores] } )
+    df_error_range['MAPE'] = aggregates['store_absolute_error'][stores] / aggregates['store_sales'][stores] * 100
     df_error_range['range'] = error_range( df_error_range )
     
     df_error_range = ( df_error_range[['range', 'store']]
@@ -166,6 +302,11 @@ def error_range_chart( df ):
     df_error_range['acum_count_range'] = acum_range
     df_error_range['diff_count_range'] = df_error_range['acum_count_range'] - df_error_range['count_range']
 
+    return df_error_range
+
+def error_range_chart( aggregates, stores ):
+    df_error_range = error_range_table( aggregates, stores )
+
     list_range            = df_error_range['range'].values
     list_count_range      = df_error_range['count_range'].values
     list_acum_count_range = df_error_range['acum_count_range'].values
@@ -189,65 +330,48 @@ def error_range_chart( df ):
 
     return None
 
-def averaging_models_comparative( df_predictions, df_original ):
-    # create rossmann model dataframe
-    df_rossmann = df_predictions.copy()
-    df_rossmann['model'] = 'Rossmann'
-    MAE_rossmann = df_rossmann['absolute_error'].mean()
-
-    # create simple average model dataframe
-    df_avg_full = df_predictions.copy()
-    df_avg_full['sales_predictions'] = df_original['sales'].mean()
-    df_avg_full['absolute_error']    = np.abs( df_avg_full['sales'] - df_avg_full['sales_predictions'] )
-    df_avg_full['model']             = 'Simple Average'
-    
-    # create average store dataframe
-    df_avg_store = df_predictions.copy()
-    df_avg_store_grouped = df_avg_store[['store', 'sales']].groupby( 'store' ).mean().reset_index().rename( columns = {'sales' :  'avg_store' } )
-    df_avg_store = pd.merge( df_avg_store, df_avg_store_grouped, how='left', on='store' )
-    df_avg_store['sales_predictions'] = df_avg_store['avg_store']
-    df_avg_store['absolute_error']    = np.abs( df_avg_store['sales'] - df_avg_store['sales_predictions'] )
-    df_avg_store['model']             = 'Store Average'
-    df_avg_store = df_avg_store.drop( columns=['avg_store'], axis=1 )
-
-    # create average store_date dataframe
-    df_avg_store_date                      = df_predictions.copy()
-    df_avg_store_date_grouped              = df_avg_store_date[['store', 'date', 'sales']].groupby( ['store','date'] ).mean().reset_index().rename( columns = {'sales' :  'avg_store_date' } )
-    df_avg_store_date                      = pd.merge( df_avg_store_date, df_avg_store_date_grouped, how='left', on='store' )
-    df_avg_store_date['sales_predictions'] = df_avg_store_date['avg_store_date']
-    df_avg_store_date['absolute_error']    = np.abs( df_avg_store_date['sales'] - df_avg_store_date['sales_predictions'] )
-    df_avg_store_date['model']             = 'Store Date Average'
-    df_avg_store_date                      = df_avg_store_date.drop( columns=['avg_store_date'], axis=1 )
-
-    # concatenate all models dataframe
-    df_pred = pd.concat( [df_rossmann, df_avg_full, df_avg_store, df_avg_store_date] )
-
-    df_pred_model = df_pred[['model', 'absolute_error']].groupby(['model']).mean().sort_values('absolute_error').reset_index()
+def averaging_models_table( aggregates, stores ):
+    # MAE of each model over the selected stores
+    stores = stores & ( aggregates['store_count'] > 0 )
+    models = aggregates['models']
+
+    df_pred_model = pd.DataFrame( { 'model'          : list( models.keys() ),
+                                    'absolute_error' : [ error[stores].sum() / count[stores].sum() for error, count in models.values() ] } )
+
+    df_pred_model = df_pred_model.sort_values('absolute_error').reset_index( drop=True )
+    MAE_rossmann  = df_pred_model.loc[df_pred_model['model'] == 'Rossmann', 'absolute_error'].iloc[0]
     df_pred_model['absolute_error_perc']   = ( df_pred_model['absolute_error'] - MAE_rossmann ) / MAE_rossmann * 100
-    df_pred_model['absolute_error_text']   = df_pred_model.apply( lambda x: ( str ( round( x['absolute_error']     , 2 ) ) + ' ( +' +  
-                                                                              str ( round( x['absolute_error_perc'], 2 ) ) + '% )' ), axis=1 )
-    
-    fig = px.bar( df_pred_model, x='model', y='absolute_error', text='absolute_error_text') 
-    fig.update_layout(title='MAE x Models Chart', yaxis_title='MAE - Mean Absolute Error', xaxis_title='Models' )
-    st.plotly_chart( fig, use_container_width=True )
+    df_pred_model['absolute_error_text']   = df_pred_model.apply( lambda x: ( str ( round( x['absolute_error']     , 2 ) ) + ' ( ' +  
+                                                                              '{:+}'.format( round( x['absolute_error_perc'], 2 ) ) + '% )' ), axis=1 )
+
+    # best model of each store ( lowest MAE, ties count for every tied model )
+    store_error = np.column_stack( [ error[stores] / count[stores] for error, count in models.values() ] )
+    best        = store_error == store_error.min( axis=1, keepdims=True )
 
-    df_pred_store_model = df_pred[['store', 'model', 'absolute_error']].groupby(['store', 'model']).mean().sort_values('absolute_error').reset_index()
-    df_pred_store       = df_pred_store_model[['store', 'absolute_error']].groupby(['store']).min().sort_values('absolute_error').reset_index()
-    df_pred_store       = pd.merge( df_pred_store, df_pred_store_model, how='inner', on=['store', 'absolute_error'])
-    df_pred_store       = df_pred_store[['model', 'store']].groupby('model').count().reset_index().rename( columns= {'store': 'count'})
+    df_pred_store = pd.DataFrame( { 'model': list( models.keys() ), 'count': best.sum( axis=0 ) } )
+    df_pred_store = df_pred_store[df_pred_store['count'] > 0].sort_values( 'model' ).reset_index( drop=True )
 
     count_sum = df_pred_store['count'].sum()
     df_pred_store['count_text'] = df_pred_store['count'].apply( lambda x: ( str( x ) + ' ( ' +  
                                                                             str( round( x / count_sum * 100, 2 ) ) + '% )' ) )
 
+    return df_pred_model, df_pred_store
+
+def averaging_models_comparative( aggregates, stores ):
+    df_pred_model, df_pred_store = averaging_models_table( aggregates, stores )
+
+    fig = px.bar( df_pred_model, x='model', y='absolute_error', text='absolute_error_text') 
+    fig.update_layout(title='MAE x Models Chart', yaxis_title='MAE - Mean Absolute Error', xaxis_title='Models' )
+    st.plotly_chart( fig, use_container_width=True )
+
     fig = px.bar( df_pred_store, x='model', y='count', text='count_text') 
     fig.update_layout(title='Quantity of stores x Models Chart', yaxis_title='Quantity of stores', xaxis_title='Models' )
     st.plotly_chart( fig, use_container_width=True )
     
     return None
 
-def table_of_stores( df ):
-    df_table = grouped_stores( df )
+def table_of_stores( aggregates, stores ):
+    df_table = grouped_stores( aggregates, stores )
     df_table['range'] = error_range( df_table )
 
     st.dataframe(df_table, hide_index=True )
@@ -293,16 +417,22 @@ def main():
     
     button = st.sidebar.button('Apply Model', type='primary')
 
+    # the aggregates of a prediction run are kept across reruns, filters are applied to them without a new run
     if button:
         df_pred = apply_model( x_test )
+        st.session_state['aggregates'] = build_aggregates( df_pred, x_test )
+
+    if 'aggregates' in st.session_state:
+        aggregates = st.session_state['aggregates']
+        stores     = np.ones( len( aggregates['stores'] ), dtype=bool )
 
         if option == 'Score of stores':
-            df_pred = df_pred[ df_pred['store'].isin( score_of_stores( df_pred, score_radio, score_slider ) ) ]
+            stores = np.isin( aggregates['stores'], score_of_stores( aggregates, score_radio, score_slider ) )
 
         elif option == 'Choose stores':
-            df_pred = df_pred[ df_pred['store'].isin( choose_select ) ]
+            stores = np.isin( aggregates['stores'], choose_select )
 
-        model_metrics( df_pred )
+        model_metrics( aggregates, stores )
 
         tab1, tab2, tab3, tab4 = st.tabs( ['Error Average', 
                                            'Error Range', 
@@ -310,16 +440,16 @@ def main():
                                            'Table of Stores'] )
 
         with tab1: 
-            error_average_chart( df_pred )   
+            error_average_chart( aggregates, stores )   
 
         with tab2:
-            error_range_chart( df_pred )            
+            error_range_chart( aggregates, stores )            
 
         with tab3: 
-            averaging_models_comparative( df_pred, x_test )
+            averaging_models_comparative( aggregates, stores )
 
         with tab4: 
-            table_of_stores( df_pred )
+            table_of_stores( aggregates, stores )
 
     return None
    
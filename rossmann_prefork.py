@@ -0,0 +1,149 @@
+# Prefork server: python rossmann_prefork.py --port 5000 --workers 4
+# Same routes of rossmann_handler.py. The parent imports rossmann_handler ( model, scalers and store table loaded once ),
+# opens the listening socket and forks the workers, which share the loaded objects copy-on-write and accept on the
+# same socket; each worker serves one request at a time ( wsgiref ). gc.freeze moves the loaded objects out of the
+# garbage collector before fork, so collections in the workers do not write to ( and copy ) their pages.
+#   SIGHUP          - the parent reloads the parameters and replaces the workers, in-flight requests finish
+#   SIGTERM, SIGINT - the workers finish their request and the server stops
+# Dead workers are replaced. Startup times of the parent: GET /rossmann/startup ( pid of the parent, worker_pid of the
+# worker that answered ).
+import wsgiref.simple_server
+import socketserver
+import traceback
+import argparse
+import signal
+import socket
+import time
+import gc
+import os
+
+import rossmann_handler
+
+
+class QuietHandler( wsgiref.simple_server.WSGIRequestHandler ):
+    # no access log line per request
+    def log_message( self, format, *args ):
+        return None
+
+class WorkerServer( wsgiref.simple_server.WSGIServer ):
+    # WSGI server on the socket opened by the parent
+    def __init__( self, sock, app ):
+        socketserver.BaseServer.__init__( self, sock.getsockname(), QuietHandler )
+        self.socket      = sock
+        self.server_name = sock.getsockname()[0]
+        self.server_port = sock.getsockname()[1]
+        self.setup_environ()
+        self.set_app( app )
+
+def serve( sock ):
+    # worker loop, returns when the parent asks the worker to stop ( SIGTERM ) or is gone: handle_request waits at
+    # most the socket timeout for a connection
+    running = [ True ]
+    signal.signal( signal.SIGTERM, lambda signum, frame: running.__setitem__( 0, False ) )
+    signal.signal( signal.SIGINT, signal.SIG_IGN )
+    signal.signal( signal.SIGHUP, signal.SIG_IGN )
+
+    parent = os.getppid()
+    server = WorkerServer( sock, rossmann_handler.app )
+    while running[0] and os.getppid() == parent:
+        server.handle_request()
+
+    return None
+
+def fork_worker( sock ):
+    pid = os.fork()
+    if pid == 0:
+        status = 0
+        try:
+            serve( sock )
+
+        except BaseException:
+            traceback.print_exc()
+            status = 1
+
+        finally:
+            os._exit( status )
+
+    return pid
+
+def fork_workers( sock, count ):
+    # objects loaded so far are never collected in the workers: their memory pages stay shared
+    gc.collect()
+    gc.freeze()
+
+    return { fork_worker( sock ) for _ in range( count ) }
+
+def stop_workers( pids ):
+    for pid in pids:
+        try:
+            os.kill( pid, signal.SIGTERM )
+
+        except ProcessLookupError:
+            pass
+
+    return None
+
+def main():
+    parser = argparse.ArgumentParser( description='Rossmann prefork server' )
+    parser.add_argument( '--host', default='0.0.0.0' )
+    parser.add_argument( '--port', type=int, default=int( os.environ.get( 'PORT', 5000 ) ) )
+    parser.add_argument( '--workers', type=int, default=int( os.environ.get( 'workers', os.cpu_count() ) ) )
+    parser.add_argument( '--backlog', type=int, default=128 )
+    args = parser.parse_args()
+
+    # with a timeout, the accept of a connection taken by another worker gives up instead of blocking the worker
+    # ( the accepted connections are blocking )
+    sock = socket.create_server( ( args.host, args.port ), backlog=args.backlog )
+    sock.settimeout( 0.5 )
+
+    events = { 'reload': False, 'stop': False }
+    signal.signal( signal.SIGHUP, lambda signum, frame: events.__setitem__( 'reload', True ) )
+    signal.signal( signal.SIGTERM, lambda signum, frame: events.__setitem__( 'stop', True ) )
+    signal.signal( signal.SIGINT, lambda signum, frame: events.__setitem__( 'stop', True ) )
+
+    workers = fork_workers( sock, args.workers )
+    print( 'serving on {}:{} with {} workers, startup {:.3f}s ( imports {:.3f}s, model {:.3f}s, parameters {:.3f}s )'.format(
+           args.host, args.port, args.workers, rossmann_handler.startup['total'], rossmann_handler.startup['imports'],
+           rossmann_handler.startup['model_load'], rossmann_handler.startup['pipeline_load'] ), flush=True )
+
+    while not events['stop']:
+        if events['reload']:
+            events['reload'] = False
+
+            # new workers with the new parameters first, then the old ones finish their request and exit
+            gc.unfreeze()
+            rossmann_handler.reload_params()
+
+            old_workers = workers
+            workers     = fork_workers( sock, args.workers )
+            stop_workers( old_workers )
+
+        # reap exited workers, replacing the ones of the current generation
+        while True:
+            try:
+                pid, status = os.waitpid( -1, os.WNOHANG )
+
+            except ChildProcessError:
+                break
+
+            if pid == 0:
+                break
+
+            if pid in workers and not events['stop']:
+                workers.discard( pid )
+                workers.add( fork_worker( sock ) )
+
+        time.sleep( 0.1 )
+
+    stop_workers( workers )
+    for pid in workers:
+        try:
+            os.waitpid( pid, 0 )
+
+        except ChildProcessError:
+            pass
+
+    return None
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+# shared fixtures: the pipeline with the parameters and the store table of the repository, the rows of data/test.csv
+# and a small model trained on them ( the production model is not part of the repository )
+import pandas as pd
+import numpy  as np
+import pickle
+import sys
+import os
+
+import pytest
+
+root = os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) )
+sys.path.insert( 0, root )
+
+from api.rossmann.Rossmann import Rossmann
+
+path_params = os.path.join( root, 'parameters', '' )
+path_store  = os.path.join( root, 'data', 'store.csv' )
+path_test   = os.path.join( root, 'data', 'test.csv' )
+
+@pytest.fixture( scope='session' )
+def sales_data():
+    # data/test.csv, full payload plus sales
+    return pd.read_csv( path_test )
+
+@pytest.fixture( scope='session' )
+def test_data( sales_data ):
+    # full payload ( test.csv without sales ), closed stores included
+    return sales_data.drop( columns=['sales'] )
+
+@pytest.fixture
+def pipeline():
+    return Rossmann( path_params, path_store )
+
+@pytest.fixture
+def lean_pipeline():
+    return Rossmann( path_params, path_store, low_memory=True )
+
+@pytest.fixture( scope='session' )
+def model( sales_data ):
+    import xgboost as xgb
+
+    pipeline = Rossmann( path_params, path_store )
+    df       = sales_data[sales_data['open'] != 0]
+    X        = pipeline.data_preparation( pipeline.feature_engineering( pipeline.data_cleaning( df.drop( columns=['sales'] ) ) ) )
+
+    model = xgb.XGBRegressor( n_estimators=20, max_depth=4, learning_rate=0.3, n_jobs=1 )
+    model.fit( X, np.log1p( df['sales'].to_numpy() ) )
+
+    return model
+
+@pytest.fixture( scope='session' )
+def path_model( model, tmp_path_factory ):
+    path = tmp_path_factory.mktemp( 'model' ) / 'model_rossmann.pkl'
+    with open( path, 'wb' ) as f:
+        pickle.dump( model, f )
+
+    return str( path )
@@ -0,0 +1,78 @@
+# rossmann_asgi.py app called with asgi messages, one pool worker
+import pandas as pd
+import importlib
+import asyncio
+import gzip
+import json
+
+import pytest
+
+from conftest import path_params, path_store
+
+@pytest.fixture
+def asgi( path_model, monkeypatch ):
+    for name in ['inference_backend', 'low_memory']:
+        monkeypatch.delenv( name, raising=False )
+
+    monkeypatch.setenv( 'path_model', path_model )
+    monkeypatch.setenv( 'path_params', path_params )
+    monkeypatch.setenv( 'path_store', path_store )
+    monkeypatch.setenv( 'workers', '1' )
+
+    import rossmann_asgi
+    module = importlib.reload( rossmann_asgi )
+    yield module
+
+    if module.pool is not None:
+        module.pool.shutdown( wait=True )
+
+def post( app, path, body, headers=() ):
+    # -> ( status, json body )
+    messages = []
+
+    async def receive():
+        return { 'type': 'http.request', 'body': body, 'more_body': False }
+
+    async def send( message ):
+        messages.append( message )
+
+    scope = { 'type': 'http', 'path': path, 'method': 'POST', 'query_string': b'',
+              'headers': [ ( b'content-type', b'application/json' ) ] + [ ( k.encode(), v.encode() ) for k, v in headers ] }
+    asyncio.run( app( scope, receive, send ) )
+
+    return messages[0]['status'], json.loads( messages[1]['body'] )
+
+def test_invalid_gzip_body_is_a_bad_request( asgi ):
+    for path in [ '/rossmann/predict', '/rossmann/forecast' ]:
+        status, response = post( asgi.app, path, b'not gzip', headers=[ ( 'content-encoding', 'gzip' ) ] )
+        assert status == 400
+        assert 'gzip' in response['error']
+
+def test_gzip_body( asgi, test_data ):
+    body = gzip.compress( test_data.head( 5 ).to_json( orient='records' ).encode() )
+    status, response = post( asgi.app, '/rossmann/predict', body, headers=[ ( 'content-encoding', 'gzip' ) ] )
+    assert status == 200
+    assert len( response ) == 5
+
+def test_closed_stores_and_unseen_labels( asgi, test_data ):
+    df = test_data.head( 10 ).copy()
+    df.loc[[1, 2], 'open'] = 0
+
+    status, response = post( asgi.app, '/rossmann/predict', df.to_json( orient='records' ).encode() )
+    assert status == 200
+    assert pd.DataFrame( response )['sales_predictions'].isna().tolist() == [ i in ( 1, 2 ) for i in range( 10 ) ]
+
+    df.loc[5, 'store_type'] = 'z'
+    status, response = post( asgi.app, '/rossmann/predict', df.to_json( orient='records' ).encode() )
+    assert status == 400
+    assert 'store_type' in response['error']
+
+def test_compact_payload_returns_the_request_columns( asgi, test_data ):
+    df = test_data[['store', 'date', 'promo', 'state_holiday', 'school_holiday']].head( 5 )
+
+    status, response = post( asgi.app, '/rossmann/predict', df.to_json( orient='records' ).encode() )
+    assert status == 200
+    assert pd.DataFrame( response ).columns.tolist() == df.columns.tolist() + ['sales_predictions']
+
+    status, response = post( asgi.app, '/rossmann/predict', b'[{"store": 1, "date": "2015-07-31"}]' )
+    assert status == 400
@@ -0,0 +1,25 @@
+# offline batch scoring: the store partitions scored by the worker processes give the predict_frame result
+import pandas as pd
+import numpy  as np
+
+import subprocess
+import sys
+
+from conftest import root, path_params, path_store
+
+def test_partitioned_run_equals_predict_frame( test_data, pipeline, model, path_model, tmp_path ):
+    # parquet in and out, closed stores included, 2 workers x 3 store partitions
+    df = test_data.head( 3000 )
+    df.to_parquet( tmp_path / 'input.parquet', index=False )
+
+    subprocess.run( [ sys.executable, 'rossmann_batch.py', str( tmp_path / 'input.parquet' ), '--output', str( tmp_path / 'output.parquet' ),
+                      '--workers', '2', '--partitions', '3', '--path-model', path_model, '--path-params', path_params, '--path-store', path_store ],
+                    cwd=root, check=True, capture_output=True )
+
+    df_pred  = pd.read_parquet( tmp_path / 'output.parquet' )
+    expected = pipeline.predict_frame( model, df.copy() )
+
+    assert df_pred.columns.tolist() == ['store', 'date', 'sales_predictions']
+    assert df_pred['store'].tolist() == expected['store'].tolist()
+    assert df_pred['date'].tolist() == expected['date'].tolist()
+    np.testing.assert_allclose( df_pred['sales_predictions'], expected['sales_predictions'], rtol=1e-6 )
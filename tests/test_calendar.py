@@ -0,0 +1,40 @@
+# calendar table ( build_calendar, cyclic_table ) against the per row isocalendar and np.sin / np.cos formulas
+import pandas as pd
+import numpy  as np
+import datetime
+
+def row_features( dates ):
+    rows = []
+    for date in dates:
+        week = datetime.date( date.year, date.month, date.day ).isocalendar().week
+        rows.append( { 'year': date.year, 'month': date.month, 'day': date.day, 'week_of_year': week,
+                       'year_week': str( date.year ) + '-' + str( week ),
+                       'month_sin': np.sin( date.month * ( 2 * np.pi/12 ) ), 'month_cos': np.cos( date.month * ( 2 * np.pi/12 ) ),
+                       'day_sin': np.sin( date.day * ( 2 * np.pi/30 ) ), 'day_cos': np.cos( date.day * ( 2 * np.pi/30 ) ),
+                       'week_of_year_sin': np.sin( week * ( 2 * np.pi/52 ) ), 'week_of_year_cos': np.cos( week * ( 2 * np.pi/52 ) ) } )
+
+    return pd.DataFrame( rows )
+
+def calendar_features( pipeline, dates ):
+    idx, calendar = pipeline.calendar_index( pd.Series( dates ) )
+
+    return pd.DataFrame( { col: calendar[col][idx] for col in row_features( dates[:1] ).columns } )
+
+def test_calendar_matches_row_formulas( pipeline ):
+    dates = pd.date_range( '2013-01-01', '2030-12-31', freq='D' )
+    pd.testing.assert_frame_equal( calendar_features( pipeline, dates ), row_features( dates ), check_exact=True, check_dtype=False )
+
+def test_calendar_rebuild( pipeline ):
+    # dates before and after the initial calendar: the calendar is rebuilt to cover them
+    start = pipeline.calendar['start']
+    dates = pd.DatetimeIndex( ['1990-12-31', '1992-01-01', '2015-07-31', '2040-12-31', '2041-01-01', '2032-12-27'] )
+
+    pd.testing.assert_frame_equal( calendar_features( pipeline, dates ), row_features( dates ), check_exact=True, check_dtype=False )
+    assert pipeline.calendar['start'] < start
+    assert len( pipeline.calendar['year'] ) == ( pd.Timestamp( '2041-01-01' ) - pd.Timestamp( '1990-12-31' ) ).days + 1
+
+def test_cyclic_table( pipeline ):
+    for period in [ 7, 12, 30, 52 ]:
+        sin, cos = pipeline.cyclic_table( range( 60 ), period )
+        assert sin.tolist() == [ np.sin( x * ( 2 * np.pi/period ) ) for x in range( 60 ) ]
+        assert cos.tolist() == [ np.cos( x * ( 2 * np.pi/period ) ) for x in range( 60 ) ]
@@ -0,0 +1,88 @@
+# feature store: the persisted features are the ones of the pipeline, scored as forecast scores the same grid
+import numpy  as np
+
+import shutil
+import json
+import os
+
+import pytest
+
+from api.rossmann.FeatureStore import FeatureStore
+from api.rossmann.Rossmann     import Rossmann
+
+from conftest import path_params, path_store
+
+stores = [1, 2, 5, 10]
+
+@pytest.fixture
+def feature_store( tmp_path, pipeline ):
+    # 10 days, chunks of 4 days: the last chunk is partial
+    return FeatureStore( str( tmp_path / 'features' ) ).build( pipeline, stores, '2015-08-01', '2015-08-10', chunk_days=4 )
+
+def test_slice_equals_data_preparation( feature_store, pipeline ):
+    keys, features = feature_store.slice( [2, 10], '2015-08-03', '2015-08-07' )
+
+    # every grid cell has features: open = 1 before the pipeline, closed days keep their open flag in keys
+    grid = pipeline.make_grid( [2, 10], '2015-08-03', '2015-08-07' )
+    assert keys['open'].tolist() == ( grid['open'] != 0 ).astype( int ).tolist()
+
+    grid['open'] = 1
+    expected = pipeline.data_preparation( pipeline.feature_engineering( pipeline.data_cleaning( pipeline.full_payload( grid ) ) ) )
+
+    assert features.columns.tolist() == list( pipeline.cols_selected )
+    np.testing.assert_array_equal( features.to_numpy(), expected[pipeline.cols_selected].to_numpy( dtype=np.float32 ) )
+    np.testing.assert_array_equal( keys['store'].to_numpy(), grid['store'].to_numpy() )
+    np.testing.assert_array_equal( keys['date'].to_numpy(), grid['date'].to_numpy().astype( 'datetime64[D]' ) )
+
+def test_predict_matches_forecast( feature_store, pipeline, model ):
+    df_pred       = feature_store.predict( model, stores, '2015-08-01', '2015-08-10' )
+    daily, weekly = pipeline.forecast( model, stores, '2015-08-01', '2015-08-10' )
+
+    opened = df_pred['open'].to_numpy() != 0
+    assert opened.tolist() == ( daily['open'] != 0 ).tolist()
+    assert df_pred['sales_predictions'][~opened].isna().all()
+    np.testing.assert_allclose( df_pred['sales_predictions'][opened], daily['sales_predictions'][opened], rtol=1e-6 )
+
+    # predict_frame of the same store-days
+    grid = pipeline.predict_frame( model, pipeline.make_grid( stores, '2015-08-01', '2015-08-10' ) )
+    np.testing.assert_allclose( df_pred['sales_predictions'], grid['sales_predictions'], rtol=1e-6 )
+
+def test_check_rejects_other_parameters( feature_store, pipeline, tmp_path ):
+    feature_store.check( pipeline )
+
+    # store file with other content
+    other_store = str( tmp_path / 'store.csv' )
+    shutil.copy( path_store, other_store )
+    with open( other_store, 'a' ) as f:
+        f.write( '\n' )
+
+    with pytest.raises( ValueError, match='store.csv' ):
+        feature_store.check( Rossmann( path_params, other_store ) )
+
+    # built with another scaler file
+    manifest = os.path.join( feature_store.path, 'manifest.json' )
+    with open( manifest ) as f:
+        content = json.load( f )
+
+    content['parameters']['year_scaler.pkl'] = '0' * 64
+    with open( manifest, 'w' ) as f:
+        json.dump( content, f )
+
+    with pytest.raises( ValueError, match='year_scaler.pkl' ):
+        FeatureStore( feature_store.path ).check( pipeline )
+
+def test_out_of_range_dates_and_unknown_stores( feature_store ):
+    with pytest.raises( ValueError, match='dates out of the feature store range' ):
+        feature_store.slice( [1], '2015-07-31', '2015-08-02' )
+
+    with pytest.raises( ValueError, match='dates out of the feature store range' ):
+        feature_store.slice( [1], '2015-08-09', '2015-08-11' )
+
+    with pytest.raises( ValueError, match='dates out of the feature store range' ):
+        feature_store.slice( [1], '2015-08-05', '2015-08-04' )
+
+    with pytest.raises( ValueError, match='stores not in the feature store' ):
+        feature_store.slice( [1, 3], '2015-08-01', '2015-08-02' )
+
+    with pytest.raises( ValueError, match='stores not in the feature store' ):
+        feature_store.slice( [99999] )
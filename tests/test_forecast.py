@@ -0,0 +1,21 @@
+# store x date grids of the forecast
+import pandas as pd
+
+def test_stores_are_closed_on_sundays_by_default( pipeline ):
+    grid = pipeline.make_grid( [1, 2, 3], '2015-08-01', '2015-08-14' )
+
+    sunday = grid['date'].dt.dayofweek.to_numpy() == 6
+    assert ( grid['open'].to_numpy()[sunday] == 0 ).all()
+    assert ( grid['open'].to_numpy()[~sunday] == 1 ).all()
+
+def test_calendar_opens_a_store_on_sunday( pipeline, model ):
+    calendars = pd.DataFrame( { 'store': [2], 'date': ['2015-08-02'], 'open': [1] } )
+    daily, weekly = pipeline.forecast( model, [1, 2], '2015-08-01', '2015-08-09', calendars )
+
+    sunday = daily[daily['date'].isin( ['2015-08-02', '2015-08-09'] )].set_index( ['store', 'date'] )
+    assert sunday['open'].to_dict() == { ( 1, '2015-08-02' ): 0, ( 2, '2015-08-02' ): 1, ( 1, '2015-08-09' ): 0, ( 2, '2015-08-09' ): 0 }
+    assert sunday.loc[( 2, '2015-08-02' ), 'sales_predictions'] > 0
+    assert sunday.loc[( 1, '2015-08-02' ), 'sales_predictions'] == 0
+
+    # week of 2015-07-27: saturday and sunday in the range, then a whole week
+    assert weekly['open_days'].tolist() == [ 1, 6, 2, 6 ]
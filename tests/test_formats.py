@@ -0,0 +1,25 @@
+# request and response formats of read_data / write_data
+import pandas as pd
+import numpy  as np
+import io
+
+import pytest
+
+def test_npz_keeps_missing_text_values( pipeline, test_data ):
+    df = test_data.head( 30 ).copy()
+    df['assortment'] = pd.Categorical( df['assortment'] )
+    assert df['promo_interval'].isna().any()
+
+    body = pipeline.write_data( df, orient='npz' )
+    with np.load( io.BytesIO( body ), allow_pickle=False ) as npz:
+        assert 'nan' not in npz['promo_interval'].tolist()
+
+    back = pipeline.read_data( body, 'application/x-npz' )
+    pd.testing.assert_series_equal( back['promo_interval'], df['promo_interval'].astype( object ) )
+    assert back['assortment'].tolist() == df['assortment'].tolist()
+    assert back.columns.tolist() == df.columns.tolist()
+
+@pytest.mark.parametrize( 'body', [ b'PK\x03\x04corrupt', b'not an archive', b'' ] )
+def test_invalid_npz_body( pipeline, body ):
+    with pytest.raises( ValueError ):
+        pipeline.read_data( body, 'application/x-npz' )
@@ -0,0 +1,160 @@
+# rossmann_handler.py routes through the flask test client, with the small model of conftest.py
+import pandas as pd
+import numpy  as np
+import inflection
+import importlib
+import signal
+import json
+import time
+import os
+
+import pytest
+
+from conftest import path_params, path_store
+
+handler_env = ['path_warm_up', 'inference_backend', 'low_memory', 'cache_max_mb', 'batch_window_ms', 'metrics', 'gzip_min_bytes']
+
+@pytest.fixture
+def handler( path_model, monkeypatch ):
+    # rossmann_handler reloaded with the given environment ( it reads it at import )
+    def load( **env ):
+        for name in handler_env:
+            monkeypatch.delenv( name, raising=False )
+
+        monkeypatch.setenv( 'path_model', path_model )
+        monkeypatch.setenv( 'path_params', path_params )
+        monkeypatch.setenv( 'path_store', path_store )
+        for name, value in env.items():
+            monkeypatch.setenv( name, value )
+
+        import rossmann_handler
+        return importlib.reload( rossmann_handler )
+
+    return load
+
+def compact_rows( test_data, rows=8 ):
+    df = test_data[['store', 'date', 'promo', 'state_holiday', 'school_holiday', 'open']].head( rows ).copy()
+    df['open'] = [0, 1] * ( rows // 2 )
+
+    return df
+
+def test_compact_payload_with_closed_stores( handler, test_data ):
+    client = handler().app.test_client()
+    df     = compact_rows( test_data )
+
+    response = client.post( '/rossmann/predict', json=df.to_dict( orient='records' ) )
+    assert response.status_code == 200
+
+    pred = pd.DataFrame( response.get_json() )['sales_predictions']
+    assert pred[df['open'].to_numpy() == 0].isna().all()
+    assert pred[df['open'].to_numpy() == 1].notna().all()
+
+def test_get_prediction_aligns_by_index( pipeline, model, test_data ):
+    df = test_data.head( 10 ).copy()
+    df.loc[[2, 5, 6], 'open'] = 0
+
+    expected = pipeline.predict_frame( model, df.copy() )['sales_predictions']
+    df_test  = pipeline.data_preparation( pipeline.feature_engineering( pipeline.data_cleaning( df.copy() ) ) )
+    response = pd.DataFrame( json.loads( pipeline.get_prediction( model, df, df_test ) ) )
+
+    # json keeps 10 significant digits
+    np.testing.assert_allclose( response['sales_predictions'].to_numpy( dtype=np.float64 ), expected.to_numpy(), rtol=1e-9 )
+    assert response['sales_predictions'].isna().sum() == 3
+
+def predict_payloads( client, test_data ):
+    # responses of a full payload, of a full payload with the kaggle column names and of a compact payload
+    full = test_data.head( 20 ).copy()
+    full.loc[[3, 4], 'open'] = 0
+    raw  = full.set_axis( [ inflection.camelize( col ) for col in full.columns ], axis=1 )
+
+    responses = []
+    for df in [ full, raw, compact_rows( test_data ) ]:
+        response = client.post( '/rossmann/predict', data=df.to_json( orient='records' ), content_type='application/json' )
+        assert response.status_code == 200
+        responses.append( ( df, pd.DataFrame( response.get_json() ) ) )
+
+    return responses
+
+@pytest.mark.parametrize( 'env', [ { 'low_memory': '1' }, { 'cache_max_mb': '8' }, { 'batch_window_ms': '2' } ], ids=['low_memory', 'cache', 'batching'] )
+def test_response_columns_do_not_depend_on_the_mode( handler, env, test_data ):
+    # the request columns plus sales_predictions, whatever the deployment flags
+    expected  = predict_payloads( handler().app.test_client(), test_data )
+    responses = predict_payloads( handler( **env ).app.test_client(), test_data )
+
+    # exactly the request columns, compact payloads included ( no joined store attributes )
+    for ( df, baseline ), ( _, response ) in zip( expected, responses ):
+        assert baseline.columns.tolist() == df.columns.tolist() + ['sales_predictions']
+        pd.testing.assert_frame_equal( response, baseline )
+
+@pytest.mark.parametrize( 'env', [ {}, { 'low_memory': '1' }, { 'cache_max_mb': '8' }, { 'batch_window_ms': '2' } ], ids=['default', 'low_memory', 'cache', 'batching'] )
+def test_unseen_store_type_is_a_bad_request( handler, env, test_data ):
+    client = handler( **env ).app.test_client()
+    df     = test_data.head( 5 ).copy()
+    df.loc[2, 'store_type'] = 'z'
+
+    response = client.post( '/rossmann/predict', data=df.to_json( orient='records' ), content_type='application/json' )
+    assert response.status_code == 400
+    assert 'store_type' in response.get_json()['error']
+
+@pytest.mark.skipif( not hasattr( signal, 'SIGHUP' ), reason='no SIGHUP' )
+def test_sighup_reload_does_not_deadlock( handler ):
+    # SIGHUP arriving while the main thread holds the registry lock: the reload waits for it in another thread
+    module  = handler()
+    version = module.registry.version
+
+    with module.registry.lock:
+        os.kill( os.getpid(), signal.SIGHUP )
+        time.sleep( 0.2 )
+
+    deadline = time.monotonic() + 10
+    while module.registry.version == version and time.monotonic() < deadline:
+        time.sleep( 0.05 )
+
+    assert module.registry.version == version + 1
+
+def test_startup_reports_the_loading_process( handler ):
+    module   = handler()
+    response = module.app.test_client().get( '/rossmann/startup' ).get_json()
+
+    assert response['pid'] == os.getpid() == response['worker_pid']
+    assert response['total'] >= response['imports']
+
+def test_reload_between_cache_get_and_put( handler, test_data ):
+    # a request with the parameters of before the reload does not leave its predictions in the cache
+    module = handler( cache_max_mb='8' )
+    params = module.registry.get()
+    df     = params['pipeline'].full_payload( test_data.head( 10 ) )
+
+    module.reload_params()
+    module.predict_rows( params['pipeline'], params['model'], df, version=params['version'] )
+    assert module.cache.stats()['entries'] == 0
+
+    current = module.registry.get()
+    module.predict_rows( current['pipeline'], current['model'], df, version=current['version'] )
+    assert module.cache.stats()['entries'] == 10
+
+@pytest.mark.parametrize( 'env', [ {}, { 'low_memory': '1' } ], ids=['default', 'low_memory'] )
+def test_compact_payload_without_required_columns( handler, env ):
+    client   = handler( **env ).app.test_client()
+    response = client.post( '/rossmann/predict', json=[ { 'store': 1, 'date': '2015-07-31' } ] )
+
+    assert response.status_code == 400
+    assert 'promo' in response.get_json()['error']
+
+def test_stage_names_and_rows_of_chunked_requests( handler, test_data ):
+    client = handler( metrics='1' ).app.test_client()
+    df     = test_data.head( 25 )
+
+    # full payloads are copied, compact payloads joined with the store table
+    full    = client.post( '/rossmann/predict', json=df.to_dict( orient='records' ), headers={ 'X-Rossmann-Timing': '1' } )
+    compact = client.post( '/rossmann/predict', json=compact_rows( test_data ).to_dict( orient='records' ), headers={ 'X-Rossmann-Timing': '1' } )
+    assert 'full_payload;' in full.headers['Server-Timing'] and 'join_store' not in full.headers['Server-Timing']
+    assert 'join_store;' in compact.headers['Server-Timing'] and 'full_payload' not in compact.headers['Server-Timing']
+
+    # chunked request of 25 rows in chunks of 10: the rows are observed once the stream ends
+    response = client.post( '/rossmann/predict?chunksize=10', data=df.to_csv( index=False ), headers={ 'Content-type': 'text/csv' } )
+    assert len( response.get_data( as_text=True ).splitlines() ) == 25
+
+    metrics = client.get( '/metrics' ).get_data( as_text=True )
+    assert 'rossmann_request_rows_count 3' in metrics
+    assert 'rossmann_request_rows_sum {}'.format( 25 + 8 + 25 ) in metrics
@@ -0,0 +1,75 @@
+# micro-batcher: requests collected by the window or up to max_rows are predicted together, a failed batch is
+# predicted again one request at a time
+import pandas as pd
+import numpy  as np
+
+import threading
+import time
+
+from api.rossmann.MicroBatcher import MicroBatcher
+
+def fake_predict( calls ):
+    # sales_predictions = store * 10, negative stores fail the whole call
+    def predict( df ):
+        calls.append( len( df ) )
+        if ( df['store'] < 0 ).any():
+            raise ValueError( 'negative store' )
+
+        return df.assign( sales_predictions=df['store'] * 10.0 )
+
+    return predict
+
+def submit_all( batcher, stores ):
+    # one thread per request ( one row each ), started together -> { store: result or exception }
+    results = {}
+    barrier = threading.Barrier( len( stores ) )
+
+    def submit( store ):
+        barrier.wait()
+        try:
+            results[store] = batcher.submit( pd.DataFrame( { 'store': [store] } ) )
+
+        except ValueError as e:
+            results[store] = e
+
+    threads = [ threading.Thread( target=submit, args=( store, ) ) for store in stores ]
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join( 30 )
+
+    return results
+
+def test_window_collects_concurrent_requests():
+    calls   = []
+    batcher = MicroBatcher( fake_predict( calls ), max_wait=0.5, max_rows=1000 )
+
+    results = submit_all( batcher, [1, 2, 3, 4] )
+
+    assert calls == [4]
+    for store in [1, 2, 3, 4]:
+        np.testing.assert_array_equal( results[store], [store * 10.0] )
+
+def test_max_rows_flushes_before_the_window():
+    calls   = []
+    batcher = MicroBatcher( fake_predict( calls ), max_wait=60, max_rows=3 )
+
+    start   = time.perf_counter()
+    results = submit_all( batcher, [1, 2, 3] )
+
+    assert time.perf_counter() - start < 30
+    assert calls == [3]
+    assert sorted( results ) == [1, 2, 3]
+
+def test_failed_batch_is_retried_per_request():
+    calls   = []
+    batcher = MicroBatcher( fake_predict( calls ), max_wait=0.5, max_rows=1000 )
+
+    results = submit_all( batcher, [1, -1, 3] )
+
+    # the batch fails, then each request alone: only the bad one gets the error
+    assert calls == [3, 1, 1, 1]
+    assert isinstance( results[-1], ValueError )
+    np.testing.assert_array_equal( results[1], [10.0] )
+    np.testing.assert_array_equal( results[3], [30.0] )
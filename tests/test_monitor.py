@@ -0,0 +1,40 @@
+# baseline models of rossmann_monitor.py: one prediction per row of the predictions frame
+import pandas as pd
+import numpy  as np
+
+import pytest
+
+import rossmann_monitor
+
+@pytest.fixture
+def predictions( sales_data ):
+    # monitor rows ( open stores ) with the columns of apply_model, plus store-dates repeated
+    df = sales_data[sales_data['open'] != 0][['store', 'date', 'sales']].head( 3000 )
+    df = pd.concat( [ df, df.iloc[::7], df.iloc[::7].assign( sales=lambda x: x['sales'] + 100 ) ], ignore_index=True )
+
+    return df.assign( sales_predictions=df['sales'] * 1.1, absolute_error=df['sales'] * 0.1 )
+
+def test_baseline_errors_have_one_value_per_row( predictions, sales_data ):
+    assert predictions.duplicated( ['store', 'date'] ).any()
+
+    errors = rossmann_monitor.baseline_errors( predictions, sales_data )
+    assert set( errors ) == set( rossmann_monitor.baseline_models )
+    for name, values in errors.items():
+        assert len( values ) == len( predictions ), name
+
+    # duplicated store-dates: the store date average of the group
+    group = predictions.groupby( ['store', 'date'] )['sales'].transform( 'mean' ).to_numpy()
+    np.testing.assert_allclose( errors['Store Date Average'], np.abs( predictions['sales'].to_numpy() - group ) )
+
+def test_baseline_aggregates_count_every_row( predictions, sales_data ):
+    aggregates = rossmann_monitor.build_aggregates( predictions, sales_data )
+
+    for name, ( errors, count ) in aggregates['models'].items():
+        assert count.sum() == len( predictions ), name
+        assert len( errors ) == len( aggregates['stores'] ), name
+
+def test_baseline_with_a_wrong_length_is_an_error( predictions, sales_data, monkeypatch ):
+    monkeypatch.setitem( rossmann_monitor.baseline_models, 'Broken', lambda df, df_original: df['sales'].groupby( df['store'] ).mean() )
+
+    with pytest.raises( ValueError, match='Broken' ):
+        rossmann_monitor.baseline_errors( predictions, sales_data )
@@ -0,0 +1,47 @@
+# keys of the prediction cache: the same rows give the same keys whatever the dtypes of the payload
+import pandas as pd
+import numpy  as np
+
+from api.rossmann.PredictionCache import PredictionCache
+from api.rossmann.Rossmann        import Rossmann
+
+def test_keys_do_not_depend_on_the_dtypes( test_data ):
+    cache = PredictionCache( [ col for col in Rossmann.input_columns if col != 'customers' ] )
+    df    = test_data.head( 50 ).copy()
+    df.loc[[3, 7], 'state_holiday'] = 'a'
+
+    text = df.assign( state_holiday=df['state_holiday'].astype( str ), date=pd.to_datetime( df['date'] ) )
+    floats = df.assign( store=df['store'].astype( float ), promo=df['promo'].astype( float ) )
+
+    keys = cache.keys( df )
+    np.testing.assert_array_equal( cache.keys( text ), keys )
+    np.testing.assert_array_equal( cache.keys( floats ), keys )
+
+    # regular days: integer, float and text zeros
+    for value in [ 0, 0.0, '0' ]:
+        regular = df.assign( state_holiday=value )
+        np.testing.assert_array_equal( cache.keys( regular ), cache.keys( df.assign( state_holiday=0 ) ) )
+
+    assert len( set( keys ) ) == len( df )
+    assert cache.keys( df.assign( state_holiday='b' ) )[0] != keys[0]
+
+def test_writes_of_an_older_version_are_dropped( test_data ):
+    # a request takes version 1, the reload clears the cache to version 2 before the request writes its predictions
+    cache = PredictionCache( [ col for col in Rossmann.input_columns if col != 'customers' ], version=1 )
+    keys  = cache.keys( test_data.head( 20 ) )
+
+    pred, hit = cache.get( keys, version=1 )
+    assert not hit.any()
+
+    cache.clear( 2 )
+    cache.put( keys, np.arange( 20.0 ), version=1 )
+    assert cache.stats()['entries'] == 0
+
+    cache.put( keys, np.arange( 20.0 ), version=2 )
+    pred, hit = cache.get( keys, version=2 )
+    assert hit.all()
+    np.testing.assert_array_equal( pred, np.arange( 20.0 ) )
+
+    # a request still holding version 1 does not get the predictions of version 2
+    pred, hit = cache.get( keys, version=1 )
+    assert not hit.any()
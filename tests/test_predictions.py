@@ -0,0 +1,24 @@
+# predictions of one row at a time against the predictions of the whole batch
+import pandas as pd
+import numpy  as np
+
+import pytest
+
+@pytest.mark.parametrize( 'low_memory', [False, True], ids=['default', 'low_memory'] )
+def test_single_row_and_batch_predictions_agree( pipeline, lean_pipeline, model, test_data, low_memory ):
+    pipeline = lean_pipeline if low_memory else pipeline
+    df       = test_data.sample( 200, random_state=0 )
+
+    batch  = pipeline.predict_frame( model, df.copy() )['sales_predictions']
+    single = pd.concat( [ pipeline.predict_frame( model, df.iloc[[i]].copy() )['sales_predictions'] for i in range( len( df ) ) ] )
+
+    assert batch.isna().sum() == ( df['open'] == 0 ).sum()
+    pd.testing.assert_series_equal( single, batch )
+
+def test_compact_and_full_payload_predictions_agree( pipeline, model, test_data ):
+    df      = test_data.sample( 200, random_state=1 )
+    compact = df[['store', 'date', 'promo', 'state_holiday', 'school_holiday', 'open']]
+
+    full    = pipeline.predict_frame( model, df.copy() )['sales_predictions']
+    joined  = pipeline.predict_frame( model, compact.copy() )['sales_predictions']
+    np.testing.assert_array_equal( joined.to_numpy(), full.to_numpy() )
@@ -0,0 +1,34 @@
+# chunked prediction: generated csv files streamed through predict_chunks, the peak memory does not grow with the file
+import numpy  as np
+import json
+import io
+import os
+
+import rossmann_benchmark
+
+from conftest import path_params, path_store
+
+def test_peak_rss_does_not_grow_with_the_file( path_model, test_data, tmp_path ):
+    # ru_maxrss of a new process: native allocations ( csv parser, xgboost DMatrix and predictor buffers ) included
+    env   = dict( os.environ, path_model=path_model, path_params=path_params, path_store=path_store )
+    small = rossmann_benchmark.write_stream_csv( test_data, 20000, str( tmp_path / 'small.csv' ) )
+    large = rossmann_benchmark.write_stream_csv( test_data, 300000, str( tmp_path / 'large.csv' ) )
+
+    rss_small = rossmann_benchmark.stream_rss( small, 5000, env )
+    rss_large = rossmann_benchmark.stream_rss( large, 5000, env )
+
+    assert ( rss_small['rows'], rss_large['rows'] ) == ( 20000, 300000 )
+    assert rss_large['peak_rss_mb'] < rss_small['peak_rss_mb'] + 16
+    assert rss_large['stream_rss_mb'] < 64
+
+def test_chunks_match_one_batch( pipeline, model, test_data ):
+    df     = test_data.head( 12345 )
+    chunks = pipeline.read_chunks( io.StringIO( df.to_csv( index=False ) ), 'text/csv', 1000 )
+    text   = ''.join( pipeline.write_chunks( pipeline.predict_chunks( model, chunks ), columns=['store', 'date', 'sales_predictions'] ) )
+
+    lines = text.split( '\n' )
+    assert len( lines ) == len( df ) + 1 and lines[-1] == ''
+
+    pred     = np.array( [ json.loads( line )['sales_predictions'] for line in lines[:-1] ], dtype=np.float64 )
+    expected = pipeline.predict_frame( model, df.copy() )['sales_predictions'].to_numpy()
+    np.testing.assert_allclose( pred, expected, rtol=1e-9 )
@@ -0,0 +1,40 @@
+# TreeEnsemble ( NumPy traversal ) against xgboost predictions
+import pandas as pd
+import numpy  as np
+
+import xgboost as xgb
+
+from api.rossmann.TreeEnsemble import TreeEnsemble
+
+def tiny_data( rows, seed ):
+    # features with missing values, the target depends on them
+    rng = np.random.default_rng( seed )
+    X   = pd.DataFrame( rng.normal( size=( rows, 6 ) ), columns=[ 'x{}'.format( i ) for i in range( 6 ) ] ).astype( np.float32 )
+    y   = 2 * X['x0'].fillna( 0 ) - X['x1'].fillna( 1 ) ** 2 + np.sin( 3 * X['x2'] ) + rng.normal( scale=0.1, size=rows )
+
+    X = X.mask( rng.random( X.shape ) < 0.15 )
+
+    return X, y.to_numpy()
+
+def test_early_stopped_model_with_missing_values( tmp_path ):
+    X, y = tiny_data( 2000, seed=0 )
+    X_valid, y_valid = tiny_data( 500, seed=1 )
+
+    model = xgb.XGBRegressor( n_estimators=300, max_depth=4, learning_rate=0.3, early_stopping_rounds=5, n_jobs=1 )
+    model.fit( X, y, eval_set=[ ( X_valid, y_valid ) ], verbose=False )
+    assert model.best_iteration < 299
+
+    X_test, _ = tiny_data( 3000, seed=2 )
+    expected  = model.predict( X_test )
+    ensemble  = TreeEnsemble( model )
+    np.testing.assert_allclose( ensemble.predict( X_test ), expected, rtol=0, atol=1e-5 )
+
+    # columns selected by name, saved and loaded without pickle
+    ensemble.save( tmp_path / 'model.npz' )
+    loaded = TreeEnsemble( path=str( tmp_path / 'model.npz' ) )
+    np.testing.assert_array_equal( loaded.predict( X_test[X_test.columns[::-1]] ), ensemble.predict( X_test ) )
+
+def test_rossmann_model( pipeline, model, test_data ):
+    X = pipeline.data_preparation( pipeline.feature_engineering( pipeline.data_cleaning( test_data.copy() ) ) )
+
+    np.testing.assert_allclose( TreeEnsemble( model ).predict( X ), model.predict( X ), rtol=0, atol=1e-5 )
@@ -0,0 +1,131 @@
+# vectorized data_cleaning / feature_engineering / data_preparation against the original row-wise formulas
+import pandas as pd
+import numpy  as np
+import datetime
+import inflection
+import math
+
+import pytest
+
+# original row-wise pipeline ( the scalers are applied with transform, inference never refits them )
+def row_wise_cleaning( df ):
+    cols_old = ['Store', 'DayOfWeek', 'Date', 'Customers', 'Open', 'Promo', 'StateHoliday', 'SchoolHoliday', 'StoreType', 'Assortment', 'CompetitionDistance',
+                'CompetitionOpenSinceMonth', 'CompetitionOpenSinceYear', 'Promo2', 'Promo2SinceWeek', 'Promo2SinceYear', 'PromoInterval']
+    df.columns = list( map( inflection.underscore, cols_old ) )
+
+    df['date'] = pd.to_datetime( df['date'] )
+    df['competition_distance'] = df['competition_distance'].apply( lambda x: 200000 if math.isnan( x ) else x )
+
+    df['competition_open_since_month'] = df.apply( lambda x: x['date'].month if math.isnan( x['competition_open_since_month'] ) else x['competition_open_since_month'], axis=1 )
+    df['competition_open_since_year']  = df.apply( lambda x: x['date'].year if math.isnan( x['competition_open_since_year'] )   else x['competition_open_since_year'], axis=1 )
+    df['promo2_since_week'] = df.apply( lambda x: x['date'].week if math.isnan( x['promo2_since_week'] ) else x['promo2_since_week'], axis=1 )
+    df['promo2_since_year'] = df.apply( lambda x: x['date'].year if math.isnan( x['promo2_since_year'] ) else x['promo2_since_year'], axis=1 )
+
+    month_map = { 1: 'Jan', 2: 'Feb', 3: 'Mar', 4: 'Apr', 5: 'May', 6: 'Jun', 7: 'Jul', 8: 'Aug', 9: 'Sep', 10: 'Oct', 11: 'Nov', 12: 'Dec' }
+    df['promo_interval'] = df['promo_interval'].fillna( 0 )
+    df['month_map'] = df['date'].dt.month.map( month_map )
+    df['is_promo'] = df[['promo_interval', 'month_map']].apply( lambda x: 0 if x['promo_interval'] == 0 else 1 if x['month_map'] in x['promo_interval'].split( ',' ) else 0, axis=1 )
+
+    df['competition_open_since_month'] = df['competition_open_since_month'].astype( int )
+    df['competition_open_since_year'] = df['competition_open_since_year'].astype( int )
+    df['promo2_since_week'] = df['promo2_since_week'].astype( int )
+    df['promo2_since_year'] = df['promo2_since_year'].astype( int )
+
+    return df
+
+def row_wise_features( df ):
+    df['year']  = df['date'].dt.year
+    df['month'] = df['date'].dt.month
+    df['day']   = df['date'].dt.day
+    df['week_of_year'] = df.apply( lambda x: datetime.date( x['year'], x['month'], x['day'] ).isocalendar().week, axis=1 )
+    df['year_week']    = df.apply( lambda x: str( x['year'] ) + '-' + str( x['week_of_year'] ), axis=1 )
+
+    df['competition_since']      = df.apply( lambda x: datetime.datetime( year=x['competition_open_since_year'], month=x['competition_open_since_month'], day=1 ), axis=1 )
+    df['competition_time_month'] = df.apply( lambda x: ( ( x['date'] - x['competition_since'] ) / 30 ).days, axis=1 ).astype( int )
+
+    df['promo2_since']     = df['promo2_since_year'].astype( str ) + '-' + df['promo2_since_week'].astype( str )
+    df['promo2_since']     = df['promo2_since'].apply( lambda x: datetime.datetime.strptime( x +'-1', '%Y-%W-%w' ) - datetime.timedelta( days=7 ) )
+    df['promo2_time_week'] = df.apply( lambda x: ( ( x['date'] - x['promo2_since'] ) / 7 ).days, axis=1 ).astype( int )
+
+    df['assortment']    = df['assortment'].apply( lambda x: 'basic' if x == 'a' else 'extra' if x =='b' else 'extended' )
+    df['state_holiday'] = df['state_holiday'].apply( lambda x: 'public holiday' if x == 'a' else 'easter holiday' if x == 'b' else 'christmas' if x == 'c' else 'regular day' )
+
+    df = df[ ( df['open'] != 0 ) ]
+
+    return df.drop( ['customers', 'open', 'promo_interval', 'month_map'], axis=1 )
+
+def row_wise_preparation( pipeline, df ):
+    df['promo2_time_week']       = pipeline.promo2_time_week_scaler.transform( df[['promo2_time_week']].values )
+    df['competition_distance']   = pipeline.competition_distance_scaler.transform( df[['competition_distance']].values )
+    df['competition_time_month'] = pipeline.competition_time_month_scaler.transform( df[['competition_time_month']].values )
+    df['year']                   = pipeline.year_scaler.transform( df[['year']].values )
+    df['store_type']             = pipeline.store_type_scaler.transform( df['store_type'] )
+
+    df = pd.get_dummies( df, prefix=['state_holiday'], columns=['state_holiday'] )
+    df['assortment'] = df['assortment'].map( { 'basic' : 1, 'extra' : 2, 'extended' : 3 } )
+
+    for col, period in [ ( 'month', 12 ), ( 'day_of_week', 7 ), ( 'day', 30 ), ( 'week_of_year', 52 ) ]:
+        df[col + '_sin'] = df[col].apply( lambda x: np.sin( x * ( 2 * np.pi/period ) ) )
+        df[col + '_cos'] = df[col].apply( lambda x: np.cos( x * ( 2 * np.pi/period ) ) )
+
+    return df[pipeline.cols_selected]
+
+def edge_rows( test_data, rows=5000, seed=0 ):
+    # test.csv rows with dates between 1990 and 2030, promo2 since weeks 0-53 ( %W ), holidays and promo intervals
+    rng = np.random.default_rng( seed )
+    df  = test_data.sample( rows, replace=True, random_state=seed ).reset_index( drop=True )
+
+    df['date'] = ( pd.Timestamp( '1990-01-01' ) + pd.to_timedelta( rng.integers( 0, 14975, rows ), unit='D' ) ).strftime( '%Y-%m-%d' )
+
+    promo2 = df['promo2'] == 1
+    df.loc[promo2, 'promo2_since_week'] = rng.integers( 0, 54, promo2.sum() ).astype( float )
+    df.loc[promo2, 'promo2_since_year'] = rng.integers( 1990, 2031, promo2.sum() ).astype( float )
+
+    # year ends and starts: iso weeks 52, 53 and 1
+    df.loc[:199, 'date'] = pd.date_range( '1990-12-20', periods=200, freq='73D' ).strftime( '%Y-%m-%d' )
+    df['day_of_week'] = pd.to_datetime( df['date'] ).dt.dayofweek + 1
+
+    df['state_holiday'] = df['state_holiday'].astype( str )
+    df.loc[df.index % 13 == 0, 'state_holiday'] = 'a'
+    df.loc[df.index % 17 == 0, 'state_holiday'] = 'c'
+    df.loc[df.index % 19 == 0, 'state_holiday'] = 'b'
+    df.loc[df.index % 5 == 0, 'promo_interval'] = 'Feb,May,Aug,Nov'
+    df.loc[df.index % 23 == 0, 'competition_distance'] = np.nan
+
+    return df
+
+@pytest.fixture( params=['test.csv', 'edge dates'] )
+def payload( request, test_data ):
+    return test_data.copy() if request.param == 'test.csv' else edge_rows( test_data )
+
+def test_cleaning_and_features_match_row_wise( pipeline, payload ):
+    expected = row_wise_cleaning( payload.copy() )
+    cleaned  = pipeline.data_cleaning( payload.copy() )
+    pd.testing.assert_frame_equal( cleaned, expected, check_exact=True )
+
+    expected = row_wise_features( expected )
+    features = pipeline.feature_engineering( cleaned )
+    pd.testing.assert_frame_equal( features, expected, check_exact=True )
+
+    expected = row_wise_preparation( pipeline, expected.copy() )
+    prepared = pipeline.data_preparation( features.copy() )
+    pd.testing.assert_frame_equal( prepared, expected, check_exact=True )
+
+def test_lean_features_match_data_preparation( pipeline, lean_pipeline, payload ):
+    expected = pipeline.data_preparation( pipeline.feature_engineering( pipeline.data_cleaning( payload.copy() ) ) )
+    lean     = lean_pipeline.lean_features( payload )
+
+    pd.testing.assert_frame_equal( lean, expected.astype( np.float32 ), check_exact=True )
+
+def test_promo2_since_matches_strptime( pipeline, test_data ):
+    # every promo2_since_year 1990-2030 x promo2_since_week 0-53
+    years, weeks = np.meshgrid( np.arange( 1990, 2031 ), np.arange( 0, 54 ) )
+    df = test_data[test_data['promo2'] == 1].iloc[[0] * years.size].reset_index( drop=True )
+    df['promo2_since_year'] = years.ravel().astype( float )
+    df['promo2_since_week'] = weeks.ravel().astype( float )
+
+    features = pipeline.feature_engineering( pipeline.data_cleaning( df ) )
+    expected = [ datetime.datetime.strptime( '{}-{}-1'.format( y, w ), '%Y-%W-%w' ) - datetime.timedelta( days=7 )
+                 for y, w in zip( years.ravel(), weeks.ravel() ) ]
+
+    assert features['promo2_since'].tolist() == expected